@@ -5,6 +5,8 @@ from typing import List, Dict, Any, Optional
 
 from .search_engine import BrainSearchEngine
 from .formatters import BrainResponseFormatter
+from deadline import Deadline
+from query_analysis import QueryAnalysis
 
 class ALUBrainManager:
     """
@@ -43,9 +45,10 @@ class ALUBrainManager:
             except Exception as e:
                 print(f"Error loading {json_path}: {e}")
     
-    def search(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+    def search(self, query: str, top_k: int = 5, deadline: Optional[Deadline] = None,
+               analysis: Optional[QueryAnalysis] = None) -> List[Dict[str, Any]]:
         """Search in the knowledge base using the search engine"""
-        return self.search_engine.search(query, self.knowledge_base, top_k)
+        return self.search_engine.search(query, self.knowledge_base, top_k, deadline, analysis)
     
     def get_entry_by_id(self, entry_id: str) -> Optional[Dict[str, Any]]:
         """Retrieve a specific entry by its ID"""
@@ -3,12 +3,20 @@ from typing import List, Dict, Any, Optional
 import re
 import time
 
+from deadline import Deadline
+from knowledge_epoch import current_epoch, EPOCH_CACHE_TTL
+from query_analysis import QueryAnalysis
+from ttl_cache import TTLCache
+from shared_cache import get_shared_cache
+
 class BrainSearchEngine:
     """Handles search operations within the ALU Brain knowledge base"""
     
     def __init__(self):
-        self._search_cache = {}  # Cache to improve performance
-        self._cache_ttl = 300  # 5 minutes cache TTL
+        # Entries are keyed on the knowledge epoch, so the TTL only bounds staleness;
+        # the shared L2 lets other workers reuse what this one computed
+        self._search_cache = TTLCache("brain_search", max_entries=2048, max_bytes=32 * 1024 * 1024,
+                                      ttl=EPOCH_CACHE_TTL, l2=get_shared_cache())
         self._search_stats = {
             "total_searches": 0,
             "cache_hits": 0,
@@ -16,31 +24,45 @@ class BrainSearchEngine:
         }
         print("Enhanced BrainSearchEngine initialized with caching and advanced semantic matching")
     
-    def search(self, query: str, knowledge_base: Dict[str, Any], top_k: int = 5) -> List[Dict[str, Any]]:
+    def search(self, query: str, knowledge_base: Dict[str, Any], top_k: int = 5,
+               deadline: Optional[Deadline] = None,
+               analysis: Optional[QueryAnalysis] = None) -> List[Dict[str, Any]]:
         """
         Enhanced semantic search in the ALU Brain knowledge base
         Uses advanced multi-layered scoring system with contextual relevance
+
+        If the deadline passes mid-search, the categories scored so far are returned.
+        Pass the request's QueryAnalysis to avoid analysing the query again.
         """
         # Track statistics
         self._search_stats["total_searches"] += 1
         start_time = time.time()
         
+        if analysis is None:
+            analysis = QueryAnalysis(query)
+        
         # Check cache first
-        cache_key = f"{query}:{top_k}"
+        cache_key = f"{current_epoch()}:{analysis.key(top_k)}"
         cached_result = self._get_from_cache(cache_key)
         if cached_result:
             self._search_stats["cache_hits"] += 1
             return cached_result
         
         results = []
-        query_terms = self._preprocess_query(query)
+        query_terms = analysis.terms
         
         # Enhanced query classification
-        query_intent = self._classify_query_intent(query)
-        query_topics = self._extract_query_topics(query)
+        query_intent = analysis.intent
+        query_topics = analysis.topics
         
         # Search through all entries in all categories with weighted scoring
+        complete = True
         for category, data in knowledge_base.items():
+            if deadline is not None and deadline.expired():
+                deadline.mark_degraded("brain_search")
+                complete = False
+                break
+            
             # Calculate category relevance with topic matching
             category_relevance = self._calculate_category_relevance(category, query_terms, query_topics)
             
@@ -61,7 +83,7 @@ class BrainSearchEngine:
                 score["question_match"] = self._calculate_text_match_score(question, query_terms, weight=3)
                 
                 # Check for exact matches (highest priority)
-                if question and query.lower() in question:
+                if question and analysis.lower in question:
                     score["exact_match"] = 10.0
                 
                 # Answer content matching with semantic relevance
@@ -106,8 +128,9 @@ class BrainSearchEngine:
         results.sort(key=lambda x: x['score'], reverse=True)
         top_results = results[:top_k]
         
-        # Add to cache
-        self._store_in_cache(cache_key, top_results)
+        # Add to cache (partial results would hide entries from later requests)
+        if complete:
+            self._store_in_cache(cache_key, top_results)
         
         # Track processing time
         end_time = time.time()
@@ -115,79 +138,6 @@ class BrainSearchEngine:
         
         return top_results
     
-    def _preprocess_query(self, query: str) -> List[str]:
-        """Process the query to extract meaningful terms"""
-        # Remove punctuation and convert to lowercase
-        query = re.sub(r'[^\w\s]', ' ', query.lower())
-        
-        # Split into terms and filter out common stop words and short terms
-        stop_words = {'a', 'an', 'the', 'and', 'or', 'but', 'is', 'are', 'was', 'were', 'be', 'been', 
-                     'being', 'in', 'on', 'at', 'to', 'for', 'with', 'by', 'about', 'against', 'between',
-                     'into', 'through', 'during', 'before', 'after', 'above', 'below', 'from', 'up',
-                     'down', 'out', 'off', 'over', 'under', 'again', 'further', 'then', 'once', 'here',
-                     'there', 'when', 'where', 'why', 'how', 'all', 'any', 'both', 'each', 'few', 'more',
-                     'most', 'other', 'some', 'such', 'no', 'nor', 'not', 'only', 'own', 'same', 'so',
-                     'than', 'too', 'very', 's', 't', 'can', 'will', 'just', 'don', 'should', 'now', 'i',
-                     'me', 'my', 'myself', 'we', 'our', 'ours', 'ourselves', 'you', 'your', 'yours'}
-        
-        terms = [term for term in query.split() if term not in stop_words and len(term) > 2]
-        
-        # Check for important terms that might be filtered
-        important_terms = ['fee', 'due', 'pay', 'gpa', 'job', 'tax', 'aid', 'lab', 'web']
-        for term in query.split():
-            if term in important_terms and term not in terms:
-                terms.append(term)
-        
-        return terms
-    
-    def _classify_query_intent(self, query: str) -> str:
-        """Classify the query intent for better matching"""
-        query_lower = query.lower()
-        
-        # Define intent patterns
-        intent_patterns = {
-            'procedural': ['how to', 'how do i', 'process', 'steps', 'procedure', 'guide', 'instructions'],
-            'informational': ['what is', 'what are', 'who is', 'explain', 'describe', 'tell me about'],
-            'comparison': ['compare', 'difference', 'versus', 'vs', 'better', 'between'],
-            'deadline': ['when', 'date', 'deadline', 'due', 'schedule', 'calendar', 'timeline'],
-            'location': ['where', 'location', 'place', 'building', 'room', 'campus'],
-            'contact': ['contact', 'email', 'phone', 'reach', 'speak', 'call'],
-            'requirement': ['require', 'need', 'necessary', 'must have', 'should', 'mandatory']
-        }
-        
-        # Check for matching patterns
-        for intent, patterns in intent_patterns.items():
-            if any(pattern in query_lower for pattern in patterns):
-                return intent
-        
-        return 'general'
-    
-    def _extract_query_topics(self, query: str) -> List[str]:
-        """Extract topic areas from the query"""
-        query_lower = query.lower()
-        
-        # Define topic keywords
-        topics = {
-            'academic': ['course', 'class', 'degree', 'major', 'minor', 'study', 'academic', 'grade', 'credit', 'transcript'],
-            'admission': ['apply', 'admission', 'application', 'accept', 'reject', 'enroll'],
-            'financial': ['tuition', 'fee', 'cost', 'payment', 'financial', 'aid', 'scholarship', 'loan', 'budget', 'fund'],
-            'housing': ['dorm', 'housing', 'residence', 'apartment', 'live', 'roommate', 'accommodation'],
-            'career': ['job', 'career', 'internship', 'employment', 'resume', 'interview', 'hire', 'company'],
-            'administrative': ['office', 'staff', 'administration', 'policy', 'rule', 'regulation', 'requirement'],
-            'student_life': ['club', 'organization', 'activity', 'event', 'social', 'community', 'student life'],
-            'technology': ['computer', 'laptop', 'software', 'internet', 'wifi', 'technology', 'online', 'access'],
-            'health': ['health', 'medical', 'doctor', 'nurse', 'counselor', 'wellness', 'sick', 'illness'],
-            'international': ['visa', 'international', 'country', 'passport', 'foreign']
-        }
-        
-        # Extract matching topics
-        matching_topics = []
-        for topic, keywords in topics.items():
-            if any(keyword in query_lower for keyword in keywords):
-                matching_topics.append(topic)
-        
-        return matching_topics if matching_topics else ['general']
-    
     def _calculate_text_match_score(self, text: str, query_terms: List[str], weight: float = 1.0) -> float:
         """Calculate a weighted score for term matches in text"""
         if not text or not query_terms:
@@ -310,23 +260,8 @@ class BrainSearchEngine:
     
     def _get_from_cache(self, key: str) -> Optional[List[Dict[str, Any]]]:
         """Get results from cache if not expired"""
-        if key in self._search_cache:
-            timestamp, results = self._search_cache[key]
-            if time.time() - timestamp < self._cache_ttl:
-                return results
-        return None
+        return self._search_cache.get(key)
     
     def _store_in_cache(self, key: str, results: List[Dict[str, Any]]) -> None:
-        """Store results in cache with timestamp"""
-        self._search_cache[key] = (time.time(), results)
-        
-        # Clean up old cache entries
-        self._clean_cache()
-    
-    def _clean_cache(self) -> None:
-        """Remove expired cache entries"""
-        if len(self._search_cache) > 100:  # Only clean if cache is large
-            now = time.time()
-            expired_keys = [k for k, v in self._search_cache.items() if now - v[0] > self._cache_ttl]
-            for k in expired_keys:
-                del self._search_cache[k]
+        """Store results in cache, evicting the least recently used entries when full"""
+        self._search_cache.put(key, results)
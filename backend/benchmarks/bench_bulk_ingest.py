@@ -0,0 +1,120 @@
+"""
+Benchmark bulk ingestion against one-document-at-a-time ingestion.
+
+Builds a synthetic corpus of text documents from the ALU Brain answers and
+ingests it twice, each time into a fresh data directory:
+- sequential: store, extract and index each file on its own, the way
+  separate /upload-document requests are handled
+- bulk: the corpus as one zip archive through store_documents (one metadata
+  transaction) and the ingestion queue (parallel extraction, embedding
+  batched across files)
+Reports files/s and MB/s for each. Loads the real embedding model, so run it
+where the backend's requirements are installed.
+
+Usage: python benchmarks/bench_bulk_ingest.py [--files 1000] [--paragraphs 12]
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import zipfile
+import argparse
+import tempfile
+import importlib
+from pathlib import Path
+from typing import List, Tuple
+
+from fastapi import UploadFile
+from starlette.datastructures import Headers
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+def build_corpus(count: int, paragraphs: int, seed: int) -> List[Tuple[str, bytes]]:
+    """(filename, bytes) pairs of distinct documents made from knowledge base answers"""
+    answers = []
+    for json_path in sorted((BACKEND_DIR / "alu_brain").glob("*.json")):
+        with open(json_path, "r", encoding="utf-8") as f:
+            answers.extend(entry["answer"] for entry in json.load(f).get("entries", []) if "answer" in entry)
+
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(count):
+        body = [f"Course pack {seed}-{i}"] + [rng.choice(answers) for _ in range(paragraphs)]
+        corpus.append((f"doc_{i:05d}.txt", "\n\n".join(body).encode("utf-8")))
+    return corpus
+
+def upload(name: str, data: bytes, content_type: str) -> UploadFile:
+    return UploadFile(io.BytesIO(data), size=len(data), filename=name, headers=Headers({"content-type": content_type}))
+
+def fresh_app():
+    """Import the app against an empty data directory in a temporary working directory"""
+    workdir = tempfile.mkdtemp(prefix="bench_ingest_")
+    os.symlink(BACKEND_DIR / "alu_brain", Path(workdir) / "alu_brain")
+    os.chdir(workdir)
+    # Backend modules resolve ./data when imported, so drop any loaded for a previous run
+    for name, module in list(sys.modules.items()):
+        if str(getattr(module, "__file__", None) or "").startswith(str(BACKEND_DIR)) and "benchmarks" not in name:
+            del sys.modules[name]
+    return importlib.import_module("main")
+
+def run_sequential(corpus: List[Tuple[str, bytes]]) -> float:
+    main = fresh_app()
+
+    async def ingest():
+        for name, data in corpus:
+            doc_id = await main.document_processor.process_document(upload(name, data, "text/plain"))
+            main.retrieval_engine.update_vector_store(doc_id)
+
+    start = time.perf_counter()
+    asyncio.run(ingest())
+    return time.perf_counter() - start
+
+def run_bulk(corpus: List[Tuple[str, bytes]]) -> Tuple[float, float]:
+    main = fresh_app()
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, data in corpus:
+            zf.writestr(name, data)
+
+    start = time.perf_counter()
+    report = asyncio.run(main.document_processor.store_documents(
+        [upload("corpus.zip", archive.getvalue(), "application/zip")]))
+    job_ids = main.ingestion_queue.enqueue_many([entry["doc_id"] for entry in report if "doc_id" in entry])
+    stored = time.perf_counter() - start
+
+    main.ingestion_queue.start(main.ingest_documents)
+    pending = set(job_ids)
+    while pending:
+        time.sleep(0.1)
+        pending = {job_id for job_id in pending if main.ingestion_queue.get(job_id)["state"] not in ("indexed", "failed")}
+    main.ingestion_queue.stop()
+    failed = sum(1 for job_id in job_ids if main.ingestion_queue.get(job_id)["state"] == "failed")
+    if failed:
+        print(f"warning: {failed} bulk jobs failed")
+    return stored, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=1000)
+    parser.add_argument("--paragraphs", type=int, default=12, help="Answers per synthetic document")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.files, args.paragraphs, args.seed)
+    megabytes = sum(len(data) for _, data in corpus) / 1e6
+    print(f"corpus: {len(corpus)} files, {megabytes:.1f} MB")
+
+    sequential = run_sequential(corpus)
+    stored, bulk = run_bulk(corpus)
+
+    print(f"sequential:         {sequential:8.2f}s  {len(corpus) / sequential:8.1f} files/s  {megabytes / sequential:6.2f} MB/s")
+    print(f"bulk (stored):      {stored:8.2f}s  {len(corpus) / stored:8.1f} files/s  {megabytes / stored:6.2f} MB/s")
+    print(f"bulk (indexed):     {bulk:8.2f}s  {len(corpus) / bulk:8.1f} files/s  {megabytes / bulk:6.2f} MB/s")
+    print(f"speedup:            {sequential / bulk:8.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Benchmark the reduced-precision vector index.
+
+Reports recall@k against exact float32 search, in-memory index size and
+query latency for each storage precision. The size column is the compact
+index only: in the service Chroma keeps its own float32 vectors as well. Uses clustered synthetic vectors
+by default; pass --embeddings with a saved (n, dim) .npy array to run on
+real chunk embeddings instead.
+
+Usage: python benchmarks/bench_vector_precision.py [--vectors 20000] [--k 5]
+"""
+import sys
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from quantized_index import QuantizedVectorIndex, PRECISIONS, _normalize
+
+def make_vectors(count: int, dim: int, clusters: int, seed: int = 0) -> np.ndarray:
+    """Clustered unit vectors, closer to sentence embeddings than uniform noise"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    assignment = rng.integers(0, clusters, size=count)
+    return _normalize(centers[assignment] + 0.6 * rng.normal(size=(count, dim))).astype(np.float32)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--rescore", type=int, default=100)
+    parser.add_argument("--embeddings", type=str, default=None, help="Optional .npy file of real embeddings")
+    args = parser.parse_args()
+
+    if args.embeddings:
+        data = _normalize(np.load(args.embeddings).astype(np.float32))
+    else:
+        data = make_vectors(args.vectors + args.queries, args.dim, clusters=max(10, args.vectors // 100))
+
+    queries, vectors = data[:args.queries], data[args.queries:]
+    ids = [f"chunk_{i}" for i in range(len(vectors))]
+    levels = ["public"] * len(vectors)
+
+    # Ground truth from exact float32 search
+    truth = [set(np.argsort(-(vectors @ q))[:args.k]) for q in queries]
+
+    print(f"{len(vectors)} vectors, dim {vectors.shape[1]}, {len(queries)} queries, k={args.k}, rescore={args.rescore}")
+    print(f"{'precision':<10} {'recall@k':>9} {'index MB':>10} {'vs f32':>7} {'p50 ms':>8} {'p95 ms':>8}")
+
+    baseline_memory = None
+    for precision in PRECISIONS:
+        with tempfile.TemporaryDirectory() as index_dir:
+            index = QuantizedVectorIndex(precision, Path(index_dir), rescore_candidates=args.rescore)
+            index.add(ids, vectors, levels)
+
+            hits = 0
+            latencies = []
+            for q, expected in zip(queries, truth):
+                start = time.perf_counter()
+                results = index.search(q, args.k)
+                latencies.append(time.perf_counter() - start)
+                hits += len({int(chunk_id.split("_")[1]) for chunk_id, _ in results} & expected)
+
+            memory = index.memory_bytes()
+            baseline_memory = baseline_memory or memory
+            p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+            print(f"{precision:<10} {hits / (len(queries) * args.k):>9.3f} {memory / 1e6:>10.2f} "
+                  f"{memory / baseline_memory:>7.2f} {p50:>8.2f} {p95:>8.2f}")
+
+if __name__ == "__main__":
+    main()
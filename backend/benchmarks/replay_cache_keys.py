@@ -0,0 +1,101 @@
+"""
+Replay a query log against raw and canonical cache keys.
+
+Compares the hit rate of a bounded LRU cache keyed on the raw query text
+(the old "{query}:{role}" keys) with one keyed on query_analysis.fingerprint.
+Pass --log with one query per line, optionally prefixed by "role<TAB>".
+Without a log, a synthetic one is generated from the ALU Brain questions
+with the case, punctuation, whitespace and wording variations seen in chat
+traffic, drawn with a Zipf-like popularity skew.
+
+Usage: python benchmarks/replay_cache_keys.py [--log queries.txt] [--cache-size 512]
+"""
+import sys
+import json
+import random
+import argparse
+from pathlib import Path
+from typing import List, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from query_analysis import fingerprint
+from ttl_cache import TTLCache
+
+BRAIN_DIR = Path(__file__).resolve().parent.parent / "alu_brain"
+
+def load_log(path: str) -> List[Tuple[str, str]]:
+    """Read (role, query) pairs from a text log"""
+    entries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line.strip():
+                continue
+            role, _, query = line.partition("\t") if "\t" in line else ("student", "", line)
+            entries.append((role, query))
+    return entries
+
+def vary(question: str, rng: random.Random) -> str:
+    """Rewrite a question the way different students type it"""
+    query = question
+    if rng.random() < 0.5:
+        query = query.lower()
+    if rng.random() < 0.4:
+        query = query.rstrip("?") if query.endswith("?") else query + "?"
+    if rng.random() < 0.2:
+        query = "  " + query.replace(" ", "  ", 1) + " "
+    if rng.random() < 0.2:
+        query = query.replace("What are", "what are the", 1).replace("What is", "what's the", 1)
+    if rng.random() < 0.15:
+        query = query.replace(" the ", " ", 1)
+    if rng.random() < 0.15:
+        query = query + "!!"
+    return query
+
+def synthetic_log(count: int, seed: int) -> List[Tuple[str, str]]:
+    """Popularity-skewed queries built from the knowledge base questions"""
+    questions = []
+    for json_path in sorted(BRAIN_DIR.glob("*.json")):
+        with open(json_path, "r", encoding="utf-8") as f:
+            questions.extend(entry["question"] for entry in json.load(f).get("entries", []) if "question" in entry)
+
+    rng = random.Random(seed)
+    weights = [1.0 / (rank + 1) for rank in range(len(questions))]
+    roles = ["student"] * 8 + ["faculty", "admin"]
+    return [(rng.choice(roles), vary(rng.choices(questions, weights)[0], rng)) for _ in range(count)]
+
+def replay(entries: List[Tuple[str, str]], cache_size: int, canonical: bool) -> float:
+    """Hit rate of an LRU cache of cache_size entries over the log"""
+    cache = TTLCache(f"replay_{'canonical' if canonical else 'raw'}", max_entries=cache_size)
+    hits = 0
+    for role, query in entries:
+        key = fingerprint(query, role) if canonical else f"{query}:{role}"
+        if cache.get(key) is not None:
+            hits += 1
+        else:
+            cache.put(key, True)
+    return hits / len(entries) if entries else 0.0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--log", type=str, default=None, help="Query log, one query per line")
+    parser.add_argument("--queries", type=int, default=5000, help="Synthetic log length")
+    parser.add_argument("--cache-size", type=int, default=512)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    entries = load_log(args.log) if args.log else synthetic_log(args.queries, args.seed)
+    distinct_raw = len({f"{query}:{role}" for role, query in entries})
+    distinct_canonical = len({fingerprint(query, role) for role, query in entries})
+
+    raw = replay(entries, args.cache_size, canonical=False)
+    canonical = replay(entries, args.cache_size, canonical=True)
+
+    print(f"queries:              {len(entries)} ({'log' if args.log else 'synthetic'})")
+    print(f"distinct keys:        raw {distinct_raw}, canonical {distinct_canonical}")
+    print(f"hit rate (raw):       {raw:.3f}")
+    print(f"hit rate (canonical): {canonical:.3f}")
+    print(f"improvement:          {canonical - raw:+.3f}")
+
+if __name__ == "__main__":
+    main()
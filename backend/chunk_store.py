@@ -0,0 +1,375 @@
+import os
+import mmap
+import fcntl
+import zlib
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from metadata_store import ImmediateTransaction
+
+DATA_DIR = Path("./data")
+CHUNK_STORE_DIR = DATA_DIR / "chunks"
+CHUNK_STORE_DIR.mkdir(parents=True, exist_ok=True)
+CHUNK_INDEX_DB = CHUNK_STORE_DIR / "index.db"
+
+# Appends go to a new segment file once the current one would grow past this size
+CHUNK_SEGMENT_BYTES = int(os.getenv("CHUNK_SEGMENT_BYTES", str(256 * 1024 * 1024)))
+# "zlib" compresses each document's text; chunks are then read by decompressing their document
+CHUNK_STORE_COMPRESSION = os.getenv("CHUNK_STORE_COMPRESSION", "none")
+# Live text is rewritten into fresh segments once this share of the written bytes is dead
+CHUNK_STORE_COMPACT_RATIO = float(os.getenv("CHUNK_STORE_COMPACT_RATIO", "0.5"))
+
+# IDs per SQL lookup, below SQLite's limit on bound parameters
+LOOKUP_BATCH = 500
+
+# A chunk of a document's text: (chunk_id, chunk_index, start, end) in characters
+ChunkSpan = Tuple[str, int, int, int]
+
+class ChunkStore:
+    """
+    Document text kept once, in append-only segment files, with an index of chunk positions:
+    - Each document's text is one contiguous (optionally compressed) region of a segment
+    - Chunks are byte ranges of that region, looked up by chunk ID or (doc_id, chunk_index)
+    - Segments are read through mmap, so uncompressed chunks are memoryview slices of the
+      page cache rather than copies
+    - The index is SQLite (WAL), whose write lock also serializes appends across worker processes
+    - Replaced and deleted text is dead space until the store is compacted, on a background
+      thread once CHUNK_STORE_COMPACT_RATIO of the written bytes are dead
+    """
+
+    def __init__(self, directory: Path = CHUNK_STORE_DIR, compression: str = CHUNK_STORE_COMPRESSION):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.compression = compression
+        self._local = threading.local()
+        self._maps: Dict[int, mmap.mmap] = {}
+        self._maps_pid = os.getpid()
+        self._maps_lock = threading.Lock()
+        self._compactor: Optional[threading.Thread] = None
+        self._compactor_lock = threading.Lock()
+
+        self._connection().executescript("""
+            CREATE TABLE IF NOT EXISTS documents (
+                doc_id TEXT PRIMARY KEY,
+                sha256 TEXT,
+                text_hash TEXT NOT NULL,
+                segment INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                compressed INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS chunks (
+                chunk_id TEXT PRIMARY KEY,
+                doc_id TEXT NOT NULL,
+                chunk_index INTEGER NOT NULL,
+                start_byte INTEGER NOT NULL,
+                end_byte INTEGER NOT NULL
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS chunks_position ON chunks (doc_id, chunk_index);
+            CREATE TABLE IF NOT EXISTS store_state (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO store_state (key, value) VALUES ('segment', 0), ('segment_end', 0), ('written', 0);
+        """)
+
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread and process; SQLite connections must not cross either"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(str(self.directory / CHUNK_INDEX_DB.name), timeout=10.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _segment_path(self, segment: int) -> Path:
+        return self.directory / f"segment-{segment:06d}.dat"
+
+    @staticmethod
+    def _state(conn: sqlite3.Connection) -> Dict[str, int]:
+        return dict(conn.execute("SELECT key, value FROM store_state").fetchall())
+
+    @staticmethod
+    def _set_state(conn: sqlite3.Connection, **values: int) -> None:
+        conn.executemany("UPDATE store_state SET value = ? WHERE key = ?", [(v, k) for k, v in values.items()])
+
+    @staticmethod
+    def _byte_spans(doc_id: str, text: str, chunks: List[ChunkSpan]) -> List[Tuple[str, str, int, int, int]]:
+        """Index rows for chunks given as character spans, converted to byte offsets in one pass"""
+        rows = []
+        char_pos = byte_pos = 0
+        for chunk_id, chunk_index, start, end in sorted(chunks, key=lambda chunk: chunk[2]):
+            byte_pos += len(text[char_pos:start].encode("utf-8"))
+            char_pos = start
+            rows.append((chunk_id, doc_id, chunk_index, byte_pos, byte_pos + len(text[start:end].encode("utf-8"))))
+        return rows
+
+    def _append(self, segment: int, position: int, data: bytes) -> None:
+        """Write at a segment's end; bytes past it are from an interrupted write and are overwritten"""
+        fd = os.open(self._segment_path(segment), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.pwrite(fd, data, position)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def put_documents(self, documents: List[Tuple[str, Optional[str], str, List[ChunkSpan]]]) -> None:
+        """
+        Store the text of several documents as (doc_id, sha256, text, chunks), in one transaction.
+        sha256 identifies the document version the text was extracted from. Text that is already
+        stored for the document is kept and only its chunk positions are rewritten.
+        """
+        conn = self._connection()
+        with ImmediateTransaction(conn):
+            state = self._state(conn)
+            segment, segment_end, written = state["segment"], state["segment_end"], state["written"]
+            pending = bytearray()
+            pending_start = segment_end
+
+            for doc_id, sha256, text, chunks in documents:
+                data = text.encode("utf-8")
+                text_hash = hashlib.blake2b(data, digest_size=16).hexdigest()
+                row = conn.execute("SELECT text_hash FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+
+                if row is not None and row[0] == text_hash:
+                    conn.execute("UPDATE documents SET sha256 = ? WHERE doc_id = ?", (sha256, doc_id))
+                else:
+                    compressed = self.compression == "zlib"
+                    if compressed:
+                        data = zlib.compress(data)
+
+                    # Start a new segment rather than grow this one past its limit
+                    if segment_end > 0 and segment_end + len(data) > CHUNK_SEGMENT_BYTES:
+                        if pending:
+                            self._append(segment, pending_start, bytes(pending))
+                            pending = bytearray()
+                        segment, segment_end, pending_start = segment + 1, 0, 0
+
+                    conn.execute(
+                        "INSERT OR REPLACE INTO documents (doc_id, sha256, text_hash, segment, position, size, compressed) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (doc_id, sha256, text_hash, segment, segment_end, len(data), int(compressed))
+                    )
+                    pending += data
+                    segment_end += len(data)
+                    written += len(data)
+
+                conn.execute("DELETE FROM chunks WHERE doc_id = ?", (doc_id,))
+                conn.executemany(
+                    "INSERT OR REPLACE INTO chunks (chunk_id, doc_id, chunk_index, start_byte, end_byte) VALUES (?, ?, ?, ?, ?)",
+                    self._byte_spans(doc_id, text, chunks)
+                )
+
+            # The text is on disk before the index that points at it is committed
+            if pending:
+                self._append(segment, pending_start, bytes(pending))
+            self._set_state(conn, segment=segment, segment_end=segment_end, written=written)
+
+        self._compact_if_needed()
+
+    def delete_document(self, doc_id: str) -> bool:
+        """Forget a document's text; its bytes stay in the segment until compaction"""
+        with ImmediateTransaction(self._connection()) as conn:
+            conn.execute("DELETE FROM chunks WHERE doc_id = ?", (doc_id,))
+            deleted = conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,)).rowcount > 0
+        if deleted:
+            self._compact_if_needed()
+        return deleted
+
+    def _map(self, segment: int, needed: int) -> mmap.mmap:
+        """A read-only map of a segment covering at least the first needed bytes"""
+        with self._maps_lock:
+            if self._maps_pid != os.getpid():
+                self._maps, self._maps_pid = {}, os.getpid()
+
+            mapped = self._maps.get(segment)
+            if mapped is None or len(mapped) < needed:
+                # Segments only grow, so a map that is too short is replaced by one of the whole file
+                with open(self._segment_path(segment), "rb") as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps[segment] = mapped
+            return mapped
+
+    def _region(self, segment: int, position: int, size: int, compressed: int) -> memoryview:
+        """A document's text bytes: a view into the segment map, or its decompressed copy"""
+        view = memoryview(self._map(segment, position + size))[position:position + size]
+        if compressed:
+            return memoryview(zlib.decompress(view))
+        return view
+
+    def _lookup(self, sql: str, params: tuple) -> List[tuple]:
+        return self._connection().execute(sql, params).fetchall()
+
+    def _read_rows(self, sql: str, params: tuple, read) -> Any:
+        """Run a lookup and read what it points at, once more if compaction moved the text meanwhile"""
+        try:
+            return read(self._lookup(sql, params))
+        except FileNotFoundError:
+            return read(self._lookup(sql, params))
+
+    def chunk_view(self, doc_id: str, chunk_index: int) -> Optional[memoryview]:
+        """The UTF-8 bytes of one chunk, without copying them when the store is uncompressed"""
+        def read(rows):
+            if not rows:
+                return None
+            start, end, segment, position, size, compressed = rows[0]
+            return self._region(segment, position, size, compressed)[start:end]
+
+        return self._read_rows(
+            "SELECT c.start_byte, c.end_byte, d.segment, d.position, d.size, d.compressed "
+            "FROM chunks c JOIN documents d ON d.doc_id = c.doc_id WHERE c.doc_id = ? AND c.chunk_index = ?",
+            (doc_id, chunk_index), read
+        )
+
+    def get_chunks(self, chunk_ids: List[str]) -> Dict[str, str]:
+        """Text of the given chunks, by chunk ID; IDs the store does not hold are left out"""
+        texts = {}
+        for offset in range(0, len(chunk_ids), LOOKUP_BATCH):
+            batch = tuple(chunk_ids[offset:offset + LOOKUP_BATCH])
+
+            def read(rows):
+                found = {}
+                regions = {}
+                for chunk_id, doc_id, start, end, segment, position, size, compressed in rows:
+                    # Decompress each document once however many of its chunks were asked for
+                    if doc_id not in regions:
+                        regions[doc_id] = self._region(segment, position, size, compressed)
+                    found[chunk_id] = str(regions[doc_id][start:end], "utf-8")
+                return found
+
+            texts.update(self._read_rows(
+                "SELECT c.chunk_id, c.doc_id, c.start_byte, c.end_byte, d.segment, d.position, d.size, d.compressed "
+                f"FROM chunks c JOIN documents d ON d.doc_id = c.doc_id WHERE c.chunk_id IN ({','.join('?' * len(batch))})",
+                batch, read
+            ))
+        return texts
+
+    def document_text(self, doc_id: str, sha256: Optional[str] = None) -> Optional[str]:
+        """A document's full text, or None if it is not stored or was stored for another version"""
+        def read(rows):
+            if not rows or rows[0][0] != sha256:
+                return None
+            _, segment, position, size, compressed = rows[0]
+            return str(self._region(segment, position, size, compressed), "utf-8")
+
+        return self._read_rows(
+            "SELECT sha256, segment, position, size, compressed FROM documents WHERE doc_id = ?",
+            (doc_id,), read
+        )
+
+    def document_versions(self, doc_ids: List[str]) -> Dict[str, Optional[str]]:
+        """The content hash each document's stored text was indexed from; unstored documents are left out"""
+        versions = {}
+        for offset in range(0, len(doc_ids), LOOKUP_BATCH):
+            batch = tuple(doc_ids[offset:offset + LOOKUP_BATCH])
+            versions.update(self._lookup(
+                f"SELECT doc_id, sha256 FROM documents WHERE doc_id IN ({','.join('?' * len(batch))})", batch
+            ))
+        return versions
+
+    def _compact_if_needed(self) -> None:
+        """Start a background compaction once enough of the written bytes are dead"""
+        conn = self._connection()
+        written = self._state(conn)["written"]
+        live = conn.execute("SELECT COALESCE(SUM(size), 0) FROM documents").fetchone()[0]
+        if written == 0 or written - live <= CHUNK_STORE_COMPACT_RATIO * written:
+            return
+        with self._compactor_lock:
+            if self._compactor is not None and self._compactor.is_alive():
+                return
+            self._compactor = threading.Thread(target=self._compact_in_background,
+                                               name="chunk-store-compact", daemon=True)
+            self._compactor.start()
+
+    def _compact_in_background(self) -> None:
+        try:
+            self.compact()
+        except (OSError, sqlite3.Error) as e:
+            print(f"Error compacting chunk store: {e}")
+
+    def compact(self) -> None:
+        """
+        Copy the live text into new segments and delete the old ones. The index write lock is held
+        only to reserve the new segments and to point documents at them, not during the copy;
+        documents replaced or deleted meanwhile keep their newer rows. Returns at once if another
+        thread or process is already compacting.
+        """
+        with open(self.directory / "compact.lock", "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            try:
+                self._compact()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _compact(self) -> None:
+        conn = self._connection()
+
+        # Lay the live text out in new segments and move appends past them
+        with ImmediateTransaction(conn):
+            state = self._state(conn)
+            first_segment = segment = state["segment"] + 1
+            segment_end = 0
+            moves = []  # (doc_id, old segment, old position, size, new segment, new position)
+            for doc_id, old_segment, position, size in conn.execute(
+                    "SELECT doc_id, segment, position, size FROM documents ORDER BY segment, position"):
+                if segment_end > 0 and segment_end + size > CHUNK_SEGMENT_BYTES:
+                    segment, segment_end = segment + 1, 0
+                moves.append((doc_id, old_segment, position, size, segment, segment_end))
+                segment_end += size
+            self._set_state(conn, segment=segment + 1, segment_end=0)
+
+        # Old segments are no longer appended to, so their text can be copied without the lock
+        fd = None
+        try:
+            for doc_id, old_segment, position, size, new_segment, new_position in moves:
+                if new_position == 0:
+                    if fd is not None:
+                        os.fsync(fd)
+                        os.close(fd)
+                        fd = None
+                    fd = os.open(self._segment_path(new_segment), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+                os.write(fd, memoryview(self._map(old_segment, position + size))[position:position + size])
+            if fd is not None:
+                os.fsync(fd)
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+        with ImmediateTransaction(conn):
+            conn.executemany(
+                "UPDATE documents SET segment = ?, position = ? WHERE doc_id = ? AND segment = ? AND position = ?",
+                [(new_segment, new_position, doc_id, old_segment, position)
+                 for doc_id, old_segment, position, _, new_segment, new_position in moves]
+            )
+            # Dead bytes before the copy are gone; text appended during it is still counted
+            written = self._state(conn)["written"] - state["written"] + sum(move[3] for move in moves)
+            self._set_state(conn, written=written)
+
+        # Readers in other processes may still map old segments; removing the files leaves their maps valid
+        for path in self.directory.glob("segment-*.dat"):
+            if int(path.stem.split("-")[1]) < first_segment:
+                os.remove(path)
+        with self._maps_lock:
+            self._maps = {number: mapped for number, mapped in self._maps.items() if number >= first_segment}
+        print(f"Compacted chunk store into {segment - first_segment + 1 if moves else 0} segments")
+
+    def get_stats(self) -> Dict[str, Any]:
+        conn = self._connection()
+        written = self._state(conn)["written"]
+        documents, live = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM documents").fetchone()
+        return {
+            "documents": documents,
+            "chunks": conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0],
+            "segments": len(list(self.directory.glob("segment-*.dat"))),
+            "live_bytes": live,
+            "dead_bytes": written - live,
+            "compression": self.compression
+        }
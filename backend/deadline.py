@@ -0,0 +1,35 @@
+import os
+import time
+from typing import List
+
+# Default end-to-end budget for a chat request
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "3.0"))  # seconds
+
+class Deadline:
+    """
+    Per-request time budget passed through the retrieval and generation pipeline:
+    - Each stage checks the remaining time and returns what it has when it runs out
+    - Stages that had to cut work short mark the request as degraded
+    """
+
+    def __init__(self, budget: float = REQUEST_DEADLINE):
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget
+        self.degraded_reasons: List[str] = []
+
+    def remaining(self) -> float:
+        """Seconds left before the deadline, never negative"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        """Whether the budget has been used up"""
+        return time.monotonic() >= self.expires_at
+
+    def mark_degraded(self, reason: str) -> None:
+        """Record that a stage returned partial results"""
+        if reason not in self.degraded_reasons:
+            self.degraded_reasons.append(reason)
+
+    @property
+    def degraded(self) -> bool:
+        return bool(self.degraded_reasons)
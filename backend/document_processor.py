@@ -1,22 +1,49 @@
 
 import os
 import uuid
-import json
-import shutil
+import asyncio
+import hashlib
+import zipfile
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import AsyncIterator, Awaitable, Callable, List, Dict, Any, Optional, Tuple
 from fastapi import UploadFile, HTTPException
 import time
 
 # Document handling libraries
-import pypdf
 import docx2txt
 
+from metadata_store import MetadataStore
+from chunk_store import ChunkStore, ChunkSpan
+from pdf_extraction import stream_pdf_pages
+
 # Create data directories if they don't exist
 DATA_DIR = Path("./data")
 DOCUMENTS_DIR = DATA_DIR / "documents"
 DOCUMENTS_DIR.mkdir(parents=True, exist_ok=True)
-METADATA_FILE = DATA_DIR / "document_metadata.json"
+# Originals and extracted text are stored under their SHA-256, so identical uploads share one copy
+ORIGINALS_DIR = DOCUMENTS_DIR / "originals"
+TEXT_DIR = DOCUMENTS_DIR / "text"
+ORIGINALS_DIR.mkdir(parents=True, exist_ok=True)
+TEXT_DIR.mkdir(parents=True, exist_ok=True)
+
+# Uploads are streamed to disk in chunks of this size, never held in memory whole
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Formats recognised by extension, for archive entries and uploads sent without a useful content type
+CONTENT_TYPES_BY_SUFFIX = {
+    ".pdf": "application/pdf",
+    ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    ".txt": "text/plain",
+    ".md": "text/markdown",
+}
+ARCHIVE_CONTENT_TYPES = ("application/zip", "application/x-zip-compressed")
+BULK_MAX_FILES = int(os.getenv("BULK_MAX_FILES", "5000"))  # files and archive entries per bulk upload
+# Uncompressed bytes allowed per archive entry, and across all archives in one bulk upload
+BULK_MAX_ENTRY_BYTES = int(os.getenv("BULK_MAX_ENTRY_BYTES", str(100 * 1024 * 1024)))
+BULK_MAX_ARCHIVE_BYTES = int(os.getenv("BULK_MAX_ARCHIVE_BYTES", str(2 * 1024 * 1024 * 1024)))
+
+# Access levels a document can be tagged with at upload, from least to most restricted
+ACCESS_LEVELS = ["public", "student", "faculty", "admin"]
 
 class DocumentProcessor:
     """
@@ -33,176 +60,428 @@ class DocumentProcessor:
             "text/plain": self._extract_text_file,
             "text/markdown": self._extract_text_file,
         }
-        self._initialize_metadata()
+        self.metadata_store = MetadataStore()
+        self.chunk_store = ChunkStore()
 
-    def _initialize_metadata(self):
-        """Initialize metadata storage"""
-        if not METADATA_FILE.exists():
-            with open(METADATA_FILE, "w") as f:
-                json.dump({}, f)
-
-    async def process_document(self, file: UploadFile, title: Optional[str] = None, source: str = "user-upload") -> str:
+    async def process_document(self, file: UploadFile, title: Optional[str] = None, source: str = "user-upload",
+                               access_level: str = "public") -> str:
         """
-        Process an uploaded document:
-        1. Extract text based on file type
-        2. Save document metadata
+        Process an uploaded document in a single pass:
+        1. Store the original and its metadata, or alias an identical existing document
+        2. Extract text from the stored file based on file type, unless already extracted
         3. Return document ID for further processing
         """
-        # Generate a unique ID for the document
-        doc_id = str(uuid.uuid4())
+        doc_id, created = await self.store_document(file, title, source, access_level)
+        if not created and not self.needs_extraction(doc_id):
+            return doc_id
         
-        # Determine document format and extract text
-        content_type = file.content_type
-        if content_type not in self.supported_formats:
+        try:
+            await self.extract_document(doc_id)
+        except Exception:
+            if created:
+                self.delete_document(doc_id)
+            raise
+        return doc_id
+
+    async def store_document(self, file: UploadFile, title: Optional[str] = None, source: str = "user-upload",
+                             access_level: str = "public") -> Tuple[str, bool]:
+        """
+        Store an uploaded document without extracting it yet:
+        1. Stream the original to disk, computing its SHA-256 and size
+        2. If a document with the same bytes exists, record this upload as an alias of it
+        3. Otherwise save document metadata; extract_document produces the text later
+        Returns the document ID and whether a new document was created.
+        """
+        self.validate_upload(file.content_type, access_level)
+        sha256, size, file_path = await self._store_original(file.read)
+        return self._register_original(file.filename, file.content_type, title, source, access_level,
+                                       sha256, size, file_path)
+
+    def store_uploaded_file(self, path: Path, sha256: str, size: int, filename: str, content_type: str,
+                            title: Optional[str] = None, source: str = "user-upload",
+                            access_level: str = "public") -> Tuple[str, bool]:
+        """
+        Store a file that was already uploaded to disk, e.g. by a resumable upload, without
+        extracting it yet. The file is moved to its content address; sha256 and size must be its own.
+        Returns the document ID and whether a new document was created.
+        """
+        file_path = ORIGINALS_DIR / sha256
+        os.replace(path, file_path)  # same bytes as any copy already there
+        return self._register_original(filename, content_type, title, source, access_level,
+                                       sha256, size, file_path)
+
+    def _register_original(self, filename: str, content_type: str, title: Optional[str], source: str,
+                           access_level: str, sha256: str, size: int, file_path: Path) -> Tuple[str, bool]:
+        """Save metadata for a stored original, or record it as an alias of an identical document"""
+        metadata, alias = self._new_document(filename, content_type, title, source, access_level,
+                                             sha256, size, file_path)
+        
+        try:
+            doc_id, created = self.metadata_store.put_or_alias(metadata["id"], metadata, alias)
+        except Exception as e:
+            print(f"Error saving metadata: {e}")
+            raise HTTPException(status_code=500, detail=f"Error saving document metadata: {str(e)}")
+        
+        if not created:
+            print(f"Upload of {filename} matches existing document {doc_id}; recorded as an alias")
+        return doc_id, created
+
+    async def store_documents(self, files: List[UploadFile], source: str = "user-upload",
+                              access_level: str = "public") -> List[Dict[str, Any]]:
+        """
+        Store many uploads at once without extracting them yet. Zip archives are read entry
+        by entry, each supported entry becoming its own document. Originals are streamed to
+        disk one at a time and all the metadata is committed in a single transaction.
+        Returns a report entry per file or archive entry: filename, size, doc_id and duplicate,
+        or error if it was skipped.
+        """
+        if access_level not in ACCESS_LEVELS:
             raise HTTPException(
-                status_code=400, 
-                detail=f"Unsupported file format: {content_type}. Supported formats: {', '.join(self.supported_formats.keys())}"
+                status_code=400,
+                detail=f"Unsupported access level: {access_level}. Supported levels: {', '.join(ACCESS_LEVELS)}"
             )
-
-        # Save the original file
-        file_path = DOCUMENTS_DIR / f"{doc_id}{Path(file.filename).suffix}"
-        with open(file_path, "wb") as f:
-            shutil.copyfileobj(file.file, f)
         
-        # Reset file position
-        await file.seek(0)
+        report = []
+        pending = []  # (report entry, metadata, alias) awaiting the metadata transaction
+        extracted = 0  # uncompressed bytes read from archives so far
+        
+        def at_file_limit(filename: str) -> bool:
+            """Whether the upload already has BULK_MAX_FILES entries, reporting it for the first file over"""
+            if len(report) < BULK_MAX_FILES:
+                return False
+            if len(report) == BULK_MAX_FILES:
+                report.append({"filename": filename, "error": f"More than {BULK_MAX_FILES} files in one upload; the rest were skipped"})
+            return True
+        
+        async def store(filename: str, content_type: Optional[str], read: Callable[[int], Awaitable[bytes]]):
+            entry = {"filename": filename}
+            report.append(entry)
+            
+            content_type = self._resolve_content_type(filename, content_type)
+            if content_type is None:
+                entry["error"] = "Unsupported file format"
+                return
+            
+            try:
+                sha256, size, file_path = await self._store_original(read)
+            except Exception as e:
+                entry["error"] = str(e)
+                return
+            
+            metadata, alias = self._new_document(filename, content_type, None, source, access_level,
+                                                 sha256, size, file_path)
+            entry["size"] = size
+            pending.append((entry, metadata, alias))
+        
+        for file in files:
+            if at_file_limit(file.filename):
+                break
+            if not self._is_archive(file.filename, file.content_type):
+                await store(file.filename, file.content_type, file.read)
+                continue
+            
+            loop = asyncio.get_running_loop()
+            try:
+                archive = zipfile.ZipFile(file.file)
+            except zipfile.BadZipFile as e:
+                report.append({"filename": file.filename, "error": f"Unreadable archive: {e}"})
+                continue
+            
+            with archive:
+                for info in archive.infolist():
+                    name = info.filename
+                    if info.is_dir() or name.startswith("__MACOSX/") or Path(name).name.startswith("."):
+                        continue
+                    
+                    filename = f"{file.filename}/{name}"
+                    if at_file_limit(filename):
+                        break
+                    # Sizes in the archive's headers are checked before decompressing anything...
+                    if info.file_size > BULK_MAX_ENTRY_BYTES:
+                        report.append({"filename": filename, "error": f"Larger than {BULK_MAX_ENTRY_BYTES} bytes uncompressed"})
+                        continue
+                    if extracted + info.file_size > BULK_MAX_ARCHIVE_BYTES:
+                        report.append({"filename": filename,
+                                       "error": f"Archives in one upload exceed {BULK_MAX_ARCHIVE_BYTES} bytes uncompressed; the rest were skipped"})
+                        break
+                    
+                    # ...and the bytes actually decompressed, a block at a time, against the declared size
+                    received = [0]
+                    with archive.open(info) as member:
+                        async def read(size: int, member=member, declared=info.file_size, received=received) -> bytes:
+                            data = await loop.run_in_executor(None, member.read, size)
+                            received[0] += len(data)
+                            if received[0] > declared:
+                                raise ValueError(f"Entry decompresses to more than the {declared} bytes it declares")
+                            return data
+                        await store(filename, None, read)
+                    extracted += received[0]
         
-        # Extract text
-        text = await self.supported_formats[content_type](file)
+        try:
+            results = self.metadata_store.put_or_alias_many([(metadata["id"], metadata, alias)
+                                                             for _, metadata, alias in pending])
+        except Exception as e:
+            print(f"Error saving metadata: {e}")
+            raise HTTPException(status_code=500, detail=f"Error saving document metadata: {str(e)}")
         
+        for (entry, _, _), (doc_id, created) in zip(pending, results):
+            entry["doc_id"] = doc_id
+            entry["duplicate"] = not created
+        return report
+
+    def _new_document(self, filename: str, content_type: str, title: Optional[str], source: str,
+                      access_level: str, sha256: str, size: int, file_path: Path) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Metadata for a newly stored original, and the alias recorded instead if its content is already known"""
         # If title is not provided, use the filename without extension
         if not title:
-            title = Path(file.filename).stem
-        
-        # Save text to a file
-        text_file_path = DOCUMENTS_DIR / f"{doc_id}.txt"
-        with open(text_file_path, "w", encoding="utf-8") as f:
-            f.write(text)
+            title = Path(filename).stem
+        upload_time = time.time()
 
-        # Update metadata
+        # Length is filled in once the text is extracted
         metadata = {
-            "id": doc_id,
+            "id": str(uuid.uuid4()),
             "title": title,
-            "filename": file.filename,
+            "filename": filename,
             "content_type": content_type,
             "source": source,
-            "length": len(text),
-            "upload_time": time.time(),
+            "access_level": access_level,
+            "length": None,
+            "size": size,
+            "sha256": sha256,
+            "upload_time": upload_time,
             "original_file": str(file_path),
-            "text_file": str(text_file_path)
+            "text_file": str(TEXT_DIR / f"{sha256}.txt")
         }
         
-        self._save_metadata(doc_id, metadata)
+        # A repeat upload keeps the existing document and its access level; its own details are kept alongside
+        alias = {
+            "title": title,
+            "filename": filename,
+            "source": source,
+            "access_level": access_level,
+            "upload_time": upload_time
+        }
+        return metadata, alias
+
+    def _resolve_content_type(self, filename: str, content_type: Optional[str]) -> Optional[str]:
+        """The supported format of a file, from its declared type or else its extension"""
+        if content_type in self.supported_formats:
+            return content_type
+        return CONTENT_TYPES_BY_SUFFIX.get(Path(filename).suffix.lower())
+
+    @staticmethod
+    def _is_archive(filename: str, content_type: Optional[str]) -> bool:
+        return content_type in ARCHIVE_CONTENT_TYPES or Path(filename or "").suffix.lower() == ".zip"
+
+    def validate_upload(self, content_type: Optional[str], access_level: str) -> None:
+        """Reject unsupported access levels and file formats"""
+        if access_level not in ACCESS_LEVELS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unsupported access level: {access_level}. Supported levels: {', '.join(ACCESS_LEVELS)}"
+            )
         
-        return doc_id
+        # Determine document format
+        if content_type not in self.supported_formats:
+            raise HTTPException(
+                status_code=400, 
+                detail=f"Unsupported file format: {content_type}. Supported formats: {', '.join(self.supported_formats.keys())}"
+            )
 
-    async def _extract_pdf_text(self, file: UploadFile) -> str:
-        """Extract text from PDF files"""
-        temp_path = DOCUMENTS_DIR / f"temp_{uuid.uuid4()}.pdf"
+    async def _store_original(self, read: Callable[[int], Awaitable[bytes]]) -> Tuple[str, int, Path]:
+        """Stream an upload to its content address, returning its SHA-256, size and path"""
+        partial_path = ORIGINALS_DIR / f".upload-{uuid.uuid4()}"
         try:
-            # Save to temporary file
-            with open(temp_path, "wb") as f:
-                shutil.copyfileobj(file.file, f)
-            
-            # Process PDF using pypdf
-            text = ""
-            with open(temp_path, "rb") as f:
-                pdf = pypdf.PdfReader(f)
-                for page in pdf.pages:
-                    text += page.extract_text() + "\n\n"
-            
-            return text
+            sha256, size = await self._store_upload(read, partial_path)
+            file_path = ORIGINALS_DIR / sha256
+            os.replace(partial_path, file_path)  # same bytes as any copy already there
         finally:
-            # Clean up temp file
-            if temp_path.exists():
-                os.remove(temp_path)
+            if partial_path.exists():
+                os.remove(partial_path)
+        return sha256, size, file_path
 
-    async def _extract_docx_text(self, file: UploadFile) -> str:
-        """Extract text from DOCX files"""
-        temp_path = DOCUMENTS_DIR / f"temp_{uuid.uuid4()}.docx"
+    async def replace_document(self, doc_id: str, file: UploadFile, title: Optional[str] = None,
+                               source: Optional[str] = None, access_level: Optional[str] = None) -> bool:
+        """
+        Store a new version of an existing document, keeping its ID.
+        Title, source and access level stay as they were unless given.
+        The text is extracted again later, by extract_document; returns False if the document does not exist.
+        """
+        metadata = self.metadata_store.get(doc_id)
+        if metadata is None:
+            return False
+        
+        self.validate_upload(file.content_type, access_level or metadata.get("access_level", "public"))
+        sha256, size, file_path = await self._store_original(file.read)
+        
+        updates = {
+            "filename": file.filename,
+            "content_type": file.content_type,
+            "size": size,
+            "sha256": sha256,
+            "original_file": str(file_path),
+            "text_file": str(TEXT_DIR / f"{sha256}.txt"),
+            "version": metadata.get("version", 1) + 1,
+            "updated_time": time.time()
+        }
+        if sha256 != metadata.get("sha256"):
+            updates["length"] = None
+        for key, value in (("title", title), ("source", source), ("access_level", access_level)):
+            if value:
+                updates[key] = value
+        
+        self.metadata_store.update(doc_id, updates)
+        if sha256 != metadata.get("sha256"):
+            self._release_content(metadata)
+        return True
+
+    def _release_content(self, metadata: Dict[str, Any]) -> None:
+        """Delete a document version's original and text files, unless another document still uses them"""
+        sha256 = metadata.get("sha256")
+        if sha256 and self.metadata_store.sha256_in_use(sha256):
+            return
+        
+        for key in ("original_file", "text_file"):
+            path = Path(metadata.get(key, ""))
+            if path.is_file():
+                os.remove(path)
+
+    def needs_extraction(self, doc_id: str) -> bool:
+        """Whether a document's text has not been extracted yet (e.g. its first ingestion failed)"""
+        metadata = self.get_metadata(doc_id)
+        return metadata is not None and metadata.get("length") is None
+
+    async def extract_document(self, doc_id: str) -> int:
+        """Extract a stored document's text to its text file, returning the text length"""
+        metadata = self.metadata_store.get(doc_id)
+        if metadata is None:
+            raise ValueError(f"Document not found: {doc_id}")
+        
+        # Extract text from the stored copy, writing it out piece by piece
+        extractor = self.supported_formats[metadata["content_type"]]
+        length = await self._write_text(extractor(Path(metadata["original_file"])), Path(metadata["text_file"]))
+        
+        self.metadata_store.update(doc_id, {"length": length})
+        return length
+
+    async def _store_upload(self, read: Callable[[int], Awaitable[bytes]], file_path: Path) -> Tuple[str, int]:
+        """Write an upload to disk chunk by chunk, returning its SHA-256 and size in bytes"""
+        digest = hashlib.sha256()
+        size = 0
+        with open(file_path, "wb") as f:
+            while True:
+                chunk = await read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+        return digest.hexdigest(), size
+
+    async def _write_text(self, pieces: AsyncIterator[str], text_file_path: Path) -> int:
+        """Write extracted text as it arrives, returning its length in characters"""
+        # Written beside the final path and renamed, so readers never see a partly extracted text
+        partial_path = text_file_path.with_suffix(".txt.partial")
+        length = 0
         try:
-            # Save to temporary file
-            with open(temp_path, "wb") as f:
-                shutil.copyfileobj(file.file, f)
-            
-            # Process DOCX using docx2txt
-            text = docx2txt.process(temp_path)
-            return text
+            with open(partial_path, "w", encoding="utf-8") as f:
+                async for piece in pieces:
+                    f.write(piece)
+                    length += len(piece)
+            os.replace(partial_path, text_file_path)
         finally:
-            # Clean up temp file
-            if temp_path.exists():
-                os.remove(temp_path)
+            if partial_path.exists():
+                os.remove(partial_path)
+        return length
+
+    async def _extract_pdf_text(self, path: Path) -> AsyncIterator[str]:
+        """Extract text from PDF files, page by page, in the extraction process pool"""
+        async for page_text in stream_pdf_pages(path):
+            yield page_text + "\n\n"
+
+    async def _extract_docx_text(self, path: Path) -> AsyncIterator[str]:
+        """Extract text from DOCX files"""
+        loop = asyncio.get_running_loop()
+        yield await loop.run_in_executor(None, docx2txt.process, str(path))
 
-    async def _extract_text_file(self, file: UploadFile) -> str:
+    async def _extract_text_file(self, path: Path) -> AsyncIterator[str]:
         """Extract text from plain text files"""
-        content = await file.read()
+        loop = asyncio.get_running_loop()
+        content = await loop.run_in_executor(None, path.read_bytes)
         try:
-            return content.decode("utf-8")
+            yield content.decode("utf-8")
         except UnicodeDecodeError:
             # Try different encoding if UTF-8 fails
-            return content.decode("latin-1")
+            yield content.decode("latin-1")
 
-    def _save_metadata(self, doc_id: str, metadata: Dict[str, Any]):
-        """Save document metadata to the metadata file"""
+    def update_metadata(self, doc_id: str, updates: Dict[str, Any]) -> bool:
+        """Merge updates into an existing document's metadata"""
         try:
-            # Load existing metadata
-            with open(METADATA_FILE, "r") as f:
-                all_metadata = json.load(f)
-            
-            # Add new metadata
-            all_metadata[doc_id] = metadata
-            
-            # Save updated metadata
-            with open(METADATA_FILE, "w") as f:
-                json.dump(all_metadata, f, indent=2)
-                
+            return self.metadata_store.update(doc_id, updates)
         except Exception as e:
-            print(f"Error saving metadata: {e}")
-            raise HTTPException(status_code=500, detail=f"Error saving document metadata: {str(e)}")
+            print(f"Error updating metadata: {e}")
+            return False
 
-    def list_documents(self) -> List[Dict[str, Any]]:
-        """Get a list of all document metadata"""
+    def update_metadata_many(self, updates: Dict[str, Dict[str, Any]]) -> List[str]:
+        """Merge updates into many documents' metadata in one write; returns the IDs updated"""
         try:
-            with open(METADATA_FILE, "r") as f:
-                all_metadata = json.load(f)
-            
-            # Return a list of metadata objects
-            return list(all_metadata.values())
-            
+            return self.metadata_store.update_many(updates)
+        except Exception as e:
+            print(f"Error updating metadata: {e}")
+            return []
+
+    def get_metadata(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        """Get the metadata for a single document"""
+        try:
+            return self.metadata_store.get(doc_id)
+        except Exception as e:
+            print(f"Error reading metadata: {e}")
+            return None
+
+    def list_document_ids(self) -> List[str]:
+        """Get the IDs of all documents"""
+        try:
+            return self.metadata_store.ids()
+        except Exception as e:
+            print(f"Error listing document IDs: {e}")
+            return []
+
+    def list_documents(self,
+                       source: Optional[str] = None,
+                       content_type: Optional[str] = None,
+                       uploaded_after: Optional[float] = None,
+                       uploaded_before: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Get document metadata, optionally filtered by source, content type and upload time"""
+        try:
+            return self.metadata_store.list(source=source, content_type=content_type,
+                                            uploaded_after=uploaded_after, uploaded_before=uploaded_before)
         except Exception as e:
             print(f"Error listing documents: {e}")
             return []
 
+    def list_document_page(self, limit: int, after: Optional[Tuple[float, str]] = None,
+                           fields: Optional[List[str]] = None, **filters) -> Tuple[int, List[Tuple[float, str, str]]]:
+        """
+        One page of document metadata as JSON text, with the metadata revision it was read at.
+        Filters are those of MetadataStore.list_json; errors are raised, since an empty page would look valid.
+        """
+        return self.metadata_store.list_json(limit, after=after, fields=fields, **filters)
+
+    def metadata_revision(self) -> int:
+        """Counter that advances on every metadata change"""
+        return self.metadata_store.revision()
+
     def delete_document(self, doc_id: str) -> bool:
         """Delete a document and its metadata"""
         try:
-            # Load existing metadata
-            with open(METADATA_FILE, "r") as f:
-                all_metadata = json.load(f)
-            
-            # Check if document exists
-            if doc_id not in all_metadata:
+            # Remove the metadata first, so the document disappears from listings at once
+            metadata = self.metadata_store.delete(doc_id)
+            if metadata is None:
                 return False
             
-            # Get metadata for the document
-            metadata = all_metadata[doc_id]
-            
-            # Delete the original file if it exists
-            original_file = Path(metadata.get("original_file", ""))
-            if original_file.exists():
-                os.remove(original_file)
-            
-            # Delete the text file if it exists
-            text_file = Path(metadata.get("text_file", ""))
-            if text_file.exists():
-                os.remove(text_file)
-            
-            # Remove from metadata
-            del all_metadata[doc_id]
-            
-            # Save updated metadata
-            with open(METADATA_FILE, "w") as f:
-                json.dump(all_metadata, f, indent=2)
+            # Delete the original and text files if no other document shares their content
+            self._release_content(metadata)
+            self.chunk_store.delete_document(doc_id)
             
             return True
             
@@ -211,25 +490,53 @@ class DocumentProcessor:
             return False
 
     def get_document_text(self, doc_id: str) -> Optional[str]:
-        """Get the extracted text for a document"""
+        """
+        Get the extracted text for a document.
+        Text waiting to be indexed is read from its extracted text file; once indexed,
+        the text lives only in the chunk store.
+        """
         try:
-            # Load metadata
-            with open(METADATA_FILE, "r") as f:
-                all_metadata = json.load(f)
-            
-            # Check if document exists
-            if doc_id not in all_metadata:
+            metadata = self.metadata_store.get(doc_id)
+            if metadata is None:
                 return None
             
             # Get text file path
-            text_file = Path(all_metadata[doc_id].get("text_file", ""))
-            if not text_file.exists():
-                return None
+            text_file = Path(metadata.get("text_file", ""))
+            if text_file.is_file():
+                with open(text_file, "r", encoding="utf-8") as f:
+                    return f.read()
             
-            # Read text file
-            with open(text_file, "r", encoding="utf-8") as f:
-                return f.read()
+            return self.chunk_store.document_text(doc_id, metadata.get("sha256"))
                 
         except Exception as e:
             print(f"Error getting document text: {e}")
             return None
+
+    def store_chunked_text(self, documents: List[Tuple[str, Optional[str], str, List[ChunkSpan]]]) -> None:
+        """
+        Move indexed documents' text, given as (doc_id, sha256, text, chunks), into the chunk store
+        and delete their extracted text files, so each document's text is kept once.
+        """
+        self.chunk_store.put_documents(documents)
+        for doc_id, sha256, _, _ in documents:
+            # A newer version may have been extracted meanwhile; its text file is not indexed yet
+            metadata = self.metadata_store.get(doc_id)
+            if metadata is None or metadata.get("sha256") != sha256:
+                continue
+            # replace_document can give another document the same content, and so the same text
+            # file; keep it until every document using it has been indexed
+            others = [other for other in self.metadata_store.ids_with_sha256(sha256) if other != doc_id]
+            versions = self.chunk_store.document_versions(others)
+            if any(versions.get(other) != sha256 for other in others):
+                continue
+            text_file = Path(metadata.get("text_file", ""))
+            if text_file.is_file():
+                os.remove(text_file)
+
+    def get_chunk_texts(self, chunk_ids: List[str]) -> Dict[str, str]:
+        """Text of indexed chunks by chunk ID, from the chunk store"""
+        try:
+            return self.chunk_store.get_chunks(chunk_ids)
+        except Exception as e:
+            print(f"Error reading chunk text: {e}")
+            return {}
@@ -0,0 +1,242 @@
+import os
+import time
+import uuid
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from metadata_store import ImmediateTransaction
+
+DATA_DIR = Path("./data")
+DATA_DIR.mkdir(parents=True, exist_ok=True)
+INGEST_DB = DATA_DIR / "ingestion_jobs.db"
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))  # per process
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "3"))
+INGEST_LEASE_SECONDS = float(os.getenv("INGEST_LEASE_SECONDS", "600"))  # a job not heard from for this long is requeued
+INGEST_RETRY_DELAY = float(os.getenv("INGEST_RETRY_DELAY", "30"))  # seconds, doubled on each attempt
+INGEST_POLL_INTERVAL = float(os.getenv("INGEST_POLL_INTERVAL", "1.0"))
+INGEST_NICENESS = int(os.getenv("INGEST_NICENESS", "10"))  # scheduling priority of ingestion threads
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "16"))  # jobs a worker claims and processes together
+
+# A job moves through these in order, ending in "indexed" or "failed"
+JOB_STATES = ["queued", "extracting", "chunking", "embedding", "indexed", "failed"]
+ACTIVE_STATES = ("extracting", "chunking", "embedding")
+
+class IngestionQueue:
+    """
+    Durable queue of document ingestion jobs, shared by all worker processes:
+    - Jobs live in SQLite, so they survive restarts
+    - A bounded number of low-priority threads per process claim jobs in small batches,
+      so documents uploaded together are extracted in parallel and embedded together
+    - A claimed job holds a lease, renewed while its batch runs; if its worker dies,
+      the job is requeued when the lease expires
+    - Failed attempts are retried with a growing delay, up to INGEST_MAX_ATTEMPTS
+    """
+
+    def __init__(self, path: Path = INGEST_DB, workers: int = INGEST_WORKERS):
+        self.path = Path(path)
+        self.workers = workers
+        self._local = threading.local()
+        self._threads: List[threading.Thread] = []
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+
+        self._connection().executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                doc_id TEXT NOT NULL,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                available_at REAL NOT NULL,
+                lease_expires_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, available_at);
+            CREATE INDEX IF NOT EXISTS jobs_doc_id ON jobs (doc_id);
+        """)
+
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread and process; SQLite connections must not cross either"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(str(self.path), timeout=10.0, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def enqueue(self, doc_id: str) -> str:
+        """Queue a document for ingestion and return the job ID"""
+        return self.enqueue_many([doc_id])[0]
+
+    def enqueue_many(self, doc_ids: List[str]) -> List[str]:
+        """Queue several documents in one transaction and return their job IDs"""
+        job_ids = [str(uuid.uuid4()) for _ in doc_ids]
+        now = time.time()
+        with ImmediateTransaction(self._connection()) as conn:
+            conn.executemany(
+                "INSERT INTO jobs (id, doc_id, state, created_at, updated_at, available_at) VALUES (?, ?, 'queued', ?, ?, ?)",
+                [(job_id, doc_id, now, now, now) for job_id, doc_id in zip(job_ids, doc_ids)]
+            )
+        self._wakeup.set()
+        return job_ids
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Status of a job, or None"""
+        row = self._connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def _claim(self, limit: int = INGEST_BATCH_SIZE) -> List[Dict[str, Any]]:
+        """
+        Take the oldest runnable jobs: queued and due, or abandoned by a worker whose lease ran out.
+        Abandoned jobs that have used their last attempt are failed instead.
+        """
+        now = time.time()
+        with ImmediateTransaction(self._connection()) as conn:
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE (state = 'queued' AND available_at <= ?) "
+                "OR (state IN (?, ?, ?) AND lease_expires_at < ?) "
+                "ORDER BY available_at LIMIT ?",
+                (now,) + ACTIVE_STATES + (now, limit)
+            ).fetchall()
+
+            jobs = []
+            for row in rows:
+                job = dict(row)
+                if job["state"] != "queued" and job["attempts"] >= INGEST_MAX_ATTEMPTS:
+                    # The last attempt's worker died; retrying would exceed INGEST_MAX_ATTEMPTS
+                    conn.execute(
+                        "UPDATE jobs SET state = 'failed', error = ?, updated_at = ?, lease_expires_at = NULL WHERE id = ?",
+                        (f"Lease expired on attempt {job['attempts']}", now, job["id"])
+                    )
+                    continue
+                job["attempts"] += 1
+                job["state"] = "extracting"
+                conn.execute(
+                    "UPDATE jobs SET state = ?, attempts = ?, updated_at = ?, lease_expires_at = ? WHERE id = ?",
+                    (job["state"], job["attempts"], now, now + INGEST_LEASE_SECONDS, job["id"])
+                )
+                jobs.append(job)
+            return jobs
+
+    def set_state(self, job_ids: List[str], state: str) -> None:
+        """Move jobs to their next stage, renewing their leases"""
+        now = time.time()
+        self._connection().executemany(
+            "UPDATE jobs SET state = ?, updated_at = ?, lease_expires_at = ? WHERE id = ?",
+            [(state, now, now + INGEST_LEASE_SECONDS, job_id) for job_id in job_ids]
+        )
+
+    def renew(self, job_ids: List[str]) -> None:
+        """Extend the leases of jobs still being worked on"""
+        now = time.time()
+        self._connection().executemany(
+            f"UPDATE jobs SET updated_at = ?, lease_expires_at = ? WHERE id = ? AND state IN ({', '.join('?' * len(ACTIVE_STATES))})",
+            [(now, now + INGEST_LEASE_SECONDS, job_id) + ACTIVE_STATES for job_id in job_ids]
+        )
+
+    def _heartbeat(self, job_ids: List[str], done: threading.Event) -> None:
+        """Renew a running batch's leases well before they expire, however long one stage takes"""
+        while not done.wait(INGEST_LEASE_SECONDS / 3):
+            try:
+                self.renew(job_ids)
+            except sqlite3.Error as e:
+                print(f"Error renewing ingestion leases: {e}")
+
+    def _finish(self, job_id: str) -> None:
+        self._connection().execute(
+            "UPDATE jobs SET state = 'indexed', error = NULL, updated_at = ?, lease_expires_at = NULL WHERE id = ?",
+            (time.time(), job_id)
+        )
+
+    def _fail(self, job: Dict[str, Any], error: str) -> None:
+        """Requeue a failed attempt with backoff, or give up after the last attempt"""
+        now = time.time()
+        if job["attempts"] < INGEST_MAX_ATTEMPTS:
+            state = "queued"
+            available_at = now + INGEST_RETRY_DELAY * 2 ** (job["attempts"] - 1)
+        else:
+            state = "failed"
+            available_at = now
+        self._connection().execute(
+            "UPDATE jobs SET state = ?, error = ?, updated_at = ?, available_at = ?, lease_expires_at = NULL WHERE id = ?",
+            (state, error, now, available_at, job["id"])
+        )
+
+    def _worker(self, process: Callable[[List[str], Callable[[str], None]], Dict[str, str]]) -> None:
+        """Claim and run batches of jobs until stopped"""
+        # Lower this thread's priority so ingestion bursts yield the CPU to chat requests (Linux only)
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), INGEST_NICENESS)
+        except (AttributeError, OSError):
+            pass
+
+        while not self._stop.is_set():
+            try:
+                jobs = self._claim()
+            except sqlite3.Error as e:
+                print(f"Error claiming ingestion jobs: {e}")
+                jobs = []
+
+            if not jobs:
+                self._wakeup.wait(INGEST_POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+
+            job_ids = [job["id"] for job in jobs]
+            doc_ids = list(dict.fromkeys(job["doc_id"] for job in jobs))
+            done = threading.Event()
+            heartbeat = threading.Thread(target=self._heartbeat, args=(job_ids, done),
+                                         name=f"{threading.current_thread().name}-lease", daemon=True)
+            heartbeat.start()
+            try:
+                failures = process(doc_ids, lambda state: self.set_state(job_ids, state))
+            except Exception as e:
+                failures = {doc_id: str(e) for doc_id in doc_ids}
+            finally:
+                done.set()
+                heartbeat.join()
+
+            for job in jobs:
+                error = failures.get(job["doc_id"])
+                if error is None:
+                    self._finish(job["id"])
+                else:
+                    print(f"Error ingesting document {job['doc_id']} (attempt {job['attempts']}): {error}")
+                    self._fail(job, error)
+
+    def start(self, process: Callable[[List[str], Callable[[str], None]], Dict[str, str]]) -> None:
+        """
+        Start the worker threads.
+        process(doc_ids, set_state) ingests a batch of documents, reporting each stage
+        through set_state, and returns {doc_id: error} for the documents that failed.
+        """
+        if self._threads or self.workers <= 0:
+            return
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, args=(process,), name=f"ingest-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        print(f"Ingestion queue started with {self.workers} workers")
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Stop claiming jobs; a job still running is requeued by its lease if the process exits"""
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Number of jobs in each state"""
+        counts = dict(self._connection().execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+        stats = {state: counts.get(state, 0) for state in JOB_STATES}
+        stats["workers"] = len(self._threads)
+        return stats
@@ -0,0 +1,60 @@
+import os
+import fcntl
+import threading
+from pathlib import Path
+
+DATA_DIR = Path("./data")
+DATA_DIR.mkdir(parents=True, exist_ok=True)
+EPOCH_FILE = DATA_DIR / "knowledge_epoch"
+EPOCH_LOCK_FILE = DATA_DIR / "knowledge_epoch.lock"
+
+# Caches keyed on the epoch are invalidated the moment knowledge changes,
+# so their TTL only bounds how long unused entries linger
+EPOCH_CACHE_TTL = int(os.getenv("EPOCH_CACHE_TTL", str(6 * 3600)))  # seconds
+
+_lock = threading.Lock()
+_cached_stat = None
+_cached_epoch = 0
+
+def current_epoch() -> int:
+    """
+    Return the current knowledge epoch, shared by all worker processes.
+    The file is only re-read when it has been replaced since the last call.
+    """
+    global _cached_stat, _cached_epoch
+    try:
+        stat = os.stat(EPOCH_FILE)
+    except FileNotFoundError:
+        return 0
+
+    key = (stat.st_ino, stat.st_mtime_ns)
+    with _lock:
+        if key != _cached_stat:
+            try:
+                with open(EPOCH_FILE, "r") as f:
+                    _cached_epoch = int(f.read().strip() or 0)
+                _cached_stat = key
+            except (OSError, ValueError) as e:
+                print(f"Error reading knowledge epoch: {e}")
+        return _cached_epoch
+
+def bump_epoch() -> int:
+    """Advance the knowledge epoch after the indexed knowledge has changed"""
+    with open(EPOCH_LOCK_FILE, "a+") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            try:
+                with open(EPOCH_FILE, "r") as f:
+                    epoch = int(f.read().strip() or 0)
+            except (FileNotFoundError, ValueError):
+                epoch = 0
+
+            epoch += 1
+            temp_path = EPOCH_FILE.with_suffix(".tmp")
+            with open(temp_path, "w") as f:
+                f.write(str(epoch))
+            # Replacing the file gives it a new inode, which readers use to detect the change
+            os.replace(temp_path, EPOCH_FILE)
+            return epoch
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -1,17 +1,33 @@
 
 import os
+import re
 import json
+import base64
+import time
+import fcntl
+import asyncio
 import uvicorn
+from contextlib import contextmanager
+from pathlib import Path
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Body, Request, BackgroundTasks
+from fastapi.responses import Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import Callable, Iterator, List, Optional, Dict, Any, Tuple
 
 # Import the modules
 from document_processor import DocumentProcessor
 from retrieval_engine_extended import ExtendedRetrievalEngine
 from prompt_engine import PromptEngine
 from prompt_engine.nyptho_integration import NypthoIntegration
+from deadline import Deadline
+from query_analysis import QueryAnalysis
+from ttl_cache import get_cache_stats
+from shared_cache import get_shared_cache
+from materialized_answers import MaterializedAnswerStore
+from pdf_extraction import shutdown_extraction_pool
+from ingestion_queue import IngestionQueue
+from upload_sessions import UploadSessions
 
 # Create FastAPI app
 app = FastAPI(title="ALU Chatbot Backend")
@@ -25,11 +41,29 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize components
-document_processor = DocumentProcessor()
-retrieval_engine = ExtendedRetrievalEngine()
-prompt_engine = PromptEngine()
-nyptho = NypthoIntegration()  # Initialize Nyptho
+# Initialize components. PDF extraction workers are spawned, and when the server is started
+# with `python main.py` spawn re-runs this file in each of them as __mp_main__; they need
+# none of the components, so the models and stores are only loaded in the server itself
+if __name__ != "__mp_main__":
+    document_processor = DocumentProcessor()
+    retrieval_engine = ExtendedRetrievalEngine()
+    prompt_engine = PromptEngine()
+    nyptho = NypthoIntegration()  # Initialize Nyptho
+    materialized_answers = MaterializedAnswerStore()
+    ingestion_queue = IngestionQueue()
+    upload_sessions = UploadSessions()
+    # Documents that lose the chunks they linked to get their own ingestion jobs
+    retrieval_engine.requeue_documents = ingestion_queue.enqueue_many
+# Extraction runs in parallel across ingestion workers; indexing runs one batch at a time
+# across every thread and worker process
+INDEX_LOCK_FILE = Path("./data") / "index.lock"
+
+# Documents per /documents page, by default and at most; pages with more rows than
+# DOCUMENT_STREAM_ROWS are encoded and sent in pieces instead of as one body
+DOCUMENT_PAGE_SIZE = int(os.getenv("DOCUMENT_PAGE_SIZE", "100"))
+DOCUMENT_PAGE_MAX = int(os.getenv("DOCUMENT_PAGE_MAX", "1000"))
+DOCUMENT_STREAM_ROWS = 200
+METADATA_FIELD = re.compile(r"[A-Za-z0-9_]+")
 
 # Define request models
 class ChatRequest(BaseModel):
@@ -48,6 +82,14 @@ class DocumentMetadata(BaseModel):
     source: str
     date: Optional[str] = None
 
+class UploadStart(BaseModel):
+    filename: str
+    content_type: str
+    size: Optional[int] = None
+    title: Optional[str] = None
+    source: str = "user-upload"
+    access_level: str = "public"
+
 class PersonalitySettings(BaseModel):
     helpfulness: float
     creativity: float
@@ -83,12 +125,101 @@ async def health():
         print(f"Health check error: {e}")
         raise HTTPException(status_code=500, detail="System health check failed")
 
+async def answer_chat(query: str, role: str, conversation_history: List[Dict[str, Any]],
+                      options: Optional[Dict[str, Any]], analysis: QueryAnalysis,
+                      deadline: Deadline) -> Dict[str, Any]:
+    """Retrieve context and generate the response for a chat message"""
+    # Get relevant context from the retrieval engine
+    context_docs = await retrieval_engine.aretrieve_context(
+        query=query,
+        role=role,
+        deadline=deadline,
+        analysis=analysis
+    )
+    
+    # Generate response using the prompt engine
+    response = await prompt_engine.agenerate_response(
+        query=query,
+        context=context_docs,
+        conversation_history=conversation_history,
+        role=role,
+        options=options,
+        deadline=deadline,
+        analysis=analysis
+    )
+    
+    # Extract sources for attribution
+    sources = []
+    for doc in context_docs[:3]:  # Top 3 sources
+        if doc.metadata and 'source' in doc.metadata:
+            source = {
+                'title': doc.metadata.get('title', 'ALU Knowledge Base'),
+                'source': doc.metadata.get('source', 'ALU Brain')
+            }
+            if source not in sources:  # Avoid duplicates
+                sources.append(source)
+    
+    return {"response": response, "sources": sources, "context": context_docs}
+
+async def materialize_chat_answer(query: str, role: str) -> Optional[Dict[str, Any]]:
+    """Precompute a /chat answer for a frequent question; partial answers are not kept"""
+    deadline = Deadline()
+    answer = await answer_chat(query, role, [], {"role": role}, QueryAnalysis(query), deadline)
+    return None if deadline.degraded else answer
+
+@contextmanager
+def index_lock():
+    """flock held while the vector store is indexed or rebuilt, shared by all worker processes"""
+    with open(INDEX_LOCK_FILE, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def ingest_documents(doc_ids: List[str], set_state: Callable[[str], None]) -> Dict[str, str]:
+    """
+    Run a batch of ingestion jobs on a queue worker thread: extract the documents in parallel,
+    then chunk them and embed their new chunks together. Returns {doc_id: error} for failures.
+    """
+    set_state("extracting")
+    failures = asyncio.run(extract_documents(doc_ids))
+    
+    with index_lock():
+        failures.update(retrieval_engine.index_documents([d for d in doc_ids if d not in failures], on_stage=set_state))
+    return failures
+
+def rebuild_index_exclusively():
+    """Rebuild the vector index, holding off queued indexing in every process until it is done"""
+    with index_lock():
+        retrieval_engine.rebuild_index()
+
+async def extract_documents(doc_ids: List[str]) -> Dict[str, str]:
+    """Extract several documents concurrently; returns {doc_id: error} for those that failed"""
+    results = await asyncio.gather(*(document_processor.extract_document(doc_id) for doc_id in doc_ids),
+                                   return_exceptions=True)
+    return {doc_id: str(result) for doc_id, result in zip(doc_ids, results) if isinstance(result, Exception)}
+
+@app.on_event("startup")
+async def start_background_tasks():
+    """Start refreshing materialized answers for the most frequent questions, and the ingestion workers"""
+    materialized_answers.start(materialize_chat_answer)
+    ingestion_queue.start(ingest_documents)
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    await materialized_answers.stop()
+    ingestion_queue.stop()
+    shutdown_extraction_pool()
+
 @app.post("/chat")
 async def chat(request: ChatRequest):
     """Process a chat message and return a response"""
     try:
         # Extract the user message
         query = request.message
+        deadline = Deadline()
+        analysis = QueryAnalysis(query)  # Shared by every component below
         
         # Convert history format if needed
         conversation_history = []
@@ -102,44 +233,28 @@ async def chat(request: ChatRequest):
         if request.options and "role" in request.options:
             role = request.options["role"]
         
-        # Get relevant context from the retrieval engine
-        context_docs = retrieval_engine.retrieve_context(
-            query=query,
-            role=role
-        )
-        
-        # Generate response using the prompt engine
-        response = prompt_engine.generate_response(
-            query=query,
-            context=context_docs,
-            conversation_history=conversation_history,
-            role=role,
-            options=request.options
-        )
+        # Frequent questions are answered from the materialized store without
+        # retrieval or generation; the history does not change the generated text
+        materialized_key = analysis.key(role)
+        materialized_answers.record(materialized_key, query, role)
+        answer = materialized_answers.lookup(materialized_key)
+        if answer is None:
+            answer = await answer_chat(query, role, conversation_history, request.options, analysis, deadline)
         
         # Have Nyptho observe this interaction
         nyptho.observe_model(
             query=query,
-            response=response,
+            response=answer["response"],
             model_id="alu_prompt_engine",
-            context=context_docs
+            context=answer["context"],
+            analysis=analysis
         )
         
-        # Extract sources for attribution
-        sources = []
-        for doc in context_docs[:3]:  # Top 3 sources
-            if doc.metadata and 'source' in doc.metadata:
-                source = {
-                    'title': doc.metadata.get('title', 'ALU Knowledge Base'),
-                    'source': doc.metadata.get('source', 'ALU Brain')
-                }
-                if source not in sources:  # Avoid duplicates
-                    sources.append(source)
-        
         return {
-            "response": response,
-            "sources": sources,
-            "engine": "alu_prompt_engine"
+            "response": answer["response"],
+            "sources": answer["sources"],
+            "engine": "alu_prompt_engine",
+            "degraded": deadline.degraded
         }
     except Exception as e:
         print(f"Error processing chat message: {e}")
@@ -149,10 +264,15 @@ async def chat(request: ChatRequest):
 async def generate_response(request: QueryRequest):
     """Generate a response for the user query"""
     try:
+        deadline = Deadline()
+        analysis = QueryAnalysis(request.query)  # Shared by every component below
+        
         # Get relevant context from the retrieval engine
-        context_docs = retrieval_engine.retrieve_context(
+        context_docs = await retrieval_engine.aretrieve_context(
             query=request.query, 
-            role=request.role
+            role=request.role,
+            deadline=deadline,
+            analysis=analysis
         )
         
         # Check if we should use Nyptho
@@ -173,17 +293,20 @@ async def generate_response(request: QueryRequest):
             response = nyptho.generate_response(
                 query=request.query,
                 context=context_docs,
-                personality=personality
+                personality=personality,
+                analysis=analysis
             )
             model_id = "nyptho"
         else:
             # Use standard prompt engine
-            response = prompt_engine.generate_response(
+            response = await prompt_engine.agenerate_response(
                 query=request.query,
                 context=context_docs,
                 conversation_history=request.conversation_history,
                 role=request.role,
-                options=request.options
+                options=request.options,
+                deadline=deadline,
+                analysis=analysis
             )
         
         # Have Nyptho observe this interaction (it learns from all responses)
@@ -192,52 +315,267 @@ async def generate_response(request: QueryRequest):
                 query=request.query,
                 response=response,
                 model_id=model_id,
-                context=context_docs
+                context=context_docs,
+                analysis=analysis
             )
         
         return {
             "response": response,
             "sources": [doc.metadata for doc in context_docs[:3]] if context_docs else [],
-            "engine": model_id
+            "engine": model_id,
+            "degraded": deadline.degraded
         }
     except Exception as e:
         print(f"Error generating response: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def queue_stored_document(doc_id: str, created: bool) -> Dict[str, Any]:
+    """Queue a just-stored upload for ingestion and describe the outcome"""
+    # Identical bytes were uploaded before: nothing to extract or embed again
+    if not created and not document_processor.needs_extraction(doc_id):
+        return {"status": "success", "message": "Document already exists; upload recorded as an alias",
+                "doc_id": doc_id, "job_id": None, "duplicate": True}
+    
+    job_id = ingestion_queue.enqueue(doc_id)
+    return {"status": "success", "message": "Document uploaded and queued for indexing",
+            "doc_id": doc_id, "job_id": job_id, "duplicate": not created}
+
 @app.post("/upload-document")
 async def upload_document(
     file: UploadFile = File(...),
     title: str = Form(None),
     source: str = Form("user-upload"),
-    background_tasks: BackgroundTasks = None
+    access_level: str = Form("public")
 ):
-    """Upload and process a document into the vector store"""
+    """Upload a document and queue it for extraction and indexing"""
     try:
-        # Process the document
-        doc_id = await document_processor.process_document(file, title, source)
+        # Store the original; the ingestion queue extracts and indexes it
+        doc_id, created = await document_processor.store_document(file, title, source, access_level)
+        return queue_stored_document(doc_id, created)
+    except Exception as e:
+        print(f"Error uploading document: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/upload-documents")
+async def upload_documents(
+    files: List[UploadFile] = File(...),
+    source: str = Form("user-upload"),
+    access_level: str = Form("public")
+):
+    """Upload many documents, or zip archives of them, and queue them for indexing together"""
+    try:
+        start = time.perf_counter()
+        report = await document_processor.store_documents(files, source, access_level)
         
-        # Add background task to update the vector store
-        if background_tasks:
-            background_tasks.add_task(
-                retrieval_engine.update_vector_store,
-                doc_id
-            )
+        # New documents, plus known ones whose first ingestion never finished, go to the queue in one write
+        to_ingest = []
+        queued = set()
+        for entry in report:
+            doc_id = entry.get("doc_id")
+            if doc_id is None or doc_id in queued:
+                continue
+            if not entry["duplicate"] or document_processor.needs_extraction(doc_id):
+                to_ingest.append(entry)
+                queued.add(doc_id)
+        job_ids = ingestion_queue.enqueue_many([entry["doc_id"] for entry in to_ingest])
+        for entry, job_id in zip(to_ingest, job_ids):
+            entry["job_id"] = job_id
         
-        return {"status": "success", "message": "Document uploaded successfully", "doc_id": doc_id}
+        return {
+            "status": "success",
+            "files": len(report),
+            "stored": sum(1 for entry in report if entry.get("duplicate") is False),
+            "duplicates": sum(1 for entry in report if entry.get("duplicate")),
+            "failed": sum(1 for entry in report if "error" in entry),
+            "bytes": sum(entry.get("size", 0) for entry in report),
+            "seconds": round(time.perf_counter() - start, 3),
+            "documents": report
+        }
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error uploading document: {e}")
+        print(f"Error uploading documents: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/uploads")
+async def start_upload(upload: UploadStart):
+    """
+    Start a resumable upload, for large documents on unreliable connections.
+    Send the file with PUT /uploads/{upload_id}?offset=N, in one or more parts, resuming
+    from the offset GET /uploads/{upload_id} reports after a failure; then finalize it.
+    """
+    document_processor.validate_upload(upload.content_type, upload.access_level)
+    try:
+        return upload_sessions.create(upload.filename, upload.content_type, upload.title, upload.source,
+                                      upload.access_level, upload.size)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error starting upload: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.put("/uploads/{upload_id}")
+async def upload_part(upload_id: str, offset: int, request: Request):
+    """Append the request body to an upload at offset, which must be where the previous part ended"""
+    try:
+        return await upload_sessions.write_part(upload_id, offset, request.stream())
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error receiving upload part: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/uploads/{upload_id}")
+async def get_upload(upload_id: str):
+    """Status of a resumable upload, including the offset to resume from"""
+    upload = upload_sessions.get(upload_id)
+    if upload is None:
+        raise HTTPException(status_code=404, detail=f"Upload not found: {upload_id}")
+    return upload
+
+@app.post("/uploads/{upload_id}/finalize")
+async def finalize_upload(upload_id: str):
+    """Store a completed upload as a document and queue it for extraction and indexing"""
+    try:
+        session, path, sha256, size = await upload_sessions.finish(upload_id)
+        try:
+            doc_id, created = document_processor.store_uploaded_file(
+                path, sha256, size, session["filename"], session["content_type"],
+                session["title"], session["source"], session["access_level"])
+        except Exception:
+            upload_sessions.release(upload_id, session["writer"])
+            raise
+        upload_sessions.remove(upload_id, session["writer"])
+        return queue_stored_document(doc_id, created)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error finalizing upload: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.delete("/uploads/{upload_id}")
+async def cancel_upload(upload_id: str):
+    """Abandon a resumable upload and delete what was received; 409 while a part or the finish is running"""
+    if not upload_sessions.remove(upload_id):
+        raise HTTPException(status_code=404, detail=f"Upload not found: {upload_id}")
+    return {"status": "success", "message": f"Upload {upload_id} cancelled"}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status of a document ingestion job"""
+    job = ingestion_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+def encode_cursor(upload_time: float, doc_id: str) -> str:
+    """Opaque /documents cursor pointing just past the given document"""
+    return base64.urlsafe_b64encode(json.dumps([upload_time, doc_id]).encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor: str) -> Tuple[float, str]:
+    """(upload_time, doc_id) from a /documents cursor; ValueError if it is not one"""
+    try:
+        upload_time, doc_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return float(upload_time), str(doc_id)
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header names the given ETag"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+def encode_document_page(rows: List[Tuple[float, str, str]], next_cursor: Optional[str]) -> Iterator[str]:
+    """The /documents body, a few hundred documents per piece; rows already hold each document's JSON"""
+    yield '{"documents": ['
+    for start in range(0, len(rows), DOCUMENT_STREAM_ROWS):
+        yield ("," if start else "") + ",".join(data for _, _, data in rows[start:start + DOCUMENT_STREAM_ROWS])
+    yield f'], "next_cursor": {json.dumps(next_cursor)}}}'
+
 @app.get("/documents")
-async def list_documents():
-    """List all available documents in the knowledge base"""
+async def list_documents(
+    request: Request,
+    source: Optional[str] = None,
+    title_prefix: Optional[str] = None,
+    content_type: Optional[str] = None,
+    uploaded_after: Optional[float] = None,
+    uploaded_before: Optional[float] = None,
+    cursor: Optional[str] = None,
+    limit: int = DOCUMENT_PAGE_SIZE,
+    fields: Optional[str] = None
+):
+    """
+    List documents in the knowledge base a page at a time, oldest upload first, optionally filtered.
+    Pass next_cursor back as cursor for the following page; it is null on the last one.
+    fields (comma-separated) limits the metadata returned for each document to those keys and id.
+    The ETag changes only when document metadata does, so a poll with If-None-Match gets
+    304 Not Modified until then.
+    """
+    if not 1 <= limit <= DOCUMENT_PAGE_MAX:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {DOCUMENT_PAGE_MAX}")
+    
+    field_list = None
+    if fields:
+        field_list = list(dict.fromkeys(["id"] + [field.strip() for field in fields.split(",") if field.strip()]))
+        invalid = [field for field in field_list if not METADATA_FIELD.fullmatch(field)]
+        if invalid:
+            raise HTTPException(status_code=400, detail=f"Invalid fields: {', '.join(invalid)}")
+    
     try:
-        documents = document_processor.list_documents()
-        return {"documents": documents}
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    try:
+        # Unchanged metadata: answer from the revision counter alone
+        etag = f'"documents-{document_processor.metadata_revision()}"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        
+        # One row more than the page, to tell whether another page follows
+        revision, rows = document_processor.list_document_page(
+            limit + 1, after=after, fields=field_list, source=source, content_type=content_type,
+            uploaded_after=uploaded_after, uploaded_before=uploaded_before, title_prefix=title_prefix)
+        headers["ETag"] = f'"documents-{revision}"'
+        
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][0], rows[-1][1])
+        
+        body = encode_document_page(rows, next_cursor)
+        if len(rows) > DOCUMENT_STREAM_ROWS:
+            return StreamingResponse(body, media_type="application/json", headers=headers)
+        return Response("".join(body), media_type="application/json", headers=headers)
     except Exception as e:
         print(f"Error listing documents: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.put("/documents/{doc_id}")
+async def update_document(
+    doc_id: str,
+    file: UploadFile = File(...),
+    title: str = Form(None),
+    source: str = Form(None),
+    access_level: str = Form(None)
+):
+    """Upload a new version of a document; only chunks that changed are re-embedded"""
+    try:
+        if not await document_processor.replace_document(doc_id, file, title, source, access_level):
+            raise HTTPException(status_code=404, detail="Document not found")
+        
+        job_id = ingestion_queue.enqueue(doc_id)
+        return {"status": "success", "message": "Document updated and queued for re-indexing",
+                "doc_id": doc_id, "job_id": job_id}
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error updating document: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.delete("/documents/{doc_id}")
 async def delete_document(doc_id: str):
     """Delete a document from the knowledge base"""
@@ -257,7 +595,7 @@ async def delete_document(doc_id: str):
 async def rebuild_index(background_tasks: BackgroundTasks):
     """Rebuild the vector index with all documents"""
     try:
-        background_tasks.add_task(retrieval_engine.rebuild_index)
+        background_tasks.add_task(rebuild_index_exclusively)
         return {"status": "success", "message": "Index rebuild started in the background"}
     except Exception as e:
         print(f"Error starting index rebuild: {e}")
@@ -294,6 +632,24 @@ async def get_search_stats():
     """Get search engine performance statistics"""
     try:
         search_stats = retrieval_engine.alu_brain.search_engine.get_search_stats()
+        search_stats["semantic_cache"] = retrieval_engine.semantic_cache.get_stats()
+        search_stats["caches"] = get_cache_stats()
+        search_stats["materialized_answers"] = materialized_answers.get_stats()
+        shared_cache = get_shared_cache()
+        if shared_cache is not None:
+            search_stats["shared_cache"] = shared_cache.get_stats()
+        search_stats["ingestion"] = ingestion_queue.get_stats()
+        search_stats["dedup"] = retrieval_engine.dedup_index.get_stats()
+        search_stats["chunk_store"] = document_processor.chunk_store.get_stats()
+        if retrieval_engine.vector_index is not None:
+            search_stats["vector_index"] = retrieval_engine.vector_index.get_stats()
+        search_stats["tiered_retrieval"] = retrieval_engine.get_tier_stats()
+        search_stats["coalescing"] = {
+            "retrieval": retrieval_engine.get_coalescing_stats(),
+            "generation": prompt_engine.get_coalescing_stats()
+        }
+        if retrieval_engine.reranker is not None:
+            search_stats["reranker"] = retrieval_engine.reranker.get_stats()
         return search_stats
     except Exception as e:
         print(f"Error getting search stats: {e}")
@@ -302,4 +658,6 @@ async def get_search_stats():
 # Run the server
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8000))
-    uvicorn.run("main:app", host="0.0.0.0", port=port, reload=False)  # Set reload to False for production
+    # Serve this module's app rather than "main:app", which would import main.py a second time
+    # and build every component twice
+    uvicorn.run(app, host="0.0.0.0", port=port, reload=False)  # Set reload to False for production
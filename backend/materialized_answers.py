@@ -0,0 +1,150 @@
+import os
+import time
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from knowledge_epoch import current_epoch
+
+# How many of the most frequent questions keep a precomputed answer
+MATERIALIZED_TOP_N = int(os.getenv("MATERIALIZED_TOP_N", "200"))
+MATERIALIZED_REFRESH_INTERVAL = float(os.getenv("MATERIALIZED_REFRESH_INTERVAL", "60"))  # seconds
+MATERIALIZED_MIN_COUNT = float(os.getenv("MATERIALIZED_MIN_COUNT", "3"))  # asks before an answer is kept
+MATERIALIZED_HALF_LIFE = float(os.getenv("MATERIALIZED_HALF_LIFE", "1800"))  # seconds of popularity memory
+MATERIALIZED_TRACKED = 20000  # fingerprints whose frequency is tracked
+
+class MaterializedAnswerStore:
+    """
+    Precomputed full answers for the most frequently asked questions:
+    - Counts how often each query fingerprint is asked, with exponential decay
+    - A background task recomputes answers for the top N fingerprints
+    - Answers from an older knowledge epoch are never served
+    """
+
+    def __init__(self,
+                 top_n: int = MATERIALIZED_TOP_N,
+                 refresh_interval: float = MATERIALIZED_REFRESH_INTERVAL,
+                 min_count: float = MATERIALIZED_MIN_COUNT,
+                 half_life: float = MATERIALIZED_HALF_LIFE):
+        self.top_n = top_n
+        self.refresh_interval = refresh_interval
+        self.min_count = min_count
+        self.decay = 0.5 ** (refresh_interval / half_life) if half_life > 0 else 0.0
+
+        # Only touched from the event loop, so no locking is needed
+        self._counts: Dict[str, float] = {}
+        self._samples: Dict[str, Tuple[str, str]] = {}  # key -> (query, role) to recompute with
+        self._answers: Dict[str, Tuple[int, Dict[str, Any]]] = {}  # key -> (epoch, answer)
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {
+            "lookups": 0,
+            "hits": 0,
+            "refreshes": 0,
+            "computed": 0,
+            "failed": 0,
+            "last_refresh_seconds": 0.0
+        }
+
+    def record(self, key: str, query: str, role: str) -> None:
+        """Count one request for a fingerprint"""
+        self._counts[key] = self._counts.get(key, 0.0) + 1.0
+        if key not in self._samples:
+            self._samples[key] = (query, role)
+
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the materialized answer for a fingerprint, if it is current"""
+        self._stats["lookups"] += 1
+        entry = self._answers.get(key)
+        if entry is None or entry[0] != current_epoch():
+            return None
+        self._stats["hits"] += 1
+        return entry[1]
+
+    def hot_keys(self) -> List[str]:
+        """The top N fingerprints that are asked often enough to materialize"""
+        ranked = sorted(self._counts.items(), key=lambda item: item[1], reverse=True)
+        return [key for key, count in ranked[:self.top_n] if count >= self.min_count]
+
+    async def refresh(self, compute: Callable[[str, str], Awaitable[Optional[Dict[str, Any]]]]) -> None:
+        """
+        Recompute answers for hot fingerprints that are missing or from an older epoch,
+        and drop answers for fingerprints that are no longer hot.
+        compute(query, role) returns the answer, or None if it should not be kept.
+        """
+        start = time.perf_counter()
+        hot = self.hot_keys()
+        hot_set = set(hot)
+
+        for key in list(self._answers):
+            if key not in hot_set:
+                del self._answers[key]
+
+        for key in hot:
+            epoch = current_epoch()
+            entry = self._answers.get(key)
+            if entry is not None and entry[0] == epoch:
+                continue
+
+            query, role = self._samples[key]
+            try:
+                answer = await compute(query, role)
+            except Exception as e:
+                print(f"Error materializing answer for '{query}': {e}")
+                self._stats["failed"] += 1
+                continue
+
+            # Tag with the epoch read before computing, so a concurrent change is not missed
+            if answer is not None:
+                self._answers[key] = (epoch, answer)
+                self._stats["computed"] += 1
+
+        self._decay_counts()
+        self._stats["refreshes"] += 1
+        self._stats["last_refresh_seconds"] = round(time.perf_counter() - start, 3)
+
+    def _decay_counts(self) -> None:
+        """Age frequencies so the store follows what is being asked now"""
+        for key in list(self._counts):
+            self._counts[key] *= self.decay
+            if self._counts[key] < 0.5:
+                del self._counts[key]
+                self._samples.pop(key, None)
+
+        if len(self._counts) > MATERIALIZED_TRACKED:
+            ranked = sorted(self._counts.items(), key=lambda item: item[1], reverse=True)
+            for key, _ in ranked[MATERIALIZED_TRACKED:]:
+                del self._counts[key]
+                self._samples.pop(key, None)
+
+    async def run(self, compute: Callable[[str, str], Awaitable[Optional[Dict[str, Any]]]]) -> None:
+        """Refresh periodically until cancelled"""
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh(compute)
+            except Exception as e:
+                print(f"Error refreshing materialized answers: {e}")
+
+    def start(self, compute: Callable[[str, str], Awaitable[Optional[Dict[str, Any]]]]) -> None:
+        """Start the background refresh task on the running event loop"""
+        if self._task is None and self.top_n > 0:
+            self._task = asyncio.get_running_loop().create_task(self.run(compute))
+            print(f"Materialized answers enabled for the top {self.top_n} questions")
+
+    async def stop(self) -> None:
+        """Cancel the background refresh task"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit and refresh statistics"""
+        stats = self._stats.copy()
+        stats["tracked"] = len(self._counts)
+        stats["materialized"] = len(self._answers)
+        stats["top_n"] = self.top_n
+        stats["hit_rate"] = stats["hits"] / stats["lookups"] if stats["lookups"] > 0 else 0
+        return stats
@@ -0,0 +1,324 @@
+import os
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+DATA_DIR = Path("./data")
+DATA_DIR.mkdir(parents=True, exist_ok=True)
+METADATA_DB = DATA_DIR / "document_metadata.db"
+LEGACY_METADATA_FILE = DATA_DIR / "document_metadata.json"
+
+class MetadataStore:
+    """
+    Document metadata in SQLite, shared safely by all worker processes:
+    - WAL mode, so readers never block each other or the writer
+    - One row per document: the full metadata as JSON plus indexed columns
+      for source, title, upload time, content type and content hash
+    - Every write is one transaction and advances a store-wide revision counter
+    - Migrates the old document_metadata.json on first use
+    """
+
+    def __init__(self, path: Path = METADATA_DB, legacy_file: Path = LEGACY_METADATA_FILE):
+        self.path = Path(path)
+        self._local = threading.local()
+
+        conn = self._connection()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS documents (
+                id TEXT PRIMARY KEY,
+                title TEXT,
+                source TEXT,
+                content_type TEXT,
+                upload_time REAL,
+                sha256 TEXT,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS documents_source ON documents (source, upload_time);
+            CREATE INDEX IF NOT EXISTS documents_upload_time ON documents (upload_time);
+            CREATE INDEX IF NOT EXISTS documents_content_type ON documents (content_type, upload_time);
+            CREATE INDEX IF NOT EXISTS documents_title ON documents (title);
+            CREATE TABLE IF NOT EXISTS store_state (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO store_state (key, value) VALUES ('revision', 0);
+        """)
+        self._add_sha256_column(conn)
+        conn.execute("CREATE INDEX IF NOT EXISTS documents_sha256 ON documents (sha256)")
+        self._migrate_legacy_file(Path(legacy_file))
+
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread and process; SQLite connections must not cross either"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(str(self.path), timeout=10.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _add_sha256_column(self, conn: sqlite3.Connection) -> None:
+        """Stores created before content hashing lack the sha256 column; add and backfill it"""
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(documents)")]
+        if "sha256" in columns:
+            return
+        try:
+            with ImmediateTransaction(conn):
+                conn.execute("ALTER TABLE documents ADD COLUMN sha256 TEXT")
+                conn.execute("UPDATE documents SET sha256 = json_extract(data, '$.sha256')")
+        except sqlite3.OperationalError as e:
+            # Another worker added it first
+            if "duplicate column" not in str(e):
+                raise
+
+    def _transaction(self) -> "ImmediateTransaction":
+        return ImmediateTransaction(self._connection())
+
+    @staticmethod
+    def _columns(doc_id: str, metadata: Dict[str, Any]) -> tuple:
+        return (
+            doc_id,
+            metadata.get("title"),
+            metadata.get("source"),
+            metadata.get("content_type"),
+            metadata.get("upload_time"),
+            metadata.get("sha256"),
+            json.dumps(metadata)
+        )
+
+    @staticmethod
+    def _bump_revision(conn: sqlite3.Connection) -> None:
+        conn.execute("UPDATE store_state SET value = value + 1 WHERE key = 'revision'")
+
+    def _migrate_legacy_file(self, legacy_file: Path) -> None:
+        """Import document_metadata.json once, then rename it out of the way"""
+        if not legacy_file.exists():
+            return
+
+        try:
+            with open(legacy_file, "r") as f:
+                all_metadata = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error reading legacy metadata file {legacy_file}: {e}")
+            return
+
+        # Every worker may try at startup; INSERT OR IGNORE makes repeats harmless
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO documents (id, title, source, content_type, upload_time, sha256, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [self._columns(doc_id, metadata) for doc_id, metadata in all_metadata.items()]
+            )
+            self._bump_revision(conn)
+
+        try:
+            os.replace(legacy_file, legacy_file.with_suffix(".json.migrated"))
+        except FileNotFoundError:
+            pass  # another worker finished the migration first
+        print(f"Migrated {len(all_metadata)} documents from {legacy_file} to {self.path}")
+
+    def get(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        """Metadata for one document, or None"""
+        row = self._connection().execute("SELECT data FROM documents WHERE id = ?", (doc_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, doc_id: str, metadata: Dict[str, Any]) -> None:
+        """Insert or replace a document's metadata"""
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO documents (id, title, source, content_type, upload_time, sha256, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                self._columns(doc_id, metadata)
+            )
+            self._bump_revision(conn)
+
+    def put_or_alias(self, doc_id: str, metadata: Dict[str, Any], alias: Dict[str, Any]) -> Tuple[str, bool]:
+        """
+        Insert a document unless one with the same sha256 already exists, in which
+        case alias is appended to that document's "aliases" instead.
+        Returns the ID of the document holding the content and whether it is new.
+        """
+        return self.put_or_alias_many([(doc_id, metadata, alias)])[0]
+
+    def put_or_alias_many(self, entries: List[Tuple[str, Dict[str, Any], Dict[str, Any]]]) -> List[Tuple[str, bool]]:
+        """put_or_alias for many (doc_id, metadata, alias) entries in one transaction"""
+        results = []
+        with self._transaction() as conn:
+            for doc_id, metadata, alias in entries:
+                row = conn.execute(
+                    "SELECT id, data FROM documents WHERE sha256 = ? ORDER BY upload_time LIMIT 1",
+                    (metadata["sha256"],)
+                ).fetchone()
+
+                if row is None:
+                    conn.execute(
+                        "INSERT INTO documents (id, title, source, content_type, upload_time, sha256, data) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        self._columns(doc_id, metadata)
+                    )
+                    results.append((doc_id, True))
+                    continue
+
+                existing_id, data = row
+                existing = json.loads(data)
+                existing.setdefault("aliases", []).append(alias)
+                conn.execute("UPDATE documents SET data = ? WHERE id = ?", (json.dumps(existing), existing_id))
+                results.append((existing_id, False))
+
+            if entries:
+                self._bump_revision(conn)
+        return results
+
+    def sha256_in_use(self, sha256: str) -> bool:
+        """Whether any document still refers to content with this hash"""
+        row = self._connection().execute("SELECT 1 FROM documents WHERE sha256 = ? LIMIT 1", (sha256,)).fetchone()
+        return row is not None
+
+    def ids_with_sha256(self, sha256: str) -> List[str]:
+        """IDs of every document whose current content has this hash"""
+        return [row[0] for row in self._connection().execute("SELECT id FROM documents WHERE sha256 = ?", (sha256,))]
+
+    def update(self, doc_id: str, updates: Dict[str, Any]) -> bool:
+        """Merge updates into a document's metadata; False if the document does not exist"""
+        return bool(self.update_many({doc_id: updates}))
+
+    def update_many(self, updates: Dict[str, Dict[str, Any]]) -> List[str]:
+        """Merge updates into many documents in one transaction; returns the IDs that existed"""
+        updated = []
+        with self._transaction() as conn:
+            for doc_id, doc_updates in updates.items():
+                row = conn.execute("SELECT data FROM documents WHERE id = ?", (doc_id,)).fetchone()
+                if row is None:
+                    continue
+
+                metadata = json.loads(row[0])
+                metadata.update(doc_updates)
+                conn.execute(
+                    "UPDATE documents SET title = ?, source = ?, content_type = ?, upload_time = ?, sha256 = ?, data = ? WHERE id = ?",
+                    self._columns(doc_id, metadata)[1:] + (doc_id,)
+                )
+                updated.append(doc_id)
+
+            if updated:
+                self._bump_revision(conn)
+        return updated
+
+    def delete(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        """Remove a document, returning the metadata it had, or None if it did not exist"""
+        with self._transaction() as conn:
+            row = conn.execute("SELECT data FROM documents WHERE id = ?", (doc_id,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("DELETE FROM documents WHERE id = ?", (doc_id,))
+            self._bump_revision(conn)
+            return json.loads(row[0])
+
+    def list(self,
+             source: Optional[str] = None,
+             content_type: Optional[str] = None,
+             uploaded_after: Optional[float] = None,
+             uploaded_before: Optional[float] = None,
+             limit: Optional[int] = None,
+             offset: int = 0,
+             title_prefix: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Documents matching the filters, oldest upload first"""
+        where, params = self._filters(source, content_type, uploaded_after, uploaded_before, title_prefix)
+        sql = f"SELECT data FROM documents{where} ORDER BY upload_time, id LIMIT ? OFFSET ?"
+        params.extend([limit if limit is not None else -1, offset])
+
+        return [json.loads(row[0]) for row in self._connection().execute(sql, params)]
+
+    def list_json(self,
+                  limit: int,
+                  after: Optional[Tuple[float, str]] = None,
+                  fields: Optional[List[str]] = None,
+                  source: Optional[str] = None,
+                  content_type: Optional[str] = None,
+                  uploaded_after: Optional[float] = None,
+                  uploaded_before: Optional[float] = None,
+                  title_prefix: Optional[str] = None) -> Tuple[int, List[Tuple[float, str, str]]]:
+        """
+        One page of documents matching the filters, oldest upload first, as (upload_time, id, json)
+        rows ready to send: the stored JSON, or only the given fields of it when fields is set.
+        after is the (upload_time, id) of the last document of the previous page.
+        Returns the store revision the page was read at along with the rows.
+        """
+        where, params = self._filters(source, content_type, uploaded_after, uploaded_before, title_prefix, after)
+        if fields:
+            columns = ", ".join("?, json_extract(data, ?)" for _ in fields)
+            selected = f"json_object({columns})"
+            params = [value for field in fields for value in (field, f'$."{field}"')] + params
+        else:
+            selected = "data"
+        sql = f"SELECT upload_time, id, {selected} FROM documents{where} ORDER BY upload_time, id LIMIT ?"
+        params.append(limit)
+
+        # One read transaction, so the revision matches the rows
+        conn = self._connection()
+        conn.execute("BEGIN")
+        try:
+            revision = conn.execute("SELECT value FROM store_state WHERE key = 'revision'").fetchone()[0]
+            rows = conn.execute(sql, params).fetchall()
+        finally:
+            conn.execute("COMMIT")
+        return revision, rows
+
+    @staticmethod
+    def _filters(source: Optional[str] = None,
+                 content_type: Optional[str] = None,
+                 uploaded_after: Optional[float] = None,
+                 uploaded_before: Optional[float] = None,
+                 title_prefix: Optional[str] = None,
+                 after: Optional[Tuple[float, str]] = None) -> Tuple[str, List[Any]]:
+        """WHERE clause and parameters for the listing filters, each served by an index"""
+        clauses = []
+        params: List[Any] = []
+        if source is not None:
+            clauses.append("source = ?")
+            params.append(source)
+        if content_type is not None:
+            clauses.append("content_type = ?")
+            params.append(content_type)
+        if uploaded_after is not None:
+            clauses.append("upload_time >= ?")
+            params.append(uploaded_after)
+        if uploaded_before is not None:
+            clauses.append("upload_time < ?")
+            params.append(uploaded_before)
+        if title_prefix:
+            # A range rather than LIKE, which is case-insensitive and cannot use the title index
+            clauses.append("title >= ? AND title < ?")
+            params.extend([title_prefix, title_prefix + "\U0010ffff"])
+        if after is not None:
+            clauses.append("(upload_time, id) > (?, ?)")
+            params.extend(after)
+
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def ids(self) -> List[str]:
+        """IDs of every document"""
+        return [row[0] for row in self._connection().execute("SELECT id FROM documents ORDER BY upload_time, id")]
+
+    def count(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def revision(self) -> int:
+        """Counter that advances on every change to the store"""
+        return self._connection().execute("SELECT value FROM store_state WHERE key = 'revision'").fetchone()[0]
+
+class ImmediateTransaction:
+    """BEGIN IMMEDIATE ... COMMIT, rolled back on error; takes the write lock up front"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self.conn.execute("ROLLBACK" if exc_type is not None else "COMMIT")
+        return False
@@ -0,0 +1,384 @@
+import os
+import re
+import json
+import zlib
+import random
+import sqlite3
+import threading
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Set
+
+import numpy as np
+
+from metadata_store import ImmediateTransaction
+
+DATA_DIR = Path("./data")
+DATA_DIR.mkdir(parents=True, exist_ok=True)
+MINHASH_INDEX_DB = DATA_DIR / "minhash_index.db"
+LEGACY_MINHASH_INDEX_FILE = DATA_DIR / "minhash_index.json"
+
+# MinHash / LSH parameters: 16 bands of 8 rows puts the LSH candidate
+# threshold at roughly 0.7 Jaccard similarity
+NUM_PERMUTATIONS = 128
+NUM_BANDS = 16
+SHINGLE_SIZE = 5  # words
+# Estimated Jaccard similarity above which a chunk is treated as a duplicate
+DUPLICATE_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.85"))
+
+# IDs per SQL lookup, below SQLite's limit on bound parameters
+LOOKUP_BATCH = 500
+# Change log entries kept for other processes to catch up from; one further behind reloads everything
+CHANGE_LOG_KEEP = int(os.getenv("DEDUP_CHANGE_LOG_KEEP", "10000"))
+
+_MERSENNE_PRIME = (1 << 31) - 1
+_SEED = 1337  # Fixed so signatures are comparable across processes and restarts
+
+class MinHasher:
+    """Computes MinHash signatures over word shingles"""
+
+    def __init__(self, num_permutations: int = NUM_PERMUTATIONS, shingle_size: int = SHINGLE_SIZE):
+        self.num_permutations = num_permutations
+        self.shingle_size = shingle_size
+
+        rng = random.Random(_SEED)
+        self._a = np.array([rng.randint(1, _MERSENNE_PRIME - 1) for _ in range(num_permutations)], dtype=np.uint64)
+        self._b = np.array([rng.randint(0, _MERSENNE_PRIME - 1) for _ in range(num_permutations)], dtype=np.uint64)
+
+    def _shingles(self, text: str) -> Set[str]:
+        """Split normalized text into overlapping word n-grams"""
+        words = re.sub(r'\s+', ' ', text.lower()).strip().split(' ')
+        if len(words) <= self.shingle_size:
+            return {' '.join(words)}
+        return {' '.join(words[i:i + self.shingle_size]) for i in range(len(words) - self.shingle_size + 1)}
+
+    def signature(self, text: str) -> List[int]:
+        """Compute the MinHash signature of a text"""
+        hashes = np.array(
+            [zlib.crc32(shingle.encode("utf-8")) % _MERSENNE_PRIME for shingle in self._shingles(text)],
+            dtype=np.uint64
+        )
+        # (a * x + b) mod p stays below 2^63 because a, b, x < 2^31
+        permuted = (np.outer(self._a, hashes) + self._b[:, None]) % _MERSENNE_PRIME
+        return permuted.min(axis=1).tolist()
+
+class NearDuplicateIndex:
+    """
+    LSH index of chunk MinHash signatures:
+    - Finds previously indexed chunks that are near-duplicates of a new one, among chunks
+      with the same access level only, so linking never moves text across access levels
+    - Records which documents were linked to an existing chunk instead of re-adding it
+    - Persists every change to SQLite as it is made, shared by all worker processes;
+      each process keeps the LSH buckets in memory and applies other processes' changes
+      from a change log, so nothing it has added is lost when it catches up; the log keeps
+      the newest CHANGE_LOG_KEEP entries and a process further behind reloads everything
+    - Migrates the old minhash_index.json on first use
+    """
+
+    def __init__(self,
+                 path: Path = MINHASH_INDEX_DB,
+                 threshold: float = DUPLICATE_THRESHOLD,
+                 num_bands: int = NUM_BANDS,
+                 legacy_file: Path = LEGACY_MINHASH_INDEX_FILE):
+        self.path = Path(path)
+        self.threshold = threshold
+        self.num_bands = num_bands
+        self.hasher = MinHasher()
+        self._rows = self.hasher.num_permutations // num_bands
+        self._lock = threading.RLock()
+        self._local = threading.local()
+
+        self._connection().executescript("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                chunk_id TEXT PRIMARY KEY,
+                doc_id TEXT NOT NULL,
+                access_level TEXT,
+                signature BLOB NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS chunks_doc_id ON chunks (doc_id);
+            CREATE TABLE IF NOT EXISTS links (
+                chunk_id TEXT NOT NULL,
+                doc_id TEXT NOT NULL,
+                PRIMARY KEY (chunk_id, doc_id)
+            );
+            CREATE INDEX IF NOT EXISTS links_doc_id ON links (doc_id);
+            CREATE TABLE IF NOT EXISTS changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                chunk_id TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS index_state (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO index_state (key, value)
+                VALUES ('chunks_seen', 0), ('duplicates_skipped', 0), ('generation', 0), ('pruned_through', 0);
+        """)
+        self._migrate_legacy_file(Path(legacy_file))
+        self._load()
+
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread and process; SQLite connections must not cross either"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(str(self.path), timeout=10.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _transaction(self) -> ImmediateTransaction:
+        return ImmediateTransaction(self._connection())
+
+    def _band_keys(self, signature: List[int], access_level: Optional[str]) -> List[str]:
+        """Hash each band of a signature into a bucket key; buckets are separate per access level"""
+        return [
+            f"{access_level}:{band}:{hash(tuple(signature[band * self._rows:(band + 1) * self._rows]))}"
+            for band in range(self.num_bands)
+        ]
+
+    def _index_signature(self, chunk_id: str, signature: List[int], access_level: Optional[str]):
+        self._forget_signature(chunk_id)
+        self._signatures[chunk_id] = signature
+        self._levels[chunk_id] = access_level
+        # Chunks migrated without an access level can be removed but never matched
+        if access_level is None:
+            return
+        for key in self._band_keys(signature, access_level):
+            self._buckets.setdefault(key, set()).add(chunk_id)
+
+    def _forget_signature(self, chunk_id: str):
+        signature = self._signatures.pop(chunk_id, None)
+        access_level = self._levels.pop(chunk_id, None)
+        if signature is None or access_level is None:
+            return
+        for key in self._band_keys(signature, access_level):
+            bucket = self._buckets.get(key)
+            if bucket:
+                bucket.discard(chunk_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    @staticmethod
+    def _encode(signature: List[int]) -> bytes:
+        return np.asarray(signature, dtype=np.uint32).tobytes()
+
+    @staticmethod
+    def _decode(blob: bytes) -> List[int]:
+        return np.frombuffer(blob, dtype=np.uint32).tolist()
+
+    @staticmethod
+    def _log_changes(conn: sqlite3.Connection, chunk_ids: List[str]):
+        """Record changed chunks for other processes, dropping entries beyond CHANGE_LOG_KEEP"""
+        conn.executemany("INSERT INTO changes (chunk_id) VALUES (?)", [(chunk_id,) for chunk_id in chunk_ids])
+        cutoff = conn.execute("SELECT MAX(seq) FROM changes").fetchone()[0] - CHANGE_LOG_KEEP
+        if cutoff > 0:
+            conn.execute("DELETE FROM changes WHERE seq <= ?", (cutoff,))
+            conn.execute("UPDATE index_state SET value = MAX(value, ?) WHERE key = 'pruned_through'", (cutoff,))
+
+    def _load(self):
+        """Rebuild the in-memory buckets from every stored signature"""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN")
+            try:
+                state = dict(conn.execute("SELECT key, value FROM index_state WHERE key IN ('generation', 'pruned_through')"))
+                self._generation = state["generation"]
+                # The log can be empty after a clear; seq keeps counting up from the pruned entries
+                last_change = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+                self._last_change = max(last_change, state["pruned_through"])
+                rows = conn.execute("SELECT chunk_id, access_level, signature FROM chunks").fetchall()
+            finally:
+                conn.execute("COMMIT")
+
+            self._signatures: Dict[str, List[int]] = {}
+            self._levels: Dict[str, Optional[str]] = {}
+            self._buckets: Dict[str, Set[str]] = {}
+            for chunk_id, access_level, signature in rows:
+                self._index_signature(chunk_id, self._decode(signature), access_level)
+
+    def _refresh(self):
+        """Apply the chunks other worker processes have added or removed since the last look"""
+        conn = self._connection()
+        changed = conn.execute("SELECT seq, chunk_id FROM changes WHERE seq > ? ORDER BY seq",
+                               (self._last_change,)).fetchall()
+        # Read after the log: a prune that dropped entries this process never applied shows up here
+        state = dict(conn.execute("SELECT key, value FROM index_state WHERE key IN ('generation', 'pruned_through')"))
+        if state["generation"] != self._generation or state["pruned_through"] > self._last_change:
+            self._load()
+            return
+        if not changed:
+            return
+        chunk_ids = list(dict.fromkeys(chunk_id for _, chunk_id in changed))
+        current = {}
+        for start in range(0, len(chunk_ids), LOOKUP_BATCH):
+            batch = chunk_ids[start:start + LOOKUP_BATCH]
+            for chunk_id, access_level, signature in conn.execute(
+                    f"SELECT chunk_id, access_level, signature FROM chunks WHERE chunk_id IN ({','.join('?' * len(batch))})", batch):
+                current[chunk_id] = (access_level, signature)
+        for chunk_id in chunk_ids:
+            if chunk_id in current:
+                access_level, signature = current[chunk_id]
+                self._index_signature(chunk_id, self._decode(signature), access_level)
+            else:
+                self._forget_signature(chunk_id)
+        self._last_change = changed[-1][0]
+
+    def _migrate_legacy_file(self, legacy_file: Path):
+        """Import minhash_index.json once, then rename it out of the way"""
+        if not legacy_file.exists():
+            return
+        try:
+            with open(legacy_file, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error reading legacy near-duplicate index {legacy_file}: {e}")
+            return
+
+        # The old file did not record access levels; those chunks are kept for removal
+        # and link tracking, but are never offered as duplicates
+        chunk_docs = data.get("chunk_docs", {})
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO chunks (chunk_id, doc_id, access_level, signature) VALUES (?, ?, NULL, ?)",
+                [(chunk_id, chunk_docs.get(chunk_id, ""), self._encode(signature))
+                 for chunk_id, signature in data.get("signatures", {}).items()]
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO links (chunk_id, doc_id) VALUES (?, ?)",
+                [(chunk_id, doc_id) for chunk_id, doc_ids in data.get("links", {}).items() for doc_id in doc_ids]
+            )
+            for key, value in data.get("stats", {}).items():
+                conn.execute("UPDATE index_state SET value = ? WHERE key = ?", (value, key))
+
+        try:
+            os.replace(legacy_file, legacy_file.with_suffix(".json.migrated"))
+        except FileNotFoundError:
+            pass  # another worker finished the migration first
+        print(f"Migrated {len(data.get('signatures', {}))} chunk signatures from {legacy_file} to {self.path}")
+
+    def signature(self, text: str) -> List[int]:
+        """Compute the MinHash signature used by this index"""
+        return self.hasher.signature(text)
+
+    def __contains__(self, chunk_id: str) -> bool:
+        with self._lock:
+            self._refresh()
+            return chunk_id in self._signatures
+
+    def find_duplicate(self, signature: List[int], access_level: str) -> Optional[str]:
+        """Return the ID of an indexed chunk with the same access level that is a near-duplicate, if any"""
+        with self._lock:
+            self._refresh()
+            candidates = set()
+            for key in self._band_keys(signature, access_level):
+                candidates.update(self._buckets.get(key, ()))
+
+            best_id, best_similarity = None, 0.0
+            query = np.array(signature)
+            for chunk_id in candidates:
+                similarity = float(np.mean(np.array(self._signatures[chunk_id]) == query))
+                if similarity > best_similarity:
+                    best_id, best_similarity = chunk_id, similarity
+
+            return best_id if best_similarity >= self.threshold else None
+
+    def add(self, chunk_id: str, doc_id: str, signature: List[int], access_level: str):
+        """Register a newly indexed chunk"""
+        with self._lock:
+            with self._transaction() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO chunks (chunk_id, doc_id, access_level, signature) VALUES (?, ?, ?, ?)",
+                    (chunk_id, doc_id, access_level, self._encode(signature))
+                )
+                conn.execute("UPDATE index_state SET value = value + 1 WHERE key = 'chunks_seen'")
+                self._log_changes(conn, [chunk_id])
+            self._index_signature(chunk_id, signature, access_level)
+
+    def link(self, chunk_id: str, doc_id: str):
+        """Record that a document reuses an existing chunk instead of indexing its own copy"""
+        with self._transaction() as conn:
+            conn.execute("INSERT OR IGNORE INTO links (chunk_id, doc_id) VALUES (?, ?)", (chunk_id, doc_id))
+            conn.execute("UPDATE index_state SET value = value + 1 WHERE key IN ('chunks_seen', 'duplicates_skipped')")
+
+    def set_access_level(self, chunk_ids: List[str], access_level: str) -> Set[str]:
+        """
+        Move chunks to another access level, e.g. when their document's level changes.
+        Links to them are dropped; returns the IDs of the linking documents, which need re-indexing.
+        """
+        if not chunk_ids:
+            return set()
+        with self._lock:
+            with self._transaction() as conn:
+                dependents = self._pop_links(conn, chunk_ids)
+                conn.executemany("UPDATE chunks SET access_level = ? WHERE chunk_id = ?",
+                                 [(access_level, chunk_id) for chunk_id in chunk_ids])
+                self._log_changes(conn, chunk_ids)
+            self._refresh()
+            return dependents
+
+    @staticmethod
+    def _pop_links(conn: sqlite3.Connection, chunk_ids: List[str]) -> Set[str]:
+        dependents = set()
+        for chunk_id in chunk_ids:
+            dependents.update(row[0] for row in conn.execute("SELECT doc_id FROM links WHERE chunk_id = ?", (chunk_id,)))
+            conn.execute("DELETE FROM links WHERE chunk_id = ?", (chunk_id,))
+        return dependents
+
+    def remove_chunks(self, chunk_ids: List[str]) -> Set[str]:
+        """
+        Forget specific chunks.
+        Returns the IDs of documents that linked to them and therefore need to be re-indexed.
+        """
+        if not chunk_ids:
+            return set()
+        with self._lock:
+            with self._transaction() as conn:
+                dependents = self._pop_links(conn, chunk_ids)
+                conn.executemany("DELETE FROM chunks WHERE chunk_id = ?", [(chunk_id,) for chunk_id in chunk_ids])
+                self._log_changes(conn, chunk_ids)
+            for chunk_id in chunk_ids:
+                self._forget_signature(chunk_id)
+            return dependents
+
+    def remove_document(self, doc_id: str) -> Set[str]:
+        """
+        Forget a document's chunks and links.
+        Returns the IDs of other documents that linked to the removed chunks
+        and therefore need to be re-indexed.
+        """
+        chunk_ids = [row[0] for row in self._connection().execute("SELECT chunk_id FROM chunks WHERE doc_id = ?", (doc_id,))]
+        dependents = self.remove_chunks(chunk_ids)
+        self.unlink_document(doc_id)
+        dependents.discard(doc_id)
+        return dependents
+
+    def unlink_document(self, doc_id: str):
+        """Drop every link from a document to other chunks, e.g. before re-indexing a new version"""
+        self._connection().execute("DELETE FROM links WHERE doc_id = ?", (doc_id,))
+
+    def clear(self):
+        """Drop every signature, e.g. before a full index rebuild"""
+        with self._lock:
+            with self._transaction() as conn:
+                conn.execute("DELETE FROM chunks")
+                conn.execute("DELETE FROM links")
+                conn.execute("DELETE FROM changes")
+                conn.execute("UPDATE index_state SET value = 0 WHERE key IN ('chunks_seen', 'duplicates_skipped')")
+                # Other processes see the new generation and reload instead of replaying the log
+                conn.execute("UPDATE index_state SET value = value + 1 WHERE key = 'generation'")
+            self._load()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get deduplication statistics"""
+        with self._lock:
+            self._refresh()
+            state = dict(self._connection().execute("SELECT key, value FROM index_state").fetchall())
+            seen = state["chunks_seen"]
+            skipped = state["duplicates_skipped"]
+            return {
+                "indexed_chunks": len(self._signatures),
+                "chunks_seen": seen,
+                "duplicates_skipped": skipped,
+                "dedup_ratio": skipped / seen if seen > 0 else 0,
+                "threshold": self.threshold
+            }
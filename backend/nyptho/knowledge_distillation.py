@@ -5,6 +5,8 @@ import time
 import json
 from pathlib import Path
 
+from query_analysis import QueryAnalysis
+
 class KnowledgeDistiller:
     """
     Knowledge Distillation module for Nyptho:
@@ -32,7 +34,8 @@ class KnowledgeDistiller:
                            query: str, 
                            response: str,
                            source_model: str,
-                           metadata: Optional[Dict[str, Any]] = None) -> None:
+                           metadata: Optional[Dict[str, Any]] = None,
+                           analysis: Optional[QueryAnalysis] = None) -> None:
         """
         Process an interaction to extract knowledge
         
@@ -41,6 +44,7 @@ class KnowledgeDistiller:
             response: AI response
             source_model: The AI model that generated the response
             metadata: Additional interaction metadata
+            analysis: The request's QueryAnalysis, if already computed
         """
         # Extract knowledge claims from the response
         knowledge_claims = self._extract_knowledge_claims(response)
@@ -50,12 +54,12 @@ class KnowledgeDistiller:
             self._add_knowledge_claim(claim, query, source_model)
         
         # Identify potential knowledge gaps from the query
-        gaps = self._identify_knowledge_gaps(query, response)
+        gaps = self._identify_knowledge_gaps(query, response, analysis)
         for gap in gaps:
             self.knowledge_gaps.add(gap)
         
         # Update topic mapping
-        topics = self._extract_topics(query, response)
+        topics = self._extract_topics(query, response, analysis)
         for topic in topics:
             if topic not in self.topic_map:
                 self.topic_map[topic] = set()
@@ -214,7 +218,8 @@ class KnowledgeDistiller:
                 "created": time.time()
             }
     
-    def _identify_knowledge_gaps(self, query: str, response: str) -> List[str]:
+    def _identify_knowledge_gaps(self, query: str, response: str,
+                                 analysis: Optional[QueryAnalysis] = None) -> List[str]:
         """Identify potential knowledge gaps from query and response"""
         gaps = []
         
@@ -231,24 +236,29 @@ class KnowledgeDistiller:
         
         if any(marker in response for marker in uncertainty_markers):
             # Extract query topics as potential gaps
-            topics = self._extract_topics(query, "")
+            topics = self._extract_topics(query, "", analysis)
             gaps.extend(topics)
             
         return gaps
     
-    def _extract_topics(self, query: str, response: str) -> List[str]:
+    def _extract_topics(self, query: str, response: str,
+                        analysis: Optional[QueryAnalysis] = None) -> List[str]:
         """Extract potential topics from query and response"""
         topics = []
         
-        # Get potential topics from query
-        query_words = query.lower().split()
-        
-        # Filter out common stop words
-        stop_words = {'a', 'an', 'the', 'and', 'or', 'but', 'is', 'are', 
-                     'was', 'were', 'is', 'be', 'been', 'being', 'have', 
-                     'has', 'had', 'to', 'for', 'of', 'by', 'with'}
-        
-        filtered_words = [word for word in query_words if word not in stop_words and len(word) > 3]
+        if analysis is not None:
+            # The request's analysis has already filtered stop words
+            filtered_words = [word for word in analysis.terms if len(word) > 3]
+        else:
+            # Get potential topics from query
+            query_words = query.lower().split()
+            
+            # Filter out common stop words
+            stop_words = {'a', 'an', 'the', 'and', 'or', 'but', 'is', 'are', 
+                         'was', 'were', 'is', 'be', 'been', 'being', 'have', 
+                         'has', 'had', 'to', 'for', 'of', 'by', 'with'}
+            
+            filtered_words = [word for word in query_words if word not in stop_words and len(word) > 3]
         
         # Look for pairs of meaningful words as topics
         for i in range(len(filtered_words) - 1):
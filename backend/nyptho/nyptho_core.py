@@ -7,6 +7,8 @@ from typing import List, Dict, Any, Optional
 from pathlib import Path
 import numpy as np
 
+from query_analysis import QueryAnalysis
+
 class NypthoCore:
     """
     Nyptho: A meta-learning system designed to learn from other AI models
@@ -44,7 +46,8 @@ class NypthoCore:
                            query: str, 
                            response: str, 
                            source_model: str,
-                           metadata: Optional[Dict[str, Any]] = None) -> None:
+                           metadata: Optional[Dict[str, Any]] = None,
+                           analysis: Optional[QueryAnalysis] = None) -> None:
         """
         Record and learn from an AI interaction
         
@@ -53,6 +56,7 @@ class NypthoCore:
             response: The AI's response to learn from
             source_model: Identifier of the source AI model
             metadata: Additional information about the interaction
+            analysis: The request's QueryAnalysis, if already computed
         """
         # Create interaction record
         interaction = {
@@ -61,7 +65,7 @@ class NypthoCore:
             "source_model": source_model,
             "metadata": metadata or {},
             "timestamp": time.time(),
-            "features": self._extract_features(query, response)
+            "features": self._extract_features(query, response, analysis)
         }
         
         # Add to memory (with size limit)
@@ -79,7 +83,8 @@ class NypthoCore:
     def generate_response(self, 
                          query: str, 
                          context: Optional[List[Dict[str, Any]]] = None,
-                         persona: Optional[Dict[str, float]] = None) -> str:
+                         persona: Optional[Dict[str, float]] = None,
+                         analysis: Optional[QueryAnalysis] = None) -> str:
         """
         Generate a response based on learned patterns
         
@@ -87,6 +92,7 @@ class NypthoCore:
             query: User query to respond to
             context: Additional context for the response
             persona: Personality traits to use (overrides default)
+            analysis: The request's QueryAnalysis, if already computed
         
         Returns:
             Generated response based on learned patterns
@@ -98,11 +104,11 @@ class NypthoCore:
         active_persona = persona or self.personality_traits
         
         # Find matching patterns
-        matching_patterns = self._find_matching_patterns(query)
+        matching_patterns = self._find_matching_patterns(query, analysis)
         
         if not matching_patterns:
             # Fallback to generic response
-            return self._generate_generic_response(query, active_persona)
+            return self._generate_generic_response(query, active_persona, analysis)
         
         # Generate response based on patterns and persona
         responses = []
@@ -126,7 +132,7 @@ class NypthoCore:
             selected_idx = np.random.choice(len(responses), p=weights)
             return responses[selected_idx]
         
-        return self._generate_generic_response(query, active_persona)
+        return self._generate_generic_response(query, active_persona, analysis)
     
     def set_personality(self, traits: Dict[str, float]) -> None:
         """Update personality traits"""
@@ -134,19 +140,23 @@ class NypthoCore:
             if trait in self.personality_traits:
                 self.personality_traits[trait] = max(0.0, min(1.0, value))
     
-    def _extract_features(self, query: str, response: str) -> Dict[str, Any]:
+    def _extract_features(self, query: str, response: str,
+                          analysis: Optional[QueryAnalysis] = None) -> Dict[str, Any]:
         """Extract features from query and response for pattern learning"""
         features = {
             "query_length": len(query),
             "response_length": len(response),
-            "query_keywords": self._extract_keywords(query),
+            "query_keywords": self._extract_keywords(query, analysis),
             "response_structure": self._analyze_structure(response),
             "sentiment": self._analyze_sentiment(query)
         }
         return features
     
-    def _extract_keywords(self, text: str) -> List[str]:
-        """Extract key terms from text"""
+    def _extract_keywords(self, text: str, analysis: Optional[QueryAnalysis] = None) -> List[str]:
+        """Extract key terms from text, reusing the query analysis when text is the query"""
+        if analysis is not None:
+            return analysis.terms
+        
         # Simple keyword extraction
         words = text.lower().split()
         # Remove common stop words
@@ -274,9 +284,10 @@ class NypthoCore:
         
         return matches / max(1, total)
     
-    def _find_matching_patterns(self, query: str) -> List[Dict[str, Any]]:
+    def _find_matching_patterns(self, query: str,
+                                analysis: Optional[QueryAnalysis] = None) -> List[Dict[str, Any]]:
         """Find patterns that match a query"""
-        keywords = self._extract_keywords(query)
+        keywords = self._extract_keywords(query, analysis)
         matches = []
         
         # Gather all potential matches from keywords
@@ -367,7 +378,8 @@ class NypthoCore:
         
         return text
     
-    def _generate_generic_response(self, query: str, persona: Dict[str, float]) -> str:
+    def _generate_generic_response(self, query: str, persona: Dict[str, float],
+                                   analysis: Optional[QueryAnalysis] = None) -> str:
         """Generate a generic response when no pattern matches"""
         generic_templates = [
             "I'm still learning about topics like this. Could you tell me more about what you're looking for regarding {topic}?",
@@ -377,7 +389,7 @@ class NypthoCore:
         ]
         
         # Extract a topic from the query
-        keywords = self._extract_keywords(query)
+        keywords = self._extract_keywords(query, analysis)
         topic = keywords[0] if keywords else "this topic"
         
         template = random.choice(generic_templates)
@@ -0,0 +1,86 @@
+import os
+import asyncio
+import threading
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import AsyncIterator, List, Optional, Union
+
+import pypdf
+
+# Worker processes for PDF text extraction; parsing is CPU-bound and must stay off the event loop
+PDF_EXTRACTION_WORKERS = int(os.getenv("PDF_EXTRACTION_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Pages extracted per task; large PDFs are split into ranges of this size and extracted in parallel
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+def count_pdf_pages(path: str) -> int:
+    """Number of pages in a PDF"""
+    return len(pypdf.PdfReader(path).pages)
+
+def extract_page_range(path: str, start: int, end: int) -> List[str]:
+    """Text of pages start..end-1; runs in a worker process, which opens the file itself"""
+    pages = pypdf.PdfReader(path).pages
+    return [pages[index].extract_text() or "" for index in range(start, end)]
+
+def get_extraction_pool() -> ProcessPoolExecutor:
+    """The shared extraction pool, started on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawned workers start a fresh interpreter rather than forking the server's threads and
+            # models. They import this module, and also re-run __main__: under uvicorn that is
+            # uvicorn's own script, under `python main.py` it is main.py, which skips its
+            # component setup when run as __mp_main__
+            _pool = ProcessPoolExecutor(max_workers=PDF_EXTRACTION_WORKERS,
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+def shutdown_extraction_pool() -> None:
+    """Stop the worker processes, cancelling extraction that has not started"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+def _discard_broken_pool(pool: ProcessPoolExecutor) -> None:
+    """A worker died (e.g. killed on memory); the next extraction starts a fresh pool"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+
+async def stream_pdf_pages(path: Union[str, Path]) -> AsyncIterator[str]:
+    """
+    Yield the text of each page of a PDF in order, as soon as it is extracted.
+    Page ranges are extracted in parallel in the process pool, so the caller can
+    start on the first pages while later ones are still being read.
+    """
+    path = str(path)
+    loop = asyncio.get_running_loop()
+    pool = get_extraction_pool()
+
+    futures = []
+    try:
+        page_count = await loop.run_in_executor(pool, count_pdf_pages, path)
+        futures = [loop.run_in_executor(pool, extract_page_range, path, start, min(start + PDF_PAGES_PER_TASK, page_count))
+                   for start in range(0, page_count, PDF_PAGES_PER_TASK)]
+
+        for future in futures:
+            for page_text in await future:
+                yield page_text
+    except BrokenProcessPool:
+        _discard_broken_pool(pool)
+        raise
+    finally:
+        # The caller stopped early or extraction failed: drop ranges that have not started
+        for future in futures:
+            future.cancel()
+
+async def extract_pdf_text(path: Union[str, Path]) -> str:
+    """Full text of a PDF, joined once from its pages"""
+    return "".join([page_text + "\n\n" async for page_text in stream_pdf_pages(path)])
@@ -2,6 +2,10 @@
 from typing import List, Dict, Any, Optional
 import time
 
+from knowledge_epoch import current_epoch, EPOCH_CACHE_TTL
+from query_analysis import QueryAnalysis, normalize_text
+from ttl_cache import TTLCache
+
 class NypthoIntegration:
     """
     Enhanced knowledge system without HuggingFace dependency
@@ -12,9 +16,10 @@ class NypthoIntegration:
     
     def __init__(self):
         # Initialize core components
-        self._knowledge_base = {}
-        self._response_cache = {}
-        self._cache_ttl = 600  # 10 minutes cache
+        # Observed responses per normalized query; least recently used queries are dropped first
+        self._knowledge_base = TTLCache("nyptho_knowledge", max_entries=5000, max_bytes=32 * 1024 * 1024)
+        # Entries are keyed on the knowledge epoch, so the TTL only bounds staleness
+        self._response_cache = TTLCache("nyptho_responses", max_entries=1000, max_bytes=16 * 1024 * 1024, ttl=EPOCH_CACHE_TTL)
         
         # Performance tracking
         self._response_times = []
@@ -25,7 +30,8 @@ class NypthoIntegration:
                      query: str, 
                      response: str, 
                      model_id: str, 
-                     context: Optional[List[Dict[str, Any]]] = None) -> None:
+                     context: Optional[List[Dict[str, Any]]] = None,
+                     analysis: Optional[QueryAnalysis] = None) -> None:
         """
         Observe and learn from model responses to improve future results
         Uses optimized pattern matching instead of HuggingFace
@@ -40,12 +46,11 @@ class NypthoIntegration:
             return
             
         # Store in knowledge base for future reference
-        query_key = self._normalize_query(query)
-        if query_key not in self._knowledge_base:
-            self._knowledge_base[query_key] = []
+        query_key = self._normalize_query(query, analysis)
+        observations = self._knowledge_base.get(query_key, [])
             
         # Add the response with metadata
-        self._knowledge_base[query_key].append({
+        observations.append({
             'response': response,
             'model': model_id,
             'timestamp': time.time(),
@@ -53,27 +58,33 @@ class NypthoIntegration:
         })
         
         # Keep knowledge base at a reasonable size
-        if len(self._knowledge_base[query_key]) > 5:
+        if len(observations) > 5:
             # Remove oldest entry
-            self._knowledge_base[query_key].pop(0)
+            observations.pop(0)
+
+        # Store again so the cache re-measures the entry's size
+        self._knowledge_base.put(query_key, observations)
     
     def generate_response(self, 
                          query: str, 
                          context: Optional[List[Dict[str, Any]]] = None,
-                         personality: Optional[Dict[str, float]] = None) -> str:
+                         personality: Optional[Dict[str, float]] = None,
+                         analysis: Optional[QueryAnalysis] = None) -> str:
         """
         Generate optimized responses using the enhanced knowledge system
         """
         start_time = time.time()
         
         # Check cache for faster response
-        cache_key = f"{query}:{str(personality)}"
+        if analysis is None:
+            analysis = QueryAnalysis(query)
+        cache_key = f"{current_epoch()}:{analysis.key(options=personality)}"
         cached = self._get_from_cache(cache_key)
         if cached:
             return cached
         
         # Get the most relevant knowledge
-        query_key = self._normalize_query(query)
+        query_key = self._normalize_query(query, analysis)
         exact_match = self._knowledge_base.get(query_key, [])
         
         # Find similar queries for more robust response
@@ -142,11 +153,13 @@ class NypthoIntegration:
             "ready": knowledge_count >= 10
         }
     
-    def _normalize_query(self, query: str) -> str:
+    def _normalize_query(self, query: str, analysis: Optional[QueryAnalysis] = None) -> str:
         """Normalize the query for consistent matching"""
+        if analysis is not None:
+            return analysis.normalized
         if not query:
             return ""
-        return query.lower().strip()
+        return normalize_text(query)
     
     def _query_similarity(self, query1: str, query2: str) -> float:
         """
@@ -168,23 +181,8 @@ class NypthoIntegration:
     
     def _get_from_cache(self, key: str) -> Optional[str]:
         """Get item from cache if not expired"""
-        if key in self._response_cache:
-            entry = self._response_cache[key]
-            if time.time() - entry['timestamp'] < self._cache_ttl:
-                return entry['response']
-        return None
+        return self._response_cache.get(key)
     
     def _add_to_cache(self, key: str, response: str) -> None:
-        """Add response to cache"""
-        self._response_cache[key] = {
-            'response': response,
-            'timestamp': time.time()
-        }
-        
-        # Clean cache if too large
-        if len(self._response_cache) > 1000:
-            # Remove oldest entries
-            sorted_keys = sorted(self._response_cache.items(), 
-                                key=lambda x: x[1]['timestamp'])
-            for key, _ in sorted_keys[:200]:  # Remove oldest 20%
-                del self._response_cache[key]
+        """Add response to cache, evicting the least recently used entries when full"""
+        self._response_cache.put(key, response)
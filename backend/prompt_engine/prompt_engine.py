@@ -1,11 +1,27 @@
 
 from typing import List, Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+import os
 
 from retrieval_engine import Document
+from deadline import Deadline
+from knowledge_epoch import current_epoch
+from query_analysis import QueryAnalysis
+from singleflight import SingleFlight
 from .templates import PromptTemplateManager
 from .response_generator import ResponseGenerator
 from .formatters import ContentFormatter
 
+# Threads used to generate responses off the event loop
+GENERATION_WORKERS = int(os.getenv("GENERATION_WORKERS", "4"))
+# Returned to a request whose deadline passed while an identical generation was still running
+TIMEOUT_RESPONSE = (
+    "## Still Working On It\n\n"
+    "This question is taking longer than usual to answer. Please try again in a moment."
+)
+
 class PromptEngine:
     """
     Handles prompt engineering and response generation:
@@ -19,6 +35,8 @@ class PromptEngine:
         self.response_generator = ResponseGenerator()
         self.formatter = ContentFormatter()
         self.current_query = ""
+        self._inflight = SingleFlight("generation")
+        self._executor = ThreadPoolExecutor(max_workers=GENERATION_WORKERS, thread_name_prefix="generation")
         print("Prompt Engine initialized with template manager and response generator")
     
     def generate_response(
@@ -27,7 +45,9 @@ class PromptEngine:
         context: List[Document], 
         conversation_history: List[Dict[str, Any]] = [],
         role: str = "student",
-        options: Optional[Dict[str, Any]] = None
+        options: Optional[Dict[str, Any]] = None,
+        deadline: Optional[Deadline] = None,
+        analysis: Optional[QueryAnalysis] = None
     ) -> str:
         """
         Generate a response using prompt engineering and context:
@@ -36,9 +56,11 @@ class PromptEngine:
         3. Format and return response
         """
         self.current_query = query  # Store for categorization
+        if analysis is None:
+            analysis = QueryAnalysis(query)
         
         # Get the appropriate prompt template
-        prompt_template = self.template_manager.get_prompt_template(role, query)
+        prompt_template = self.template_manager.get_prompt_template(role, query, analysis)
         
         # Format context and history
         formatted_context = self.formatter.format_context(context)
@@ -51,7 +73,44 @@ class PromptEngine:
             history=formatted_history
         )
         
-        # Generate response
-        response = self.response_generator.generate_response(query, context, role)
+        # Generate response; identical requests already in flight share one generation
+        cache_key = f"{current_epoch()}:{analysis.key(role, len(context))}"
+        
+        def generate():
+            response = self.response_generator.generate_response(query, context, role, deadline, analysis)
+            return response, list(deadline.degraded_reasons) if deadline is not None else []
+        
+        try:
+            response, degraded_reasons = self._inflight.do(
+                cache_key, generate, timeout=deadline.remaining() if deadline is not None else None)
+        except TimeoutError as e:
+            # Out of time; generating again would duplicate the run this request was waiting on
+            print(f"Generation gave up waiting: {e}")
+            response, degraded_reasons = TIMEOUT_RESPONSE, ["coalesced_wait"]
+        if deadline is not None:
+            for reason in degraded_reasons:
+                deadline.mark_degraded(reason)
         
         return response
+    
+    async def agenerate_response(
+        self,
+        query: str,
+        context: List[Document],
+        conversation_history: List[Dict[str, Any]] = [],
+        role: str = "student",
+        options: Optional[Dict[str, Any]] = None,
+        deadline: Optional[Deadline] = None,
+        analysis: Optional[QueryAnalysis] = None
+    ) -> str:
+        """
+        Async generate_response that runs on a bounded thread pool, keeping the
+        event loop free while concurrent identical requests wait on one generation
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(
+            self.generate_response, query, context, conversation_history, role, options, deadline, analysis))
+    
+    def get_coalescing_stats(self) -> Dict[str, Any]:
+        """Get how many generations were shared with an identical in-flight request"""
+        return self._inflight.get_stats()
@@ -1,30 +1,43 @@
 
 import random
-import time
 import re
 from typing import List, Dict, Any, Optional
 import markdown
 
 from retrieval_engine import Document
+from deadline import Deadline
+from knowledge_epoch import current_epoch, EPOCH_CACHE_TTL
+from query_analysis import QueryAnalysis
+from ttl_cache import TTLCache
+from shared_cache import get_shared_cache
 
 class ResponseGenerator:
     """Handles the generation of responses based on context and query"""
     
     def __init__(self):
-        self.response_cache = {}
-        self.cache_ttl = 300  # 5 minutes
+        # Entries are keyed on the knowledge epoch, so the TTL only bounds staleness;
+        # the shared L2 lets other workers reuse what this one computed
+        self.response_cache = TTLCache("responses", max_entries=2048, max_bytes=32 * 1024 * 1024,
+                                       ttl=EPOCH_CACHE_TTL, l2=get_shared_cache())
         print("Enhanced ResponseGenerator initialized with caching and advanced formatting")
     
     def generate_response(self, 
                          query: str, 
                          context: List[Document], 
-                         role: str = "student") -> str:
+                         role: str = "student",
+                         deadline: Optional[Deadline] = None,
+                         analysis: Optional[QueryAnalysis] = None) -> str:
         """
         Generate a structured, professional response using context and role
         with proper markdown formatting and knowledge integration
+
+        If the deadline has passed, only the most relevant ALU Brain entry is formatted.
         """
+        if analysis is None:
+            analysis = QueryAnalysis(query)
+        
         # Check cache for this query
-        cache_key = f"{query}:{role}:{len(context)}"
+        cache_key = f"{current_epoch()}:{analysis.key(role, len(context))}"
         cached = self._get_from_cache(cache_key)
         if cached:
             return cached
@@ -38,12 +51,12 @@ class ResponseGenerator:
             response_parts.append(greeting)
         
         # Process context from ALU Brain
-        brain_content = self._process_brain_content(query, context)
+        brain_content = self._process_brain_content(query, context, deadline)
         if brain_content:
             response_parts.append(brain_content)
         else:
             # If no ALU Brain content, generate a response using other context
-            general_content = self._generate_general_response(query, context, role)
+            general_content = self._generate_general_response(query, context, role, analysis)
             response_parts.append(general_content)
         
         # Add appropriate closing
@@ -54,12 +67,13 @@ class ResponseGenerator:
         # Format as markdown
         full_response = "\n\n".join(response_parts)
         
-        # Add to cache
-        self._add_to_cache(cache_key, full_response)
+        # Add to cache, unless parts of the pipeline were cut short
+        if deadline is None or not deadline.degraded:
+            self._add_to_cache(cache_key, full_response)
         
         return full_response
     
-    def _process_brain_content(self, query: str, context: List[Document]) -> str:
+    def _process_brain_content(self, query: str, context: List[Document], deadline: Optional[Deadline] = None) -> str:
         """Process ALU Brain content in the context to create a structured response"""
         # Identify ALU Brain documents
         alu_brain_docs = [doc for doc in context if "ALU Brain" in doc.metadata.get('source', '')]
@@ -79,6 +93,11 @@ class ResponseGenerator:
             # Limit to max 3 documents for conciseness
             if doc_count >= 3:
                 break
+            
+            # Out of time: keep what has been formatted so far
+            if doc_count > 0 and deadline is not None and deadline.expired():
+                deadline.mark_degraded("response_generation")
+                break
                 
             source_category = doc.metadata.get('source', '').replace('ALU Brain: ', '')
             
@@ -205,9 +224,10 @@ class ResponseGenerator:
         response += f"\n*Source: ALU {category.replace('_', ' ').title()}*"
         return response
     
-    def _generate_general_response(self, query: str, context: List[Document], role: str) -> str:
+    def _generate_general_response(self, query: str, context: List[Document], role: str,
+                                   analysis: Optional[QueryAnalysis] = None) -> str:
         """Generate a response using non-ALU Brain context"""
-        query_lower = query.lower()
+        query_lower = analysis.lower if analysis is not None else query.lower()
         response = ""
         
         # Try to extract useful information from context
@@ -265,20 +285,8 @@ class ResponseGenerator:
     
     def _get_from_cache(self, key: str) -> Optional[str]:
         """Retrieve response from cache if not expired"""
-        if key in self.response_cache:
-            timestamp, response = self.response_cache[key]
-            if time.time() - timestamp < self.cache_ttl:
-                return response
-        return None
+        return self.response_cache.get(key)
     
     def _add_to_cache(self, key: str, response: str) -> None:
-        """Add response to cache with timestamp"""
-        self.response_cache[key] = (time.time(), response)
-        
-        # Clean up old cache entries if cache gets too large
-        if len(self.response_cache) > 100:
-            now = time.time()
-            expired_keys = [k for k, v in self.response_cache.items() 
-                           if now - v[0] > self.cache_ttl]
-            for k in expired_keys:
-                del self.response_cache[k]
+        """Add response to cache, evicting the least recently used entries when full"""
+        self.response_cache.put(key, response)
@@ -1,7 +1,9 @@
 
 import os
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Optional
+
+from query_analysis import QueryAnalysis, query_categories
 
 # Directory for storing prompt templates
 DATA_DIR = Path("./data")
@@ -80,7 +82,8 @@ class PromptTemplateManager:
                 with open(prompt_path, "w") as f:
                     f.write(template)
     
-    def get_prompt_template(self, role: str = "student", query: str = "") -> str:
+    def get_prompt_template(self, role: str = "student", query: str = "",
+                            analysis: Optional[QueryAnalysis] = None) -> str:
         """Get the appropriate prompt template based on user role and query"""
         # Map roles to prompt types
         role_to_prompt = {
@@ -90,7 +93,7 @@ class PromptTemplateManager:
         }
         
         prompt_type = role_to_prompt.get(role, "general")
-        if role == "student" and "academic" in self._query_category(query):
+        if role == "student" and "academic" in self._query_category(query, analysis):
             prompt_type = "academic"
             
         # Load the prompt template
@@ -102,27 +105,8 @@ class PromptTemplateManager:
             # Fall back to default template
             return DEFAULT_PROMPTS.get(prompt_type, DEFAULT_PROMPTS["general"])
     
-    def _query_category(self, query: str) -> list:
+    def _query_category(self, query: str, analysis: Optional[QueryAnalysis] = None) -> list:
         """Simple categorization of queries"""
-        categories = []
-        
-        # Academic keywords
-        academic_keywords = ["course", "assignment", "exam", "study", "learn", 
-                           "class", "lecture", "professor", "grade", "academic"]
-        
-        # Administrative keywords
-        admin_keywords = ["register", "enrollment", "tuition", "deadline", "policy", 
-                         "form", "application", "schedule", "payment", "administrative"]
-        
-        # Simple keyword matching
-        query_lower = query.lower()
-        if any(keyword in query_lower for keyword in academic_keywords):
-            categories.append("academic")
-            
-        if any(keyword in query_lower for keyword in admin_keywords):
-            categories.append("administrative")
-            
-        if not categories:
-            categories.append("general")
-            
-        return categories
+        if analysis is not None:
+            return analysis.categories
+        return query_categories(query.lower())
@@ -0,0 +1,462 @@
+import os
+import json
+import fcntl
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+DATA_DIR = Path("./data")
+VECTOR_INDEX_DIR = DATA_DIR / "vector_index"
+
+# Storage precision for the compact search index: float32 (Chroma only, the default), float16 or pq.
+# The compact index is opt-in and sits beside Chroma, which still keeps its own float32 vectors,
+# and it also keeps a full-precision copy on disk for re-scoring; queries scan every stored row.
+# float16 scores slower than float32 because numpy has no fast half-precision matmul
+# (benchmarks/bench_vector_precision.py).
+VECTOR_PRECISION = os.getenv("VECTOR_PRECISION", "float32").lower()
+# Candidates re-scored against full-precision vectors after the compressed search
+RESCORE_CANDIDATES = int(os.getenv("RESCORE_CANDIDATES", "100"))
+
+# Product quantization settings: each vector is split into PQ_SUBVECTORS parts
+# and every part is replaced by the index of its nearest of 256 centroids
+PQ_SUBVECTORS = int(os.getenv("PQ_SUBVECTORS", "48"))
+PQ_CENTROIDS = 256
+PQ_TRAIN_MIN = 1024  # vectors needed before codebooks are trained
+PQ_KMEANS_ITERATIONS = 15
+
+PRECISIONS = ("float32", "float16", "pq")
+_SCORE_BLOCK_ROWS = 2048  # float16 rows widened to float32 at a time during scoring
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """Scale rows to unit length so inner product equals cosine similarity"""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def _kmeans(data: np.ndarray, k: int, iterations: int, seed: int = 0) -> np.ndarray:
+    """Plain Lloyd's k-means, enough for per-subspace PQ codebooks"""
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), size=k, replace=len(data) < k)].copy()
+    for _ in range(iterations):
+        distances = (
+            (data ** 2).sum(axis=1, keepdims=True)
+            - 2 * data @ centroids.T
+            + (centroids ** 2).sum(axis=1)
+        )
+        assignment = distances.argmin(axis=1)
+        for c in range(k):
+            members = data[assignment == c]
+            if len(members):
+                centroids[c] = members.mean(axis=0)
+    return centroids
+
+class QuantizedVectorIndex:
+    """
+    Compact in-memory vector index for chunk embeddings:
+    - Keeps search vectors as float32, float16 or product-quantized codes
+    - Re-scores the best candidates against full-precision vectors read from disk
+    - Filters by access level before scoring, like the Chroma where filter
+    - Ids, codes and vectors are append-only files shared by all worker processes;
+      the manifest records how many rows are committed, and writers hold a file lock
+    """
+
+    def __init__(self, precision: str = VECTOR_PRECISION, index_dir: Path = VECTOR_INDEX_DIR,
+                 rescore_candidates: int = RESCORE_CANDIDATES, pq_subvectors: int = PQ_SUBVECTORS):
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unsupported vector precision: {precision}. Supported: {', '.join(PRECISIONS)}")
+
+        self.precision = precision
+        self.index_dir = Path(index_dir)
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        self.rescore_candidates = rescore_candidates
+        self.pq_subvectors = pq_subvectors
+
+        self._manifest_path = self.index_dir / "manifest.json"
+        self._lock_path = self.index_dir / "index.lock"
+        self._ids_path = self.index_dir / "ids.jsonl"
+        self._full_path = self.index_dir / "full.f32"
+        self._codebooks_path = self.index_dir / "pq_codebooks.npy"
+
+        self._lock = threading.RLock()
+        self._reset()
+        with self._file_lock(fcntl.LOCK_SH):
+            self._load()
+
+    def _reset(self):
+        """Clear all in-memory state"""
+        self.dim: Optional[int] = None
+        self._ids: List[str] = []
+        self._levels = np.empty(0, dtype=str)  # access level per row, aligned with _ids
+        self._row_of: Dict[str, int] = {}
+        self._codes: Optional[np.ndarray] = None
+        self._codebooks: Optional[np.ndarray] = None
+        self._full: Optional[np.memmap] = None
+        self._generation = 0
+        self._ids_bytes = 0  # committed length of the ids file
+        self._manifest_stamp = None
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    @contextmanager
+    def _file_lock(self, mode: int):
+        """flock on a sidecar file: exclusive for writers, shared for readers loading the files"""
+        with open(self._lock_path, "a") as f:
+            fcntl.flock(f, mode)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    # Encoding
+
+    def _codes_path(self, precision: str) -> Path:
+        return self.index_dir / f"codes_{precision}.bin"
+
+    def _code_format(self) -> Tuple[Any, int]:
+        """dtype and row width of the stored codes"""
+        if self.precision == "pq":
+            return np.uint8, self.pq_subvectors
+        return np.dtype(self.precision), self.dim
+
+    def _encode(self, vectors: np.ndarray) -> Optional[np.ndarray]:
+        """Convert unit vectors into the stored search representation"""
+        if self.precision == "float32":
+            return vectors.astype(np.float32)
+        if self.precision == "float16":
+            return vectors.astype(np.float16)
+        if self._codebooks is None:
+            return None
+
+        sub_dim = self.dim // self.pq_subvectors
+        codes = np.empty((len(vectors), self.pq_subvectors), dtype=np.uint8)
+        for m in range(self.pq_subvectors):
+            part = vectors[:, m * sub_dim:(m + 1) * sub_dim]
+            centroids = self._codebooks[m]
+            distances = -2 * part @ centroids.T + (centroids ** 2).sum(axis=1)
+            codes[:, m] = distances.argmin(axis=1)
+        return codes
+
+    def _train_codebooks(self):
+        """Train PQ codebooks on the stored full-precision vectors and encode everything"""
+        if self.dim % self.pq_subvectors != 0:
+            # e.g. another embedding model: use the most subvectors that split the dimension evenly
+            subvectors = max(m for m in range(1, self.pq_subvectors + 1) if self.dim % m == 0)
+            print(f"Embedding dimension {self.dim} is not divisible by {self.pq_subvectors} subvectors, using {subvectors}")
+            self.pq_subvectors = subvectors
+
+        full = np.asarray(self._full)
+        sub_dim = self.dim // self.pq_subvectors
+        self._codebooks = np.stack([
+            _kmeans(full[:, m * sub_dim:(m + 1) * sub_dim], PQ_CENTROIDS, PQ_KMEANS_ITERATIONS, seed=m)
+            for m in range(self.pq_subvectors)
+        ]).astype(np.float32)
+        self._codes = self._encode(full)
+
+        temp_path = self.index_dir / "pq_codebooks.tmp.npy"
+        np.save(temp_path, self._codebooks)
+        os.replace(temp_path, self._codebooks_path)
+        print(f"Trained PQ codebooks on {len(full)} vectors")
+
+    # Mutation
+
+    def add(self, ids: List[str], embeddings, access_levels: List[str]):
+        """Append vectors to the index and persist them"""
+        if not ids:
+            return
+        vectors = _normalize(np.asarray(embeddings, dtype=np.float32))
+
+        with self._lock, self._file_lock(fcntl.LOCK_EX):
+            # Under the lock the manifest is authoritative: pick up rows other workers committed
+            self._load()
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            start = len(self._ids)
+
+            # Full-precision vectors live on disk; only the page cache holds them.
+            # Bytes past the committed rows are from a writer that died before its manifest update.
+            self._append(self._full_path, start * self.dim * 4, vectors.tobytes())
+            lines = "".join(json.dumps([chunk_id, level]) + "\n" for chunk_id, level in zip(ids, access_levels))
+            self._append(self._ids_path, self._ids_bytes, lines.encode("utf-8"))
+            self._ids_bytes += len(lines.encode("utf-8"))
+
+            self._ids.extend(ids)
+            self._levels = np.concatenate([self._levels, np.array(access_levels, dtype=str)])
+            for offset, chunk_id in enumerate(ids):
+                self._row_of[chunk_id] = start + offset
+            self._open_full()
+
+            if self.precision == "pq" and self._codebooks is None:
+                if len(self._ids) >= PQ_TRAIN_MIN:
+                    self._train_codebooks()
+                    self._write_codes()
+            elif self._codes is not None and len(self._codes) == start and self._codes_on_disk() >= start:
+                encoded = self._encode(vectors)
+                self._append(self._codes_path(self.precision), start * encoded.itemsize * encoded.shape[1], encoded.tobytes())
+                self._codes = np.concatenate([self._codes, encoded])
+            else:
+                # Codes were never written with this precision, e.g. after switching VECTOR_PRECISION
+                encoded = self._encode(vectors)
+                self._codes = encoded if self._codes is None else np.concatenate([self._codes, encoded])
+                self._write_codes()
+
+            self._write_manifest()
+
+    def remove(self, ids: List[str]):
+        """Drop vectors from the index, compacting the stored files"""
+        with self._lock, self._file_lock(fcntl.LOCK_EX):
+            self._load()
+            rows = [self._row_of[chunk_id] for chunk_id in ids if chunk_id in self._row_of]
+            if not rows:
+                return
+
+            keep = np.ones(len(self._ids), dtype=bool)
+            keep[rows] = False
+            full = np.asarray(self._full)[keep]
+
+            self._ids = [chunk_id for chunk_id, k in zip(self._ids, keep) if k]
+            self._levels = self._levels[keep]
+            self._row_of = {chunk_id: row for row, chunk_id in enumerate(self._ids)}
+            if self._codes is not None:
+                self._codes = self._codes[keep]
+
+            # Write new files rather than truncating, other workers may still map the old ones
+            self._replace(self._full_path, full.astype(np.float32).tobytes())
+            lines = "".join(json.dumps([chunk_id, level]) + "\n" for chunk_id, level in zip(self._ids, self._levels))
+            self._replace(self._ids_path, lines.encode("utf-8"))
+            self._ids_bytes = len(lines.encode("utf-8"))
+            self._write_codes()
+            self._open_full()
+
+            # Readers holding an older generation reload everything instead of appending
+            self._generation += 1
+            self._write_manifest()
+
+    def clear(self):
+        """Drop every vector, e.g. before a full index rebuild"""
+        with self._lock, self._file_lock(fcntl.LOCK_EX):
+            generation = self._read_manifest().get("generation", self._generation)
+            self._reset()
+            for path in [self._full_path, self._ids_path, self._codebooks_path] + [self._codes_path(p) for p in PRECISIONS]:
+                if path.exists():
+                    os.remove(path)
+            self._generation = generation + 1
+            self._write_manifest()
+
+    # Search
+
+    def search(self, query_embedding, k: int, access_levels: Optional[List[str]] = None) -> List[Tuple[str, float]]:
+        """
+        Return (chunk_id, distance) pairs for the k nearest vectors.
+        Distance is squared L2 between unit vectors, matching Chroma's default scores.
+        """
+        with self._lock:
+            self._refresh()
+            if not self._ids:
+                return []
+
+            query = _normalize(np.asarray(query_embedding, dtype=np.float32).ravel())
+
+            allowed = np.ones(len(self._ids), dtype=bool)
+            if access_levels is not None:
+                allowed = np.isin(self._levels, access_levels)
+            if not allowed.any():
+                return []
+
+            approx = self._approximate_scores(query)
+            approx = np.where(allowed, approx, -np.inf)
+
+            # Shortlist with the compressed vectors, then re-score exactly
+            shortlist_size = min(max(k, self.rescore_candidates), int(allowed.sum()))
+            shortlist = np.argpartition(-approx, shortlist_size - 1)[:shortlist_size]
+            shortlist.sort()
+            exact = np.asarray(self._full[shortlist]) @ query
+
+            order = np.argsort(-exact)[:k]
+            return [(self._ids[shortlist[i]], float(2 - 2 * exact[i])) for i in order]
+
+    def _approximate_scores(self, query: np.ndarray) -> np.ndarray:
+        """Inner products between the query and every stored vector"""
+        if self._codes is None:
+            # PQ codebooks not trained yet: the index is still small, scan full precision
+            return np.asarray(self._full) @ query
+
+        if self.precision == "pq":
+            sub_dim = self.dim // self.pq_subvectors
+            # Lookup table of query-part x centroid inner products
+            table = np.einsum(
+                "md,mkd->mk",
+                query.reshape(self.pq_subvectors, sub_dim),
+                self._codebooks
+            )
+            return table[np.arange(self.pq_subvectors), self._codes].sum(axis=1)
+
+        if self.precision == "float16":
+            # numpy has no fast float16 matmul, so widen block by block to keep peak memory bounded
+            return np.concatenate([
+                self._codes[start:start + _SCORE_BLOCK_ROWS].astype(np.float32) @ query
+                for start in range(0, len(self._codes), _SCORE_BLOCK_ROWS)
+            ])
+
+        return self._codes @ query
+
+    # Persistence
+
+    @staticmethod
+    def _append(path: Path, committed: int, data: bytes):
+        """Write data after the committed bytes of a file, dropping anything past them"""
+        with open(path, "ab") as f:
+            f.truncate(committed)
+            f.write(data)
+
+    @staticmethod
+    def _replace(path: Path, data: bytes):
+        temp_path = path.with_name(path.name + ".tmp")
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def _codes_on_disk(self) -> int:
+        """Complete rows in this precision's codes file"""
+        path = self._codes_path(self.precision)
+        if not path.exists() or not self.dim:
+            return 0
+        dtype, width = self._code_format()
+        return path.stat().st_size // (np.dtype(dtype).itemsize * width)
+
+    def _write_codes(self):
+        """Rewrite this precision's codes file; codes stored with other precisions are now stale"""
+        for precision in PRECISIONS:
+            path = self._codes_path(precision)
+            if precision != self.precision and path.exists():
+                os.remove(path)
+        if self._codes is not None:
+            self._replace(self._codes_path(self.precision), self._codes.tobytes())
+
+    def _read_codes(self, start: int, stop: int) -> Optional[np.ndarray]:
+        """Codes for rows start..stop, from the codes file or re-encoded from full precision"""
+        if self.precision == "pq" and self._codebooks is None:
+            return None
+        dtype, width = self._code_format()
+        if self._codes_on_disk() >= stop:
+            row_bytes = np.dtype(dtype).itemsize * width
+            codes = np.fromfile(self._codes_path(self.precision), dtype=dtype,
+                                count=(stop - start) * width, offset=start * row_bytes)
+            return codes.reshape(stop - start, width)
+        # Stored with a different precision before: re-encode from full precision
+        return self._encode(np.asarray(self._full[start:stop]))
+
+    def _open_full(self):
+        if self.dim and self._ids and self._full_path.exists():
+            self._full = np.memmap(self._full_path, dtype=np.float32, mode="r", shape=(len(self._ids), self.dim))
+        else:
+            self._full = None
+
+    def _read_manifest(self) -> Dict[str, Any]:
+        if not self._manifest_path.exists():
+            return {}
+        with open(self._manifest_path, "r") as f:
+            return json.load(f)
+
+    def _write_manifest(self):
+        """Commit the rows written so far; called last, under the exclusive file lock"""
+        try:
+            manifest = {
+                "dim": self.dim,
+                "count": len(self._ids),
+                "ids_bytes": self._ids_bytes,
+                "generation": self._generation
+            }
+            self._replace(self._manifest_path, json.dumps(manifest).encode("utf-8"))
+            self._manifest_stamp = self._stamp()
+        except Exception as e:
+            print(f"Error saving vector index: {e}")
+
+    def _load(self):
+        """
+        Bring the in-memory index up to the committed manifest. Rows appended since the last
+        load are read incrementally; after a remove or clear everything is read again.
+        Callers hold the file lock.
+        """
+        try:
+            stamp = self._stamp()
+            manifest = self._read_manifest()
+            count = manifest.get("count", 0)
+            generation = manifest.get("generation", 0)
+
+            if generation != self._generation or count < len(self._ids):
+                self._reset()
+                self._generation = generation
+            start = len(self._ids)
+
+            self.dim = manifest.get("dim")
+            if count > start:
+                with open(self._ids_path, "rb") as f:
+                    f.seek(self._ids_bytes)
+                    data = f.read(manifest["ids_bytes"] - self._ids_bytes)
+                levels = []
+                for line in data.decode("utf-8").splitlines():
+                    chunk_id, level = json.loads(line)
+                    self._row_of[chunk_id] = len(self._ids)
+                    self._ids.append(chunk_id)
+                    levels.append(level)
+                self._levels = np.concatenate([self._levels, np.array(levels, dtype=str)])
+                self._ids_bytes = manifest["ids_bytes"]
+            self._open_full()
+
+            if self.precision == "pq" and self._codebooks is None and self._codebooks_path.exists():
+                self._codebooks = np.load(self._codebooks_path)
+                self.pq_subvectors = len(self._codebooks)
+                self._codes = None  # codebooks were just trained elsewhere: every row has new codes
+            if self._codes is None:
+                self._codes = self._read_codes(0, count) if count else None
+            elif count > len(self._codes):
+                self._codes = np.concatenate([self._codes, self._read_codes(len(self._codes), count)])
+            self._manifest_stamp = stamp
+
+        except Exception as e:
+            print(f"Error loading vector index: {e}")
+
+    def _stamp(self) -> Optional[Tuple[int, int]]:
+        """Identifies a manifest version; os.replace gives every version a new inode"""
+        try:
+            stat = self._manifest_path.stat()
+            return stat.st_ino, stat.st_mtime_ns
+        except OSError:
+            return None
+
+    def _refresh(self):
+        """Load rows other worker processes have committed since the last load"""
+        if self._stamp() != self._manifest_stamp:
+            with self._file_lock(fcntl.LOCK_SH):
+                self._load()
+
+    def memory_bytes(self) -> int:
+        """
+        Bytes of compressed search data held in RAM. Excludes the full-precision file,
+        which is paged in while re-scoring, and the float32 vectors Chroma keeps.
+        """
+        total = self._levels.nbytes
+        if self._codes is not None:
+            total += self._codes.nbytes
+        if self._codebooks is not None:
+            total += self._codebooks.nbytes
+        return total
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get index size and precision information"""
+        with self._lock:
+            return {
+                "precision": self.precision,
+                "vectors": len(self._ids),
+                "dimension": self.dim,
+                "memory_bytes": self.memory_bytes(),
+                "full_precision_bytes": len(self._ids) * (self.dim or 0) * 4,
+                # Chroma stores its own float32 copy of every vector alongside this index
+                "chroma_vector_bytes": len(self._ids) * (self.dim or 0) * 4,
+                "rescore_candidates": self.rescore_candidates,
+                "pq_trained": self._codebooks is not None
+            }
@@ -0,0 +1,159 @@
+import re
+import json
+import hashlib
+from typing import Any, Dict, List, Optional
+
+# Common words that carry no search meaning; shared by query preprocessing and cache keys
+STOP_WORDS = frozenset({
+    'a', 'an', 'the', 'and', 'or', 'but', 'is', 'are', 'was', 'were', 'be', 'been',
+    'being', 'in', 'on', 'at', 'to', 'for', 'with', 'by', 'about', 'against', 'between',
+    'into', 'through', 'during', 'before', 'after', 'above', 'below', 'from', 'up',
+    'down', 'out', 'off', 'over', 'under', 'again', 'further', 'then', 'once', 'here',
+    'there', 'when', 'where', 'why', 'how', 'all', 'any', 'both', 'each', 'few', 'more',
+    'most', 'other', 'some', 'such', 'no', 'nor', 'not', 'only', 'own', 'same', 'so',
+    'than', 'too', 'very', 's', 't', 'can', 'will', 'just', 'don', 'should', 'now', 'i',
+    'me', 'my', 'myself', 'we', 'our', 'ours', 'ourselves', 'you', 'your', 'yours'
+})
+
+# Stop words that still change the answer ("when" vs "where", "can" vs "should",
+# "all" vs "some", "my" vs "your"), so two queries differing only in these must not
+# share a cache entry
+FINGERPRINT_KEEP_WORDS = frozenset({
+    'when', 'where', 'why', 'how', 'no', 'nor', 'not', 'before', 'after',
+    'above', 'below', 'between', 'against', 'up', 'down', 'over', 'under', 'more', 'most', 'few',
+    'can', 'should', 'will', 'only', 'all', 'any', 'both', 'each', 'some', 'other', 'same', 'own',
+    'i', 'me', 'my', 'myself', 'we', 'our', 'ours', 'ourselves', 'you', 'your', 'yours'
+})
+
+# Short terms that are still meaningful search terms
+IMPORTANT_SHORT_TERMS = ('fee', 'due', 'pay', 'gpa', 'job', 'tax', 'aid', 'lab', 'web')
+
+# Phrases that reveal what kind of answer the query wants
+INTENT_PATTERNS = {
+    'procedural': ['how to', 'how do i', 'process', 'steps', 'procedure', 'guide', 'instructions'],
+    'informational': ['what is', 'what are', 'who is', 'explain', 'describe', 'tell me about'],
+    'comparison': ['compare', 'difference', 'versus', 'vs', 'better', 'between'],
+    'deadline': ['when', 'date', 'deadline', 'due', 'schedule', 'calendar', 'timeline'],
+    'location': ['where', 'location', 'place', 'building', 'room', 'campus'],
+    'contact': ['contact', 'email', 'phone', 'reach', 'speak', 'call'],
+    'requirement': ['require', 'need', 'necessary', 'must have', 'should', 'mandatory']
+}
+
+# Keywords mapping a query onto knowledge base topic areas
+TOPIC_KEYWORDS = {
+    'academic': ['course', 'class', 'degree', 'major', 'minor', 'study', 'academic', 'grade', 'credit', 'transcript'],
+    'admission': ['apply', 'admission', 'application', 'accept', 'reject', 'enroll'],
+    'financial': ['tuition', 'fee', 'cost', 'payment', 'financial', 'aid', 'scholarship', 'loan', 'budget', 'fund'],
+    'housing': ['dorm', 'housing', 'residence', 'apartment', 'live', 'roommate', 'accommodation'],
+    'career': ['job', 'career', 'internship', 'employment', 'resume', 'interview', 'hire', 'company'],
+    'administrative': ['office', 'staff', 'administration', 'policy', 'rule', 'regulation', 'requirement'],
+    'student_life': ['club', 'organization', 'activity', 'event', 'social', 'community', 'student life'],
+    'technology': ['computer', 'laptop', 'software', 'internet', 'wifi', 'technology', 'online', 'access'],
+    'health': ['health', 'medical', 'doctor', 'nurse', 'counselor', 'wellness', 'sick', 'illness'],
+    'international': ['visa', 'international', 'country', 'passport', 'foreign']
+}
+
+# Keywords used to pick a prompt template
+CATEGORY_KEYWORDS = {
+    'academic': ["course", "assignment", "exam", "study", "learn",
+                 "class", "lecture", "professor", "grade", "academic"],
+    'administrative': ["register", "enrollment", "tuition", "deadline", "policy",
+                       "form", "application", "schedule", "payment", "administrative"]
+}
+
+_PUNCTUATION = re.compile(r'[^\w\s]')
+
+def normalize_text(query: str) -> str:
+    """Lowercase, replace punctuation with spaces and collapse whitespace"""
+    return " ".join(_PUNCTUATION.sub(" ", query.lower()).split())
+
+def light_stem(word: str) -> str:
+    """Strip plural endings only, so "fees" matches "fee" without over-merging distinct words"""
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 4 and word.endswith(("sses", "shes", "ches", "xes")):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+def canonical_terms(query: str) -> List[str]:
+    """Meaningful, stemmed terms of a query in their original order"""
+    return _canonical_from_tokens(normalize_text(query).split())
+
+def _canonical_from_tokens(tokens: List[str]) -> List[str]:
+    terms = [light_stem(token) for token in tokens
+             if token not in STOP_WORDS or token in FINGERPRINT_KEEP_WORDS]
+    # A query made only of stop words ("how are you") keeps its words rather than collapsing to nothing
+    return terms or tokens
+
+def _fingerprint_terms(terms: List[str], parts: tuple, options: Optional[Dict[str, Any]]) -> str:
+    key = {
+        "terms": terms,
+        "parts": [str(part) for part in parts],
+        "options": options or {}
+    }
+    encoded = json.dumps(key, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(encoded.encode("utf-8"), digest_size=16).hexdigest()
+
+def fingerprint(query: str, *parts: Any, options: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Canonical cache key for a query plus whatever else the cached value depends on.
+    Case, punctuation, whitespace, stop words, plurals and option ordering do not change it.
+    """
+    return _fingerprint_terms(canonical_terms(query), parts, options)
+
+def extract_terms(tokens: List[str]) -> List[str]:
+    """Search terms: tokens that are not stop words and not too short to be meaningful"""
+    terms = [term for term in tokens if term not in STOP_WORDS and len(term) > 2]
+    
+    # Check for important terms that might be filtered
+    for term in tokens:
+        if term in IMPORTANT_SHORT_TERMS and term not in terms:
+            terms.append(term)
+    
+    return terms
+
+def classify_intent(query_lower: str) -> str:
+    """Classify the query intent for better matching"""
+    for intent, patterns in INTENT_PATTERNS.items():
+        if any(pattern in query_lower for pattern in patterns):
+            return intent
+    return 'general'
+
+def extract_topics(query_lower: str) -> List[str]:
+    """Extract topic areas from the query"""
+    matching_topics = [topic for topic, keywords in TOPIC_KEYWORDS.items()
+                       if any(keyword in query_lower for keyword in keywords)]
+    return matching_topics if matching_topics else ['general']
+
+def query_categories(query_lower: str) -> List[str]:
+    """Simple categorization of queries"""
+    categories = [category for category, keywords in CATEGORY_KEYWORDS.items()
+                  if any(keyword in query_lower for keyword in keywords)]
+    return categories if categories else ['general']
+
+class QueryAnalysis:
+    """
+    Everything derived from the query text, computed once per request
+    and passed down so every component sees the same interpretation:
+    - Normalized text, tokens and stop-word-filtered search terms
+    - Intent, topic areas and prompt category
+    - The canonical fingerprint used for cache keys
+    """
+
+    def __init__(self, query: str):
+        self.query = query
+        self.lower = query.lower()
+        self.normalized = normalize_text(query)
+        self.tokens = self.normalized.split()
+        self.terms = extract_terms(self.tokens)
+        self.intent = classify_intent(self.lower)
+        self.topics = extract_topics(self.lower)
+        self.categories = query_categories(self.lower)
+        self.canonical_terms = _canonical_from_tokens(self.tokens)
+        self.fingerprint = self.key()
+
+    def key(self, *parts: Any, options: Optional[Dict[str, Any]] = None) -> str:
+        """Cache key for this query plus other inputs; equal to fingerprint(query, *parts, options=options)"""
+        return _fingerprint_terms(self.canonical_terms, parts, options)
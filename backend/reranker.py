@@ -0,0 +1,104 @@
+import os
+import time
+import threading
+from collections import deque
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+from retrieval_engine import Document
+
+# Re-ranking is opt-in because it loads a second model into every worker
+RERANKER_ENABLED = os.getenv("ENABLE_RERANKER", "false").lower() == "true"
+RERANKER_MODEL = os.getenv("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "20"))  # candidates scored per request
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "8"))
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "150"))  # per-request time budget
+
+class CrossEncoderReranker:
+    """
+    Re-orders first-stage retrieval candidates with a small CPU cross-encoder:
+    - Scores only the top N candidates, in batches
+    - Stops when the per-request time budget would be exceeded
+    - Tracks its own latency percentiles
+    """
+
+    def __init__(self,
+                 model_name: str = RERANKER_MODEL,
+                 top_n: int = RERANK_TOP_N,
+                 batch_size: int = RERANK_BATCH_SIZE,
+                 budget_ms: float = RERANK_BUDGET_MS):
+        from sentence_transformers import CrossEncoder
+
+        self.model = CrossEncoder(model_name, device="cpu", max_length=256)
+        self.top_n = top_n
+        self.batch_size = batch_size
+        self.budget = budget_ms / 1000.0
+
+        self._latencies = deque(maxlen=1000)
+        self._lock = threading.Lock()
+        self._stats = {
+            "requests": 0,
+            "reranked": 0,
+            "budget_exceeded": 0,
+            "candidates_scored": 0
+        }
+        print(f"Cross-encoder re-ranker initialized with {model_name}")
+
+    def rerank(self, query: str, documents: List[Document], budget: Optional[float] = None) -> Optional[List[Document]]:
+        """
+        Return the documents re-ordered by cross-encoder score,
+        or None if the budget ran out before every candidate was scored.
+        """
+        budget = self.budget if budget is None else budget
+        candidates = documents[:self.top_n]
+        remainder = documents[self.top_n:]
+
+        start = time.perf_counter()
+        scores = []
+        batch_time = 0.0
+        completed = True
+
+        for batch_start in range(0, len(candidates), self.batch_size):
+            # Skip the next batch if it is not expected to finish within the budget
+            elapsed = time.perf_counter() - start
+            if elapsed + batch_time > budget:
+                completed = False
+                break
+
+            batch = candidates[batch_start:batch_start + self.batch_size]
+            batch_start_time = time.perf_counter()
+            scores.extend(self.model.predict([(query, doc.text) for doc in batch], batch_size=len(batch)))
+            batch_time = time.perf_counter() - batch_start_time
+
+        duration = time.perf_counter() - start
+        with self._lock:
+            self._latencies.append(duration)
+            self._stats["requests"] += 1
+            self._stats["candidates_scored"] += len(scores)
+            if completed:
+                self._stats["reranked"] += 1
+            else:
+                self._stats["budget_exceeded"] += 1
+
+        if not completed:
+            return None
+
+        ranked = sorted(zip(scores, range(len(candidates))), key=lambda x: x[0], reverse=True)
+        return [candidates[i] for _, i in ranked] + remainder
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get re-ranking statistics including latency percentiles in milliseconds"""
+        with self._lock:
+            stats = self._stats.copy()
+            latencies = list(self._latencies)
+
+        stats["top_n"] = self.top_n
+        stats["budget_ms"] = self.budget * 1000
+        if latencies:
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+            stats["latency_ms"] = {"p50": round(p50, 2), "p95": round(p95, 2), "p99": round(p99, 2)}
+        else:
+            stats["latency_ms"] = {"p50": 0, "p95": 0, "p99": 0}
+
+        return stats
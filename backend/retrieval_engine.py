@@ -1,8 +1,9 @@
 
 import os
-import json
+import re
+import hashlib
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import Callable, List, Dict, Any, Optional, Set, Tuple, Union
 import numpy as np
 
 # For vector storage and retrieval
@@ -10,16 +11,31 @@ import chromadb
 from chromadb.utils import embedding_functions
 from sentence_transformers import SentenceTransformer
 
+from near_duplicates import NearDuplicateIndex
+from quantized_index import QuantizedVectorIndex, VECTOR_PRECISION
+from knowledge_epoch import bump_epoch
+
 # Create necessary directories
 DATA_DIR = Path("./data")
 DOCUMENTS_DIR = DATA_DIR / "documents"
-METADATA_FILE = DATA_DIR / "document_metadata.json"
 VECTOR_DB_DIR = DATA_DIR / "vectordb"
 VECTOR_DB_DIR.mkdir(parents=True, exist_ok=True)
 
 # Maximum chunk size for document splitting
 MAX_CHUNK_SIZE = 1000  # characters
 MAX_CHUNK_OVERLAP = 200  # characters
+# A paragraph whose hash ends in one of these closes its chunk: one in four on average
+CHUNK_BOUNDARY_DIGITS = "0123"
+# New chunks embedded and written per batch, across documents when several are indexed together
+INDEX_BATCH_CHUNKS = int(os.getenv("INDEX_BATCH_CHUNKS", "256"))
+
+# Document access levels each role may search; unknown roles only see public content
+ROLE_ACCESS_LEVELS = {
+    "student": ["public", "student"],
+    "faculty": ["public", "student", "faculty"],
+    "admin": ["public", "student", "faculty", "admin"],
+}
+DEFAULT_ACCESS_LEVEL = "public"
 
 class Document:
     """Simple document class to store text and metadata"""
@@ -61,16 +77,36 @@ class RetrievalEngine:
             )
             print("Created new vector collection")
         
+        # Tag chunks indexed before access levels existed so role filters can see them
+        self._backfill_access_levels()
+        
+        # Near-duplicate detection for chunks at ingest
+        self.dedup_index = NearDuplicateIndex()
+        # Receives documents whose linked chunks went away and need their own copies;
+        # main.py hands them to the ingestion queue, without it they are indexed inline
+        self.requeue_documents: Optional[Callable[[List[str]], Any]] = None
+        
+        # Optional reduced-precision search index; Chroma stays the store for metadata
+        self.vector_index = None
+        if VECTOR_PRECISION != "float32":
+            self.vector_index = QuantizedVectorIndex(VECTOR_PRECISION)
+            self._sync_vector_index()
+        
         # Initialize document processor reference
         from document_processor import DocumentProcessor
         self.document_processor = DocumentProcessor()
 
     def _chunk_text(self, text: str, chunk_size: int = MAX_CHUNK_SIZE, chunk_overlap: int = MAX_CHUNK_OVERLAP) -> List[str]:
         """Split text into chunks with overlap"""
+        return [text[start:end] for start, end in self._chunk_spans(text, chunk_size, chunk_overlap)]
+
+    def _chunk_spans(self, text: str, chunk_size: int = MAX_CHUNK_SIZE,
+                     chunk_overlap: int = MAX_CHUNK_OVERLAP) -> List[Tuple[int, int]]:
+        """(start, end) positions of overlapping chunks of text"""
         if not text:
             return []
             
-        chunks = []
+        spans = []
         start = 0
         text_length = len(text)
         
@@ -88,70 +124,351 @@ class RetrievalEngine:
                         break
             
             # Add the chunk
-            chunks.append(text[start:end])
+            spans.append((start, end))
             
             # Move the start position for the next chunk, considering overlap
             start = end - chunk_overlap if end < text_length else end
         
-        return chunks
+        return spans
 
-    def update_vector_store(self, doc_id: str):
-        """Process and add a document to the vector store"""
-        try:
-            # Get document text
-            doc_text = self.document_processor.get_document_text(doc_id)
-            if not doc_text:
-                print(f"Document text not found for ID: {doc_id}")
-                return False
-            
-            # Get document metadata
-            with open(METADATA_FILE, "r") as f:
-                all_metadata = json.load(f)
-            
-            if doc_id not in all_metadata:
-                print(f"Document metadata not found for ID: {doc_id}")
-                return False
-                
-            metadata = all_metadata[doc_id]
+    def _chunk_document(self, text: str, chunk_size: int = MAX_CHUNK_SIZE) -> Tuple[str, List[Tuple[str, int, int]]]:
+        """
+        Normalize text to its paragraphs separated by blank lines, and split that into
+        (chunk_hash, start, end) spans along paragraph boundaries.
+        Where a chunk ends depends only on nearby paragraphs (a paragraph whose hash hits
+        CHUNK_BOUNDARY_DIGITS closes the chunk), so editing one paragraph changes only
+        the chunks around it and every other chunk keeps its hash.
+        Identical chunks within a document are kept once.
+        """
+        paragraphs = [paragraph.strip() for paragraph in re.split(r"\n\s*\n", text)]
+        text = "\n\n".join(paragraph for paragraph in paragraphs if paragraph)
+        
+        pieces = []
+        position = 0
+        for paragraph in paragraphs:
+            if not paragraph:
+                continue
+            # Paragraphs too long for one chunk are split on their own, so their pieces stay local
+            if len(paragraph) > chunk_size:
+                pieces.extend((position + start, position + end) for start, end in self._chunk_spans(paragraph, chunk_size))
+            else:
+                pieces.append((position, position + len(paragraph)))
+            position += len(paragraph) + 2
+        
+        spans = []
+        current_start = None
+        current_end = 0
+        for start, end in pieces:
+            if current_start is not None and end - current_start > chunk_size:
+                spans.append((current_start, current_end))
+                current_start = None
             
-            # Chunk the document
-            chunks = self._chunk_text(doc_text)
+            if current_start is None:
+                current_start = start
+            current_end = end
             
-            # Prepare for batch add
-            doc_ids = []
+            if self._content_hash(text[start:end])[-1] in CHUNK_BOUNDARY_DIGITS:
+                spans.append((current_start, current_end))
+                current_start = None
+        if current_start is not None:
+            spans.append((current_start, current_end))
+        
+        seen = set()
+        hashed = []
+        for start, end in spans:
+            chunk_hash = self._content_hash(text[start:end])
+            if chunk_hash not in seen:
+                seen.add(chunk_hash)
+                hashed.append((chunk_hash, start, end))
+        return text, hashed
+
+    @staticmethod
+    def _content_hash(text: str) -> str:
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+    @staticmethod
+    def _chunk_id(doc_id: str, chunk_hash: str) -> str:
+        return f"{doc_id}_{chunk_hash}"
+
+    def _backfill_access_levels(self):
+        """Add the default access level to chunks that were indexed without one"""
+        try:
+            results = self.collection.get(include=["metadatas"])
+            ids = []
             metadatas = []
+            for chunk_id, metadata in zip(results.get("ids", []), results.get("metadatas") or []):
+                if metadata is not None and "access_level" not in metadata:
+                    ids.append(chunk_id)
+                    metadatas.append({**metadata, "access_level": DEFAULT_ACCESS_LEVEL})
             
-            for i, chunk in enumerate(chunks):
-                chunk_id = f"{doc_id}_chunk_{i}"
-                doc_ids.append(chunk_id)
+            if ids:
+                self.collection.update(ids=ids, metadatas=metadatas)
+                print(f"Backfilled access level on {len(ids)} chunks")
                 
-                # Create metadata for the chunk
-                chunk_metadata = {
-                    "doc_id": doc_id,
-                    "chunk_id": i,
-                    "title": metadata.get("title", "Untitled"),
-                    "source": metadata.get("source", "Unknown"),
-                    "chunk_index": i,
-                    "total_chunks": len(chunks),
-                }
-                metadatas.append(chunk_metadata)
+        except Exception as e:
+            print(f"Error backfilling access levels: {e}")
+
+    def _sync_vector_index(self):
+        """Load vectors from the collection if the compact index is out of step with it"""
+        try:
+            if len(self.vector_index) == self.collection.count():
+                return
             
-            # Add to the collection
-            if chunks:
-                self.collection.add(
-                    documents=chunks,
-                    ids=doc_ids,
-                    metadatas=metadatas
-                )
-                print(f"Added {len(chunks)} chunks from document {doc_id}")
-                return True
+            results = self.collection.get(include=["embeddings", "metadatas"])
+            self.vector_index.clear()
+            self.vector_index.add(
+                results["ids"],
+                results["embeddings"],
+                [(m or {}).get("access_level", DEFAULT_ACCESS_LEVEL) for m in results["metadatas"]]
+            )
+            print(f"Loaded {len(results['ids'])} vectors into the {VECTOR_PRECISION} index")
             
-            return False
+        except Exception as e:
+            print(f"Error syncing vector index: {e}")
+
+    def _access_filter(self, role: str) -> Dict[str, Any]:
+        """Build the metadata filter restricting a query to the levels a role may see"""
+        levels = ROLE_ACCESS_LEVELS.get(role, [DEFAULT_ACCESS_LEVEL])
+        if len(levels) == 1:
+            return {"access_level": levels[0]}
+        return {"access_level": {"$in": levels}}
+
+    def update_vector_store(self, doc_id: str, on_stage: Optional[Callable[[str], None]] = None):
+        """
+        Process and add a document to the vector store, or bring it up to date with a new version.
+        on_stage, if given, is called with "chunking" and then "embedding" as work progresses.
+        """
+        try:
+            failures = self.index_documents([doc_id], on_stage)
+            if doc_id in failures:
+                print(f"Error updating vector store: {failures[doc_id]}")
+                return False
+            return True
             
         except Exception as e:
             print(f"Error updating vector store: {e}")
             return False
 
+    def index_documents(self, doc_ids: List[str],
+                        on_stage: Optional[Callable[[str], None]] = None) -> Dict[str, str]:
+        """
+        Add documents to the vector store, or bring them up to date with new versions.
+        Chunks are identified by their content hash, so only chunks that are new in this version are
+        embedded and chunks that disappeared are deleted; unchanged chunks are kept as they are.
+        New chunks from all the documents are embedded together in batches of INDEX_BATCH_CHUNKS.
+        Returns {doc_id: error} for the documents that could not be indexed.
+        """
+        failures = {}
+        
+        # Chunk every document and work out what changed
+        if on_stage is not None:
+            on_stage("chunking")
+        plans = []
+        for doc_id in doc_ids:
+            try:
+                plan = self._plan_document(doc_id)
+            except Exception as e:
+                plan = None
+                failures[doc_id] = str(e)
+            if isinstance(plan, str):
+                failures[doc_id] = plan
+            elif plan is not None:
+                plans.append(plan)
+        
+        new_chunks = [chunk for plan in plans for chunk in plan["new_chunks"]]
+        if new_chunks and on_stage is not None:
+            on_stage("embedding")
+        
+        # Embed and add new chunks across documents, one batch at a time
+        added = 0
+        try:
+            for start in range(0, len(new_chunks), INDEX_BATCH_CHUNKS):
+                batch = new_chunks[start:start + INDEX_BATCH_CHUNKS]
+                ids = [chunk_id for chunk_id, _, _ in batch]
+                embeddings = self.embedding_model.encode([text for _, text, _ in batch]).tolist()
+                # Chunk text is kept in the chunk store, not duplicated in the collection
+                self.collection.add(
+                    embeddings=embeddings,
+                    ids=ids,
+                    metadatas=[metadata for _, _, metadata in batch]
+                )
+                if self.vector_index is not None:
+                    self.vector_index.add(ids, embeddings, [metadata["access_level"] for _, _, metadata in batch])
+                added += len(batch)
+        except Exception as e:
+            # Chunks that never reached the collection must not be found as near-duplicates later
+            self.dedup_index.remove_chunks([chunk_id for chunk_id, _, _ in new_chunks[added:]])
+            for plan in plans:
+                failures[plan["doc_id"]] = f"Embedding failed: {e}"
+            # Planning already dropped the dependents' links, so they still need their own copies
+            self._reindex_dependents(self._dependents_of(plans, doc_ids))
+            return failures
+        
+        # New chunk text becomes readable as the old version's is replaced, before removed chunks are deleted
+        try:
+            self.document_processor.store_chunked_text(
+                [(plan["doc_id"], plan["sha256"], plan["text"], plan["spans"]) for plan in plans])
+        except Exception as e:
+            for plan in plans:
+                failures[plan["doc_id"]] = f"Storing chunk text failed: {e}"
+            self._reindex_dependents(self._dependents_of(plans, doc_ids))
+            return failures
+        
+        metadata_updates = {}
+        for plan in plans:
+            doc_id = plan["doc_id"]
+            
+            if plan["kept_ids"]:
+                self.collection.update(ids=plan["kept_ids"], metadatas=plan["kept_metadatas"])
+                if self.vector_index is not None:
+                    # The compact index stores access levels per row, so re-add rows whose level may have changed
+                    self.vector_index.remove(plan["kept_ids"])
+                    kept = self.collection.get(ids=plan["kept_ids"], include=["embeddings"])
+                    self.vector_index.add(kept["ids"], kept["embeddings"],
+                                          [m["access_level"] for m in plan["kept_metadatas"]])
+            
+            # Delete what the new version no longer contains, after its replacements are searchable
+            if plan["removed_ids"]:
+                self.collection.delete(ids=plan["removed_ids"])
+                if self.vector_index is not None:
+                    self.vector_index.remove(plan["removed_ids"])
+            
+            # Record how much of the document was already in the index
+            total = plan["total_chunks"]
+            linked_chunks = plan["linked_chunks"]
+            metadata_updates[doc_id] = {
+                "dedup": {
+                    "total_chunks": total,
+                    "duplicate_chunks": len(linked_chunks),
+                    "dedup_ratio": len(linked_chunks) / total,
+                    "linked_chunks": linked_chunks
+                },
+                "last_indexing": {
+                    "embedded_chunks": len(plan["new_chunks"]),
+                    "unchanged_chunks": total - len(plan["new_chunks"]) - len(linked_chunks),
+                    "removed_chunks": len(plan["removed_ids"])
+                }
+            }
+            
+            print(f"Indexed document {doc_id}: {len(plan['new_chunks'])} chunks embedded, "
+                  f"{len(plan['removed_ids'])} removed, {len(linked_chunks)} near-duplicates linked")
+        
+        self.document_processor.update_metadata_many(metadata_updates)
+        
+        # Documents that linked to removed chunks now need their own copies
+        self._reindex_dependents(self._dependents_of(plans, doc_ids))
+        
+        if plans:
+            bump_epoch()
+        return failures
+
+    @staticmethod
+    def _dependents_of(plans: List[Dict[str, Any]], doc_ids: List[str]) -> Set[str]:
+        """Documents whose links the plans dropped, other than the ones being indexed"""
+        dependents = set()
+        for plan in plans:
+            dependents.update(plan["dependents"])
+        dependents.difference_update(doc_ids)
+        return dependents
+
+    def _reindex_dependents(self, dependents: Set[str]):
+        """Re-index documents that lost the chunks they linked to"""
+        if not dependents:
+            return
+        if self.requeue_documents is not None:
+            self.requeue_documents(sorted(dependents))
+        else:
+            self.index_documents(sorted(dependents))
+
+    def _plan_document(self, doc_id: str) -> Union[Dict[str, Any], str]:
+        """
+        Chunk one document and diff it against its chunks already in the collection.
+        Registers new chunks with the near-duplicate index; returns the plan, or an error message.
+        """
+        # Get document text
+        doc_text = self.document_processor.get_document_text(doc_id)
+        if not doc_text:
+            return f"Document text not found for ID: {doc_id}"
+        
+        # Get document metadata
+        metadata = self.document_processor.get_metadata(doc_id)
+        if metadata is None:
+            return f"Document metadata not found for ID: {doc_id}"
+        
+        # Chunk the document
+        doc_text, chunks = self._chunk_document(doc_text)
+        if not chunks:
+            return f"Document has no text to index: {doc_id}"
+        
+        # Chunks already in the collection for this document, from a previous version or a previous attempt
+        existing = self.collection.get(where={"doc_id": doc_id}, include=["metadatas"])
+        existing_metadata = dict(zip(existing.get("ids") or [], existing.get("metadatas") or []))
+        
+        wanted_ids = {self._chunk_id(doc_id, chunk_hash) for chunk_hash, _, _ in chunks}
+        removed_ids = [chunk_id for chunk_id in existing_metadata if chunk_id not in wanted_ids]
+        
+        # Forget removed chunks and this document's old links first, so new chunks are never linked to them
+        dependents = self.dedup_index.remove_chunks(removed_ids)
+        dependents.discard(doc_id)
+        self.dedup_index.unlink_document(doc_id)
+        
+        plan = {
+            "doc_id": doc_id,
+            "sha256": metadata.get("sha256"),
+            "text": doc_text,
+            "spans": [],  # (chunk_id, chunk_index, start, end) for the chunk store
+            "total_chunks": len(chunks),
+            "new_chunks": [],  # (chunk_id, text, metadata)
+            "kept_ids": [],
+            "kept_metadatas": [],
+            "removed_ids": removed_ids,
+            "linked_chunks": {},
+            "dependents": dependents
+        }
+        
+        for i, (chunk_hash, start, end) in enumerate(chunks):
+            chunk_id = self._chunk_id(doc_id, chunk_hash)
+            chunk = doc_text[start:end]
+            plan["spans"].append((chunk_id, i, start, end))
+            
+            # Create metadata for the chunk
+            chunk_metadata = {
+                "doc_id": doc_id,
+                "chunk_id": i,
+                "chunk_hash": chunk_hash,
+                "title": metadata.get("title", "Untitled"),
+                "source": metadata.get("source", "Unknown"),
+                "chunk_index": i,
+                "total_chunks": len(chunks),
+                "access_level": metadata.get("access_level", DEFAULT_ACCESS_LEVEL),
+            }
+            
+            # Unchanged chunks keep their embedding; only moved or retitled ones get new metadata
+            if chunk_id in existing_metadata:
+                if existing_metadata[chunk_id] != chunk_metadata:
+                    plan["kept_ids"].append(chunk_id)
+                    plan["kept_metadatas"].append(chunk_metadata)
+                    # Documents linked to a chunk whose access level changed must index their own copies
+                    if existing_metadata[chunk_id].get("access_level") != chunk_metadata["access_level"]:
+                        dependents.update(self.dedup_index.set_access_level([chunk_id], chunk_metadata["access_level"]))
+                        dependents.discard(doc_id)
+                continue
+            
+            # Link near-duplicates to an existing chunk with the same access level instead of embedding
+            # another copy; linking across levels would hide this text from roles that may see it
+            signature = self.dedup_index.signature(chunk)
+            duplicate_of = self.dedup_index.find_duplicate(signature, chunk_metadata["access_level"])
+            if duplicate_of is not None:
+                self.dedup_index.link(duplicate_of, doc_id)
+                plan["linked_chunks"][str(i)] = duplicate_of
+                continue
+            
+            # Register immediately so repeated chunks within this document, and later documents in the batch, are caught too
+            self.dedup_index.add(chunk_id, doc_id, signature, chunk_metadata["access_level"])
+            plan["new_chunks"].append((chunk_id, chunk, chunk_metadata))
+        
+        return plan
+
     def remove_document(self, doc_id: str):
         """Remove a document's chunks from the vector store"""
         try:
@@ -165,10 +482,16 @@ class RetrievalEngine:
                 for chunk_id in results["ids"]:
                     self.collection.delete(chunk_id)
                 
+                if self.vector_index is not None:
+                    self.vector_index.remove(results["ids"])
+                
                 print(f"Removed {len(results['ids'])} chunks for document {doc_id}")
-                return True
             
-            return False
+            # Documents that linked to the removed chunks now need their own copies
+            self._reindex_dependents(self.dedup_index.remove_document(doc_id))
+            
+            bump_epoch()
+            return bool(results and results.get("ids"))
             
         except Exception as e:
             print(f"Error removing document from vector store: {e}")
@@ -179,40 +502,69 @@ class RetrievalEngine:
         try:
             # Clear the collection
             self.collection.delete(where={})
+            self.dedup_index.clear()
+            if self.vector_index is not None:
+                self.vector_index.clear()
             print("Cleared vector collection")
             
             # Get all document IDs
-            with open(METADATA_FILE, "r") as f:
-                all_metadata = json.load(f)
+            doc_ids = self.document_processor.list_document_ids()
             
             # Add each document
-            for doc_id in all_metadata.keys():
+            for doc_id in doc_ids:
                 self.update_vector_store(doc_id)
             
-            print(f"Rebuilt vector index with {len(all_metadata)} documents")
+            print(f"Rebuilt vector index with {len(doc_ids)} documents")
+            bump_epoch()
             return True
             
         except Exception as e:
             print(f"Error rebuilding index: {e}")
             return False
 
-    def retrieve_context(self, query: str, role: str = "student", top_k: int = 5) -> List[Document]:
+    def embed_query(self, query: str) -> List[float]:
+        """Embed a query with the same model used for the collection"""
+        return self.embedding_model.encode(query).tolist()
+
+    def retrieve_context(self, query: str, role: str = "student", top_k: int = 5,
+                         query_embedding: Optional[List[float]] = None) -> List[Document]:
         """
         Retrieve relevant context for a query:
         1. Perform semantic search against the vector store
         2. Return top matches as Document objects
+
+        A precomputed query_embedding can be passed to avoid embedding the query twice.
+        Access control is applied inside the vector query, so top_k is filled only
+        with chunks the role is allowed to see.
         """
         try:
+            if self.vector_index is not None:
+                return self._retrieve_from_vector_index(query, role, top_k, query_embedding)
+            
+            where = self._access_filter(role)
+            
             # Query the collection
-            results = self.collection.query(
-                query_texts=[query],
-                n_results=top_k
-            )
+            if query_embedding is not None:
+                results = self.collection.query(
+                    query_embeddings=[query_embedding],
+                    n_results=top_k,
+                    where=where
+                )
+            else:
+                results = self.collection.query(
+                    query_texts=[query],
+                    n_results=top_k,
+                    where=where
+                )
             
-            # Create Document objects
+            # Create Document objects, with chunk text from the chunk store
             documents = []
-            if results and results.get("documents") and results.get("documents")[0]:
-                for i, doc_text in enumerate(results["documents"][0]):
+            if results and results.get("ids") and results["ids"][0]:
+                ids = results["ids"][0]
+                texts = self._chunk_texts(ids, (results.get("documents") or [None])[0])
+                for i, chunk_id in enumerate(ids):
+                    if texts[i] is None:
+                        continue
                     metadata = results["metadatas"][0][i] if results.get("metadatas") and results["metadatas"][0] else {}
                     
                     # Add distance/score if available
@@ -221,19 +573,52 @@ class RetrievalEngine:
                         score = results["distances"][0][i]
                     
                     documents.append(Document(
-                        text=doc_text,
+                        text=texts[i],
                         metadata=metadata,
                         score=score
                     ))
-            
-            # Role-based filtering (could be expanded)
-            if role != "admin" and role != "faculty":
-                # For regular students, filter out admin-only content if needed
-                # (This is just a placeholder for role-based access logic)
-                pass
                 
             return documents
             
         except Exception as e:
             print(f"Error retrieving context: {e}")
             return []
+
+    def _retrieve_from_vector_index(self, query: str, role: str, top_k: int,
+                                    query_embedding: Optional[List[float]] = None) -> List[Document]:
+        """Search the reduced-precision index, then fetch the matching chunks' metadata and text"""
+        if query_embedding is None:
+            query_embedding = self.embed_query(query)
+        
+        levels = ROLE_ACCESS_LEVELS.get(role, [DEFAULT_ACCESS_LEVEL])
+        hits = self.vector_index.search(query_embedding, top_k, levels)
+        if not hits:
+            return []
+        
+        results = self.collection.get(
+            ids=[chunk_id for chunk_id, _ in hits],
+            include=["documents", "metadatas"]
+        )
+        texts = self._chunk_texts(results["ids"], results.get("documents"))
+        found = {
+            chunk_id: (text, metadata)
+            for chunk_id, text, metadata in zip(results["ids"], texts, results["metadatas"])
+            if text is not None
+        }
+        
+        documents = []
+        for chunk_id, score in hits:
+            if chunk_id in found:
+                text, metadata = found[chunk_id]
+                documents.append(Document(text=text, metadata=metadata or {}, score=score))
+        
+        return documents
+
+    def _chunk_texts(self, chunk_ids: List[str], collection_texts: Optional[List[Optional[str]]]) -> List[Optional[str]]:
+        """
+        Text for each chunk ID from the chunk store. Chunks indexed before the chunk store
+        existed still carry their text in the collection, which is used instead.
+        """
+        stored = self.document_processor.get_chunk_texts(chunk_ids)
+        collection_texts = collection_texts or [None] * len(chunk_ids)
+        return [stored.get(chunk_id, collection_text) for chunk_id, collection_text in zip(chunk_ids, collection_texts)]
@@ -1,8 +1,46 @@
 
 from retrieval_engine import RetrievalEngine, Document
 from alu_brain import ALUBrainManager
-from typing import List, Dict, Any, Optional
-import time
+from semantic_cache import SemanticQueryCache
+from ttl_cache import TTLCache
+from shared_cache import get_shared_cache
+from singleflight import SingleFlight
+from reranker import CrossEncoderReranker, RERANKER_ENABLED
+from deadline import Deadline
+from knowledge_epoch import current_epoch, EPOCH_CACHE_TTL
+from query_analysis import QueryAnalysis
+from typing import List, Dict, Any, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+import threading
+import os
+
+# Number of vector store candidates fetched per query (first stage)
+VECTOR_TOP_K = int(os.getenv("VECTOR_TOP_K", "5"))
+MAX_CONTEXT_RESULTS = 10
+
+# Concurrent retrieval: worker threads shared by all requests and the time
+# after which whatever has finished is merged without the slower lookup
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", "4"))
+RETRIEVAL_TIMEOUT = float(os.getenv("RETRIEVAL_TIMEOUT", "5.0"))  # seconds
+# The brain has its own threads, so a stalled vector store can never queue brain lookups behind it
+BRAIN_WORKERS = int(os.getenv("BRAIN_WORKERS", "4"))
+# Vector lookups running or queued at once; past this, requests skip the vector stage
+# rather than wait behind lookups that are already over time
+VECTOR_MAX_INFLIGHT = int(os.getenv("VECTOR_MAX_INFLIGHT", str(2 * RETRIEVAL_WORKERS)))
+
+# Tiered retrieval: the ALU Brain is searched first and the vector stage is skipped
+# when its top hit is an exact question match with a clear lead over the runner-up
+TIERED_RETRIEVAL = os.getenv("TIERED_RETRIEVAL", "true").lower() == "true"
+BRAIN_CONFIDENT_SCORE = float(os.getenv("BRAIN_CONFIDENT_SCORE", "40.0"))
+BRAIN_CONFIDENT_MARGIN = float(os.getenv("BRAIN_CONFIDENT_MARGIN", "10.0"))
+# Start the vector stage alongside the brain search and discard it if the brain is
+# confident: lower latency for ambiguous queries at the cost of embedding every query
+SPECULATIVE_VECTOR_SEARCH = os.getenv("SPECULATIVE_VECTOR_SEARCH", "false").lower() == "true"
+# Longest the vector stage waits for the brain's verdict, at most half the remaining budget;
+# a slow brain then runs alongside the vector stage instead of using up the deadline
+TIER_BRAIN_WAIT = float(os.getenv("TIER_BRAIN_WAIT", "0.25"))  # seconds
 
 class ExtendedRetrievalEngine(RetrievalEngine):
     """
@@ -13,63 +51,312 @@ class ExtendedRetrievalEngine(RetrievalEngine):
     def __init__(self):
         super().__init__()
         self.alu_brain = ALUBrainManager()
-        self._cache = {}  # Simple in-memory cache
-        self._cache_ttl = 300  # Cache TTL in seconds (5 minutes)
+        # Entries are keyed on the knowledge epoch, so the TTL only bounds staleness;
+        # the shared L2 lets other workers reuse what this one computed
+        self._cache = TTLCache("retrieval", max_entries=2048, max_bytes=64 * 1024 * 1024,
+                               ttl=EPOCH_CACHE_TTL, l2=get_shared_cache())
+        self.semantic_cache = SemanticQueryCache()  # Catches paraphrases the exact cache misses
+        self.reranker = CrossEncoderReranker() if RERANKER_ENABLED else None
+        self._executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+        self._brain_executor = ThreadPoolExecutor(max_workers=BRAIN_WORKERS, thread_name_prefix="brain")
+        # Released when a lookup actually ends, so lookups abandoned at the timeout still count
+        self._vector_slots = threading.BoundedSemaphore(VECTOR_MAX_INFLIGHT)
+        self._tier_stats = {"brain_only": 0, "brain_and_vector": 0}
+        self._inflight = SingleFlight("retrieval")
         print("Extended Retrieval Engine initialized with ALU Brain integration and performance optimizations")
     
-    def retrieve_context(self, query: str, role: str = "student", **kwargs):
+    def retrieve_context(self, query: str, role: str = "student", deadline: Optional[Deadline] = None,
+                         analysis: Optional[QueryAnalysis] = None, **kwargs):
         """
         Enhanced retrieve_context that combines vector store results with ALU Brain results
         using intelligent merging based on relevance scores
         """
+        if analysis is None:
+            analysis = QueryAnalysis(query)
+        
         # Check cache first for improved performance
-        cache_key = f"{query}:{role}"
+        epoch = current_epoch()
+        cache_key = f"{epoch}:{analysis.key(role)}"
         cached_result = self._get_from_cache(cache_key)
         if cached_result:
             return cached_result
-            
-        # Get results from the original vector store (parent class)
-        vector_results = super().retrieve_context(query, role, **kwargs)
         
-        # Get results from ALU Brain
-        brain_results = self.alu_brain.search(query, top_k=5)
+        # Identical queries already being answered wait for that answer instead of recomputing it
+        def compute():
+            results = self._compute_context(query, role, epoch, cache_key, deadline, analysis, **kwargs)
+            return results, list(deadline.degraded_reasons) if deadline is not None else []
+        
+        try:
+            results, degraded_reasons = self._inflight.do(
+                cache_key, compute, timeout=deadline.remaining() if deadline is not None else None)
+        except TimeoutError as e:
+            print(f"Retrieval gave up waiting: {e}")
+            deadline.mark_degraded("coalesced_wait")
+            return []
+        return self._share_result(results, degraded_reasons, deadline)
+    
+    def _compute_context(self, query: str, role: str, epoch: int, cache_key: str,
+                         deadline: Optional[Deadline], analysis: QueryAnalysis, **kwargs) -> List[Document]:
+        """Run the retrieval pipeline for a query that missed the cache"""
+        # Get results from ALU Brain; a confident answer makes the vector stage unnecessary
+        brain_documents, brain_confident = self._brain_stage(query, deadline, analysis)
+        if TIERED_RETRIEVAL and brain_confident:
+            return self._finish_brain_only(cache_key, self._combine_results(query, [], brain_documents), deadline)
+        
+        # Get results from the original vector store, unless a paraphrase was answered recently
+        query_embedding, vector_results, semantic_result = None, [], None
+        if deadline is not None and deadline.expired():
+            deadline.mark_degraded("vector_search")
+        else:
+            query_embedding, vector_results, semantic_result = self._vector_stage(query, role, **kwargs)
+        if semantic_result is not None:
+            self._store_in_cache(cache_key, semantic_result)
+            return semantic_result
+        
+        self._tier_stats["brain_and_vector"] += 1
+        merged_results = self._combine_results(query, vector_results, brain_documents)
+        
+        # Store in cache, unless a stage was cut short
+        if deadline is None or not deadline.degraded:
+            self._store_in_cache(cache_key, merged_results)
+            self.semantic_cache.store(query_embedding, role, merged_results, epoch)
+        
+        return merged_results
+    
+    async def aretrieve_context(self, query: str, role: str = "student",
+                                deadline: Optional[Deadline] = None,
+                                analysis: Optional[QueryAnalysis] = None, **kwargs):
+        """
+        Async retrieve_context that runs the vector store and ALU Brain lookups on separate
+        bounded thread pools. With tiered retrieval the brain goes first and the vector stage only runs
+        when the brain is not confident or has not answered within TIER_BRAIN_WAIT; otherwise
+        both run concurrently, so latency is the
+        slower of the two rather than their sum. A lookup still running when the deadline
+        (or RETRIEVAL_TIMEOUT) passes is left out of the merge and the request is marked degraded.
+        """
+        if analysis is None:
+            analysis = QueryAnalysis(query)
+        
+        epoch = current_epoch()
+        cache_key = f"{epoch}:{analysis.key(role)}"
+        cached_result = self._get_from_cache(cache_key)
+        if cached_result:
+            return cached_result
+        
+        budget = deadline if deadline is not None else Deadline(RETRIEVAL_TIMEOUT)
+        
+        # Identical queries already being answered wait for that answer instead of recomputing it
+        async def compute():
+            results = await self._acompute_context(query, role, epoch, cache_key, budget, analysis, **kwargs)
+            return results, list(budget.degraded_reasons)
+        
+        try:
+            results, degraded_reasons = await self._inflight.do_async(cache_key, compute, timeout=budget.remaining())
+        except TimeoutError as e:
+            print(f"Retrieval gave up waiting: {e}")
+            budget.mark_degraded("coalesced_wait")
+            return []
+        return self._share_result(results, degraded_reasons, budget)
+    
+    async def _acompute_context(self, query: str, role: str, epoch: int, cache_key: str,
+                                budget: Deadline, analysis: QueryAnalysis, **kwargs) -> List[Document]:
+        """Run the concurrent retrieval pipeline for a query that missed the cache"""
+        run_vector_stage = functools.partial(self._vector_stage, query, role, **kwargs)
+        
+        brain_task = asyncio.get_running_loop().run_in_executor(
+            self._brain_executor, self._brain_stage, query, budget, analysis)
+        vector_task = None
+        if not TIERED_RETRIEVAL or SPECULATIVE_VECTOR_SEARCH:
+            vector_task = self._start_vector_stage(run_vector_stage)
+        
+        if TIERED_RETRIEVAL:
+            await asyncio.wait({brain_task}, timeout=min(TIER_BRAIN_WAIT, budget.remaining() / 2))
+            if brain_task.done() and not brain_task.exception():
+                brain_documents, brain_confident = brain_task.result()
+                if brain_confident:
+                    if vector_task is not None:
+                        vector_task.cancel()
+                    merged_results = await self._acombine_results(query, [], brain_documents, budget)
+                    return self._finish_brain_only(cache_key, merged_results, budget)
+            if vector_task is None:
+                vector_task = self._start_vector_stage(run_vector_stage)
+        
+        pending = {task for task in (vector_task, brain_task) if task is not None and not task.done()}
+        if pending:
+            await asyncio.wait(pending, timeout=budget.remaining())
+        done = {task for task in (vector_task, brain_task) if task is not None and task.done()}
+        
+        query_embedding, vector_results, semantic_result = None, [], None
+        vector_stage = self._task_result(vector_task, done, "vector store")
+        if vector_stage is None:
+            budget.mark_degraded("vector_search")
+        else:
+            query_embedding, vector_results, semantic_result = vector_stage
+        if semantic_result is not None:
+            self._store_in_cache(cache_key, semantic_result)
+            return semantic_result
+        
+        brain_stage = self._task_result(brain_task, done, "ALU Brain")
+        if brain_stage is None:
+            budget.mark_degraded("brain_search")
+        brain_documents = brain_stage[0] if brain_stage is not None else []
+        
+        self._tier_stats["brain_and_vector"] += 1
+        merged_results = await self._acombine_results(query, vector_results or [], brain_documents, budget)
+        
+        # Partial results are returned but never cached
+        if not budget.degraded:
+            self._store_in_cache(cache_key, merged_results)
+            self.semantic_cache.store(query_embedding, role, merged_results, epoch)
+        
+        return merged_results
+    
+    def _share_result(self, results: List[Document], degraded_reasons: List[str],
+                      deadline: Optional[Deadline]) -> List[Document]:
+        """Carry a shared computation's degraded state over to each caller's own deadline"""
+        if deadline is not None:
+            for reason in degraded_reasons:
+                deadline.mark_degraded(reason)
+        return results
+    
+    def _finish_brain_only(self, cache_key: str, merged_results: List[Document],
+                           deadline: Optional[Deadline]) -> List[Document]:
+        """Count and cache the context when the brain answered confidently on its own"""
+        self._tier_stats["brain_only"] += 1
+        if deadline is None or not deadline.degraded:
+            self._store_in_cache(cache_key, merged_results)
+        return merged_results
+    
+    def _start_vector_stage(self, run_vector_stage) -> Optional[asyncio.Future]:
+        """Run the vector stage on the retrieval pool, or return None if too many lookups are in flight"""
+        if not self._vector_slots.acquire(blocking=False):
+            print("Too many vector lookups in flight, continuing without the vector store")
+            return None
+        
+        try:
+            future = self._executor.submit(run_vector_stage)
+        except Exception:
+            self._vector_slots.release()
+            raise
+        # Fires when the lookup ends, or when it is cancelled before starting
+        future.add_done_callback(lambda _: self._vector_slots.release())
+        return asyncio.wrap_future(future)
+    
+    def _task_result(self, task: Optional[asyncio.Future], done: set, name: str):
+        """Result of a finished lookup, or None if it was skipped, failed or missed the timeout"""
+        if task is None:
+            return None
+        if task not in done:
+            print(f"Retrieval timed out waiting for {name}, continuing without it")
+            return None
+        if task.exception():
+            print(f"Error during {name} retrieval: {task.exception()}")
+            return None
+        return task.result()
+    
+    def _vector_stage(self, query: str, role: str, **kwargs) -> Tuple[Any, Optional[List[Document]], Optional[List[Document]]]:
+        """
+        Embed the query, check the semantic cache and, on a miss, search the vector store.
+        Returns (query_embedding, vector_results, semantic_cache_result).
+        """
+        query_embedding = self.embed_query(query)
+        semantic_result = self.semantic_cache.lookup(query_embedding, role)
+        if semantic_result is not None:
+            return query_embedding, None, semantic_result
+        
+        kwargs.setdefault("top_k", VECTOR_TOP_K)
+        vector_results = super().retrieve_context(query, role, query_embedding=query_embedding, **kwargs)
+        return query_embedding, vector_results, None
+    
+    def _brain_stage(self, query: str, deadline: Optional[Deadline] = None,
+                     analysis: Optional[QueryAnalysis] = None) -> Tuple[List[Document], bool]:
+        """
+        Search the ALU Brain and convert the hits into Document objects.
+        Returns (documents, confident) where confident means the vector stage can be skipped.
+        """
+        brain_results = self.alu_brain.search(query, top_k=5, deadline=deadline, analysis=analysis)
         
-        # Process ALU Brain results if available
         brain_documents = []
-        if brain_results:
-            brain_context = self.alu_brain.format_for_context(brain_results)
+        for result in brain_results:
+            entry = result['entry']
+            category = result['category']
+            
+            # Extract core information
+            question = entry.get('question', '')
+            answer = entry.get('answer', '')
+            entry_type = entry.get('type', 'text')
+            
+            # Create text content based on entry type
+            text = self._format_entry_content(entry, question, answer, entry_type)
             
-            for i, result in enumerate(brain_results):
-                entry = result['entry']
-                category = result['category']
-                
-                # Extract core information
-                question = entry.get('question', '')
-                answer = entry.get('answer', '')
-                entry_type = entry.get('type', 'text')
-                
-                # Create text content based on entry type
-                text = self._format_entry_content(entry, question, answer, entry_type)
-                
-                # Create Document object
-                doc = Document(
-                    text=text,
-                    metadata={
-                        'title': question or f"ALU {category.replace('_', ' ').title()} Knowledge",
-                        'source': f"ALU Brain: {category.replace('_', ' ').title()}",
-                        'type': entry_type,
-                        'score': result.get('score', 0)
-                    }
-                )
-                brain_documents.append(doc)
+            # Create Document object
+            doc = Document(
+                text=text,
+                metadata={
+                    'title': question or f"ALU {category.replace('_', ' ').title()} Knowledge",
+                    'source': f"ALU Brain: {category.replace('_', ' ').title()}",
+                    'type': entry_type,
+                    'score': result.get('score', 0)
+                }
+            )
+            brain_documents.append(doc)
         
-        # Intelligently merge vector and brain results
-        merged_results = self._merge_results(vector_results, brain_documents)
+        return brain_documents, self._brain_is_confident(brain_results)
+    
+    def _brain_is_confident(self, brain_results: List[Dict[str, Any]]) -> bool:
+        """Whether the top brain hit is an exact question match that clearly beats the runner-up"""
+        if not brain_results:
+            return False
         
-        # Store in cache
-        self._store_in_cache(cache_key, merged_results)
+        top = brain_results[0]
+        if top.get('score_breakdown', {}).get('exact_match', 0) <= 0:
+            return False
         
-        return merged_results
+        runner_up = brain_results[1]['score'] if len(brain_results) > 1 else 0
+        return top['score'] >= BRAIN_CONFIDENT_SCORE and top['score'] - runner_up >= BRAIN_CONFIDENT_MARGIN
+    
+    def get_coalescing_stats(self) -> Dict[str, Any]:
+        """Get how many retrievals were shared with an identical in-flight query"""
+        return self._inflight.get_stats()
+    
+    def get_tier_stats(self) -> Dict[str, Any]:
+        """Get how often the vector stage was skipped by tiered retrieval"""
+        stats = self._tier_stats.copy()
+        total = stats["brain_only"] + stats["brain_and_vector"]
+        stats["enabled"] = TIERED_RETRIEVAL
+        stats["brain_only_rate"] = stats["brain_only"] / total if total > 0 else 0
+        return stats
+    
+    def _combine_results(self, query: str, vector_results: List[Document], brain_documents: List[Document]) -> List[Document]:
+        """Order the vector and brain results into the final context list"""
+        # Let the cross-encoder order the candidate pool when enabled, falling back
+        # to positional merging if it runs out of time budget
+        if self.reranker is not None:
+            candidates = self._pool_results(vector_results, brain_documents)
+            reranked = self.reranker.rerank(query, candidates)
+            if reranked is not None:
+                return reranked[:MAX_CONTEXT_RESULTS]
+        
+        # Intelligently merge vector and brain results
+        return self._merge_results(vector_results, brain_documents)
+    
+    async def _acombine_results(self, query: str, vector_results: List[Document],
+                                brain_documents: List[Document], budget: Deadline) -> List[Document]:
+        """
+        _combine_results for the async path: reranking runs on the retrieval pool instead of the
+        event loop. Falls back to positional merging if no retrieval thread frees up in time.
+        """
+        if self.reranker is None:
+            return self._merge_results(vector_results, brain_documents)
+        
+        rerank = asyncio.get_running_loop().run_in_executor(
+            self._executor, self._combine_results, query, vector_results, brain_documents)
+        try:
+            return await asyncio.wait_for(rerank, timeout=budget.remaining())
+        except asyncio.TimeoutError:
+            print("Retrieval pool busy, merging results without reranking")
+            budget.mark_degraded("rerank")
+            return self._merge_results(vector_results, brain_documents)
     
     def _format_entry_content(self, entry, question, answer, entry_type):
         """Helper method to format entry content based on type"""
@@ -108,6 +395,14 @@ class ExtendedRetrievalEngine(RetrievalEngine):
             # Default format for text responses
             return f"{question}\n\n{answer}"
     
+    def _pool_results(self, vector_results: List[Document], brain_results: List[Document]) -> List[Document]:
+        """
+        Combine vector and brain results into one candidate pool for re-ranking,
+        each source in its own first-stage order
+        """
+        brain_sorted = sorted(brain_results, key=lambda x: x.metadata.get('score', 0), reverse=True)
+        return list(vector_results) + brain_sorted
+    
     def _merge_results(self, vector_results: List[Document], brain_results: List[Document]) -> List[Document]:
         """
         Intelligently merge vector and brain results based on relevance and diversity
@@ -152,29 +447,12 @@ class ExtendedRetrievalEngine(RetrievalEngine):
                 all_results.append(doc)
         
         # Ensure we don't return too many results (limit to 10)
-        return all_results[:10]
+        return all_results[:MAX_CONTEXT_RESULTS]
         
     def _get_from_cache(self, key):
         """Get result from cache if it exists and hasn't expired"""
-        if key in self._cache:
-            entry = self._cache[key]
-            if time.time() - entry['timestamp'] < self._cache_ttl:
-                return entry['data']
-        return None
+        return self._cache.get(key)
         
     def _store_in_cache(self, key, data):
-        """Store result in cache with current timestamp"""
-        self._cache[key] = {
-            'data': data,
-            'timestamp': time.time()
-        }
-        
-        # Clean up old cache entries
-        self._clean_cache()
-        
-    def _clean_cache(self):
-        """Remove expired cache entries"""
-        now = time.time()
-        expired_keys = [k for k, v in self._cache.items() if now - v['timestamp'] > self._cache_ttl]
-        for key in expired_keys:
-            del self._cache[key]
+        """Store result in cache, evicting the least recently used entries when full"""
+        self._cache.put(key, data)
@@ -0,0 +1,135 @@
+import os
+import time
+import threading
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from knowledge_epoch import current_epoch, EPOCH_CACHE_TTL
+
+# Cosine similarity above which two queries are treated as paraphrases
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "512"))  # entries
+SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", str(EPOCH_CACHE_TTL)))  # seconds
+
+class SemanticQueryCache:
+    """
+    Caches retrieval results keyed on query embeddings:
+    - Keeps a small ring buffer of recently answered query vectors
+    - Reuses cached context when a new query is a close paraphrase
+    - Tracks hit and miss statistics
+    """
+
+    def __init__(self,
+                 threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 max_entries: int = SEMANTIC_CACHE_SIZE,
+                 ttl: int = SEMANTIC_CACHE_TTL):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        # The vector matrix is allocated on first insert, once the dimension is known
+        self._vectors: Optional[np.ndarray] = None
+        self._timestamps = np.zeros(max_entries, dtype=np.float64)
+        self._epochs = np.full(max_entries, -1, dtype=np.int64)
+        self._roles = np.empty(max_entries, dtype=object)
+        self._payloads = [None] * max_entries
+        self._next_slot = 0
+        self._size = 0
+        self._lock = threading.Lock()
+
+        self._stats = {
+            "lookups": 0,
+            "hits": 0,
+            "misses": 0,
+            "similarity_sum": 0.0
+        }
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        """Return the embedding as a unit-length float32 vector"""
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def lookup(self, embedding, role: str) -> Optional[Any]:
+        """Return cached data for the closest recent query if it is similar enough"""
+        query_vector = self._normalize(embedding)
+
+        with self._lock:
+            self._stats["lookups"] += 1
+
+            if self._size == 0 or self._vectors is None:
+                self._stats["misses"] += 1
+                return None
+
+            # Exact scan: at a few hundred entries a matrix-vector product
+            # is cheaper than maintaining a graph or tree index
+            similarities = self._vectors[:self._size] @ query_vector
+
+            # Only consider live entries answered for the same role and knowledge epoch
+            valid = (self._roles[:self._size] == role) & \
+                    (self._epochs[:self._size] == current_epoch()) & \
+                    (time.time() - self._timestamps[:self._size] < self.ttl)
+            if not valid.any():
+                self._stats["misses"] += 1
+                return None
+
+            similarities = np.where(valid, similarities, -1.0)
+            best = int(np.argmax(similarities))
+            best_similarity = float(similarities[best])
+
+            if best_similarity >= self.threshold:
+                self._stats["hits"] += 1
+                self._stats["similarity_sum"] += best_similarity
+                return self._payloads[best]
+
+            self._stats["misses"] += 1
+            return None
+
+    def store(self, embedding, role: str, data: Any, epoch: Optional[int] = None) -> None:
+        """
+        Remember the result for a query, replacing the oldest entry when full.
+        Pass the epoch the result was computed under so a concurrent change is not missed.
+        """
+        query_vector = self._normalize(embedding)
+
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, query_vector.shape[0]), dtype=np.float32)
+
+            slot = self._next_slot
+            self._vectors[slot] = query_vector
+            self._timestamps[slot] = time.time()
+            self._epochs[slot] = current_epoch() if epoch is None else epoch
+            self._roles[slot] = role
+            self._payloads[slot] = data
+
+            self._next_slot = (slot + 1) % self.max_entries
+            self._size = min(self._size + 1, self.max_entries)
+
+    def clear(self) -> None:
+        """Drop all cached entries"""
+        with self._lock:
+            self._payloads = [None] * self.max_entries
+            self._timestamps[:] = 0
+            self._next_slot = 0
+            self._size = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit/miss statistics for the semantic cache"""
+        with self._lock:
+            stats = {
+                "lookups": self._stats["lookups"],
+                "hits": self._stats["hits"],
+                "misses": self._stats["misses"],
+                "entries": self._size,
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "ttl": self.ttl
+            }
+            hits = self._stats["hits"]
+
+            stats["hit_rate"] = hits / stats["lookups"] if stats["lookups"] > 0 else 0
+            stats["avg_hit_similarity"] = self._stats["similarity_sum"] / hits if hits > 0 else 0
+            return stats
@@ -0,0 +1,234 @@
+import os
+import time
+import zlib
+import pickle
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+DATA_DIR = Path("./data")
+
+SHARED_CACHE_ENABLED = os.getenv("SHARED_CACHE_ENABLED", "true").lower() == "true"
+SHARED_CACHE_MAX_BYTES = int(os.getenv("SHARED_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+SHARED_CACHE_COMPRESS_MIN = 1024  # values smaller than this are stored uncompressed
+SHARED_CACHE_TRIM_INTERVAL = 256  # writes between size checks
+
+def _default_cache_path() -> Path:
+    """Prefer tmpfs so the cache never touches disk, falling back to the data directory"""
+    configured = os.getenv("SHARED_CACHE_PATH")
+    if configured:
+        return Path(configured)
+
+    shm = Path("/dev/shm")
+    if shm.is_dir() and os.access(shm, os.W_OK):
+        # A private directory keeps other local users from planting entries
+        directory = shm / f"alu-cache-{os.getuid()}"
+        try:
+            directory.mkdir(mode=0o700, exist_ok=True)
+            if directory.stat().st_uid == os.getuid():
+                return directory / "shared_cache.db"
+        except OSError:
+            pass
+
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    return DATA_DIR / "shared_cache.db"
+
+class SharedCache:
+    """
+    Host-wide cache shared by all worker processes:
+    - SQLite in WAL mode, so readers never block each other or the writer
+    - Values are pickled and zlib-compressed when large
+    - Oldest entries are trimmed when the store grows past its size limit
+    - Failures are counted and treated as misses, never raised to callers
+    """
+
+    def __init__(self, path: Optional[Path] = None, max_bytes: int = SHARED_CACHE_MAX_BYTES):
+        self.path = Path(path) if path else _default_cache_path()
+        self.max_bytes = max_bytes
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes_since_trim = 0
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "writes": 0,
+            "trimmed": 0,
+            "errors": 0
+        }
+
+        conn = self._connection()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            ) WITHOUT ROWID
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS entries_created ON entries (created_at)")
+        print(f"Shared cache initialized at {self.path}")
+
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread and process; SQLite connections must not cross either"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            # A short busy timeout: a contended write is dropped rather than stalling a request
+            conn = sqlite3.connect(str(self.path), timeout=0.25, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")  # the cache is disposable
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _encode(value: Any) -> bytes:
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) >= SHARED_CACHE_COMPRESS_MIN:
+            return b"z" + zlib.compress(data, 1)
+        return b"p" + data
+
+    @staticmethod
+    def _decode(blob: bytes) -> Any:
+        data = blob[1:]
+        if blob[:1] == b"z":
+            data = zlib.decompress(data)
+        return pickle.loads(data)
+
+    def _count(self, stat: str, amount: int = 1) -> None:
+        with self._lock:
+            self._stats[stat] += amount
+
+    def lookup(self, namespace: str, key: str) -> Optional[Tuple[Any, float]]:
+        """Return (value, expires_at) for a live entry, or None"""
+        try:
+            row = self._connection().execute(
+                "SELECT value, expires_at FROM entries WHERE namespace = ? AND key = ?",
+                (namespace, key)
+            ).fetchone()
+            if row is None or row[1] < time.time():
+                self._count("misses")
+                return None
+            value = self._decode(row[0])
+        except Exception as e:
+            print(f"Shared cache read error: {e}")
+            self._count("errors")
+            return None
+
+        self._count("hits")
+        return value, row[1]
+
+    def store(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """Write an entry through to the shared store"""
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else float("inf")
+        try:
+            blob = self._encode(value)
+            self._connection().execute(
+                "INSERT OR REPLACE INTO entries (namespace, key, value, size, created_at, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (namespace, key, blob, len(blob), now, expires_at)
+            )
+        except Exception as e:
+            print(f"Shared cache write error: {e}")
+            self._count("errors")
+            return
+
+        with self._lock:
+            self._stats["writes"] += 1
+            self._writes_since_trim += 1
+            should_trim = self._writes_since_trim >= SHARED_CACHE_TRIM_INTERVAL
+            if should_trim:
+                self._writes_since_trim = 0
+
+        if should_trim:
+            self.trim()
+
+    def delete(self, namespace: str, key: str) -> None:
+        """Remove one entry"""
+        try:
+            self._connection().execute(
+                "DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key)
+            )
+        except Exception as e:
+            print(f"Shared cache delete error: {e}")
+            self._count("errors")
+
+    def clear(self, namespace: Optional[str] = None) -> None:
+        """Remove every entry, or every entry in one namespace"""
+        try:
+            if namespace is None:
+                self._connection().execute("DELETE FROM entries")
+            else:
+                self._connection().execute("DELETE FROM entries WHERE namespace = ?", (namespace,))
+        except Exception as e:
+            print(f"Shared cache clear error: {e}")
+            self._count("errors")
+
+    def trim(self) -> None:
+        """Drop expired entries, then the oldest ones until the store fits its size limit"""
+        try:
+            conn = self._connection()
+            removed = conn.execute("DELETE FROM entries WHERE expires_at < ?", (time.time(),)).rowcount
+
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total > self.max_bytes:
+                # Walk from the oldest entry until enough bytes are covered, then cut there
+                excess = total - self.max_bytes
+                freed = 0
+                cutoff = None
+                for created_at, size in conn.execute("SELECT created_at, size FROM entries ORDER BY created_at"):
+                    freed += size
+                    cutoff = created_at
+                    if freed >= excess:
+                        break
+                if cutoff is not None:
+                    removed += conn.execute("DELETE FROM entries WHERE created_at <= ?", (cutoff,)).rowcount
+
+            self._count("trimmed", removed)
+        except Exception as e:
+            print(f"Shared cache trim error: {e}")
+            self._count("errors")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit/miss statistics for this process and the size of the shared store"""
+        with self._lock:
+            stats = self._stats.copy()
+
+        try:
+            entries, total = self._connection().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+            stats["entries"] = entries
+            stats["bytes"] = total
+        except Exception as e:
+            print(f"Shared cache stats error: {e}")
+
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups > 0 else 0
+        stats["max_bytes"] = self.max_bytes
+        stats["path"] = str(self.path)
+        return stats
+
+_shared_cache = None
+_shared_cache_failed = False
+_shared_cache_lock = threading.Lock()
+
+def get_shared_cache() -> Optional[SharedCache]:
+    """Return this process's handle on the shared cache, or None if it is disabled or unavailable"""
+    global _shared_cache, _shared_cache_failed
+    if not SHARED_CACHE_ENABLED:
+        return None
+
+    with _shared_cache_lock:
+        if _shared_cache is None and not _shared_cache_failed:
+            try:
+                _shared_cache = SharedCache()
+            except Exception as e:
+                print(f"Shared cache unavailable, using per-process caches only: {e}")
+                _shared_cache_failed = True
+        return _shared_cache
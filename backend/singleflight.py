@@ -0,0 +1,90 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+class _Call:
+    """A computation in flight, shared by every caller with the same key"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical work:
+    - The first caller for a key runs the computation
+    - Callers arriving while it runs wait for it and share its result (or exception)
+    - Nothing is remembered once the computation finishes; caching stays with the caches
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        self._tasks: Dict[Hashable, asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self._stats = {"executed": 0, "coalesced": 0}
+
+    def do(self, key: Hashable, fn: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+        """
+        Run fn for key from a thread, or wait for the run already in progress.
+        Raises TimeoutError if a waiting caller gives up before the run finishes.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._stats["executed"] += 1
+            else:
+                self._stats["coalesced"] += 1
+
+        if not leader:
+            if not call.done.wait(timeout):
+                raise TimeoutError(f"Timed out waiting for in-flight {self.name} computation")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def do_async(self, key: Hashable, fn: Callable[[], Awaitable[Any]],
+                       timeout: Optional[float] = None) -> Any:
+        """
+        Await fn() for key on the event loop, or await the run already in progress.
+        A waiting caller that times out or is cancelled does not cancel the shared run.
+        """
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+            with self._lock:
+                self._stats["executed"] += 1
+            return await asyncio.shield(task)
+
+        with self._lock:
+            self._stats["coalesced"] += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Timed out waiting for in-flight {self.name} computation")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get how much work was shared rather than repeated"""
+        with self._lock:
+            stats = self._stats.copy()
+            stats["in_flight"] = len(self._calls) + len(self._tasks)
+
+        requests = stats["executed"] + stats["coalesced"]
+        stats["coalesce_rate"] = stats["coalesced"] / requests if requests > 0 else 0
+        return stats
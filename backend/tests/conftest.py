@@ -0,0 +1,76 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+# Backend modules create and use ./data relative to the working directory, so run the
+# tests from a scratch directory before any of them is imported
+os.chdir(tempfile.mkdtemp(prefix="alu_backend_tests_"))
+# Each test builds its own engines; results must not leak between them through the shared cache
+os.environ.setdefault("SHARED_CACHE_ENABLED", "false")
+
+class HashingEmbedder:
+    """Small deterministic stand-in for the sentence embedding model: hashed bag of words"""
+
+    dimensions = 64
+
+    def encode(self, texts):
+        single = isinstance(texts, str)
+        vectors = []
+        for text in [texts] if single else texts:
+            vector = np.zeros(self.dimensions, dtype=np.float32)
+            for word in text.lower().split():
+                vector[hash(word) % self.dimensions] += 1.0
+            norm = np.linalg.norm(vector)
+            vectors.append(vector / norm if norm else vector)
+        return vectors[0] if single else np.array(vectors)
+
+@pytest.fixture
+def document_processor(tmp_path):
+    """A DocumentProcessor whose metadata and chunk stores live in tmp_path"""
+    from document_processor import DocumentProcessor
+    from metadata_store import MetadataStore
+    from chunk_store import ChunkStore
+
+    processor = DocumentProcessor()
+    processor.metadata_store = MetadataStore(tmp_path / "metadata.db", tmp_path / "legacy.json")
+    processor.chunk_store = ChunkStore(tmp_path / "chunks")
+    return processor
+
+@pytest.fixture
+def retrieval_engine(tmp_path, document_processor):
+    """A RetrievalEngine over an in-memory Chroma collection and stores in tmp_path, without loading models"""
+    chromadb = pytest.importorskip("chromadb")
+    pytest.importorskip("sentence_transformers")
+    from retrieval_engine import RetrievalEngine
+    from near_duplicates import NearDuplicateIndex
+
+    engine = RetrievalEngine.__new__(RetrievalEngine)
+    engine.embedding_model = HashingEmbedder()
+    engine.collection = chromadb.EphemeralClient().create_collection(
+        name=f"test_{tmp_path.name}"[:60], embedding_function=None)
+    engine.dedup_index = NearDuplicateIndex(tmp_path / "minhash.db", legacy_file=tmp_path / "minhash.json")
+    engine.vector_index = None
+    engine.requeue_documents = None
+    engine.document_processor = document_processor
+    return engine
+
+def add_document(engine, doc_id: str, text: str, access_level: str = "public", title: str = "Test"):
+    """Store a document whose text is already extracted, ready for index_documents"""
+    text_file = engine.document_processor.chunk_store.directory.parent / f"{doc_id}.txt"
+    text_file.write_text(text, encoding="utf-8")
+    engine.document_processor.metadata_store.put(doc_id, {
+        "id": doc_id,
+        "title": title,
+        "source": "test",
+        "access_level": access_level,
+        "upload_time": 0.0,
+        "text_file": str(text_file),
+        "length": len(text)
+    })
@@ -0,0 +1,98 @@
+import chunk_store
+from chunk_store import ChunkStore
+
+def spans(doc_id, text, size):
+    """Character spans of fixed-size chunks, as the retrieval engine passes them"""
+    return [(f"{doc_id}-{i}", i, start, min(start + size, len(text)))
+            for i, start in enumerate(range(0, len(text), size))]
+
+def put(store, doc_id, text, size=10, sha256="v1"):
+    store.put_documents([(doc_id, sha256, text, spans(doc_id, text, size))])
+
+def test_chunks_of_multi_byte_text_are_read_back_exactly(tmp_path):
+    store = ChunkStore(tmp_path)
+    text = "Café hours: 8–17 ✓. Résumé workshops in the Aula — bring a laptop 💻 and snacks."
+    put(store, "doc", text, size=7)
+
+    chunks = store.get_chunks([chunk_id for chunk_id, _, _, _ in spans("doc", text, 7)])
+    assert "".join(chunks[f"doc-{i}"] for i in range(len(chunks))) == text
+    assert str(store.chunk_view("doc", 3), "utf-8") == text[21:28]
+    assert store.document_text("doc", "v1") == text
+    assert store.document_text("doc", "v2") is None
+
+def test_zlib_regions_are_decompressed_per_document(tmp_path):
+    store = ChunkStore(tmp_path, compression="zlib")
+    first = "Library opening hours are listed on the portal. " * 20
+    second = "Ünïcode survives compression too. " * 10
+    put(store, "first", first, size=50)
+    put(store, "second", second, size=50)
+
+    assert store.get_chunks(["first-3", "second-0"]) == {"first-3": first[150:200], "second-0": second[:50]}
+    assert store.document_text("second", "v1") == second
+    assert store.get_stats()["live_bytes"] < len(first.encode("utf-8"))
+
+def test_appends_roll_over_into_new_segments(tmp_path, monkeypatch):
+    monkeypatch.setattr(chunk_store, "CHUNK_SEGMENT_BYTES", 100)
+    store = ChunkStore(tmp_path)
+    texts = {f"doc-{i}": f"document {i} " * 6 for i in range(6)}
+    for doc_id, text in texts.items():
+        put(store, doc_id, text)
+
+    assert store.get_stats()["segments"] > 1
+    for doc_id, text in texts.items():
+        assert store.document_text(doc_id, "v1") == text
+        assert store.get_chunks([f"{doc_id}-1"])[f"{doc_id}-1"] == text[10:20]
+
+def test_compaction_drops_dead_text_and_old_segments(tmp_path, monkeypatch):
+    monkeypatch.setattr(chunk_store, "CHUNK_STORE_COMPACT_RATIO", 1.0)
+    store = ChunkStore(tmp_path)
+    put(store, "kept", "kept text " * 5)
+    put(store, "replaced", "first version " * 5)
+    put(store, "replaced", "second version " * 5, sha256="v2")
+    put(store, "deleted", "deleted text " * 5)
+    store.delete_document("deleted")
+    old_segments = set(tmp_path.glob("segment-*.dat"))
+
+    store.compact()
+
+    assert store.get_stats()["dead_bytes"] == 0
+    assert old_segments.isdisjoint(tmp_path.glob("segment-*.dat"))
+    assert store.document_text("kept", "v1") == "kept text " * 5
+    assert store.document_text("replaced", "v2") == "second version " * 5
+    assert store.get_chunks(["replaced-0", "deleted-0"]) == {"replaced-0": "second ver"}
+    # Appends after compaction go to a fresh segment
+    put(store, "later", "added after compaction")
+    assert store.document_text("later", "v1") == "added after compaction"
+
+def test_document_replaced_during_compaction_keeps_its_new_text(tmp_path, monkeypatch):
+    monkeypatch.setattr(chunk_store, "CHUNK_STORE_COMPACT_RATIO", 1.0)
+    store = ChunkStore(tmp_path)
+    put(store, "a", "original a " * 5)
+    put(store, "b", "original b " * 5)
+    copy_region = store._map
+    replaced = []
+
+    def replace_while_copying(segment, needed):
+        # The copy runs without the index write lock, so a writer can get in
+        if not replaced:
+            replaced.append(True)
+            put(store, "a", "replacement a " * 5, sha256="v2")
+        return copy_region(segment, needed)
+
+    monkeypatch.setattr(store, "_map", replace_while_copying)
+    store.compact()
+    monkeypatch.setattr(store, "_map", copy_region)
+
+    assert store.document_text("a", "v2") == "replacement a " * 5
+    assert store.document_text("b", "v1") == "original b " * 5
+
+def test_deletes_compact_on_a_background_thread(tmp_path):
+    store = ChunkStore(tmp_path)
+    put(store, "kept", "kept text " * 5)
+    put(store, "deleted", "deleted text " * 20)
+
+    assert store.delete_document("deleted")
+    store._compactor.join(10)
+
+    assert store.get_stats()["dead_bytes"] == 0
+    assert store.document_text("kept", "v1") == "kept text " * 5
@@ -0,0 +1,92 @@
+import time
+import asyncio
+import threading
+
+import pytest
+
+from deadline import Deadline
+
+@pytest.fixture
+def extended_engine(monkeypatch):
+    """An ExtendedRetrievalEngine whose brain and vector stages the test replaces"""
+    pytest.importorskip("chromadb")
+    pytest.importorskip("sentence_transformers")
+    import retrieval_engine_extended
+    from retrieval_engine import RetrievalEngine
+
+    monkeypatch.setattr(RetrievalEngine, "__init__", lambda self: None)
+    monkeypatch.setattr(retrieval_engine_extended, "ALUBrainManager", lambda: None)
+    engine = retrieval_engine_extended.ExtendedRetrievalEngine()
+    yield engine
+    engine._executor.shutdown(wait=False)
+    engine._brain_executor.shutdown(wait=False)
+
+def brain_answer(text):
+    from retrieval_engine import Document
+    return [Document(text=text, metadata={"title": text, "source": "ALU Brain", "score": 20})], False
+
+def test_stalled_vector_store_does_not_starve_the_brain(extended_engine):
+    stall = threading.Event()
+    extended_engine._vector_stage = lambda query, role, **kwargs: stall.wait(10)
+    extended_engine._brain_stage = lambda query, deadline=None, analysis=None: brain_answer(query)
+
+    async def ask(i):
+        deadline = Deadline(0.3)
+        results = await extended_engine.aretrieve_context(f"question number {i}", deadline=deadline)
+        return results, deadline.degraded_reasons
+
+    async def ask_many():
+        # The first wave leaves every retrieval thread stuck in the vector store
+        first = await asyncio.gather(*(ask(i) for i in range(8)))
+        return first + await asyncio.gather(*(ask(i) for i in range(8, 12)))
+
+    try:
+        answers = asyncio.run(ask_many())
+    finally:
+        stall.set()
+
+    for i, (results, reasons) in enumerate(answers):
+        assert [doc.text for doc in results] == [f"question number {i}"]
+        assert reasons == ["vector_search"]
+
+def test_stalled_brain_leaves_time_for_the_vector_stage(extended_engine):
+    from retrieval_engine import Document
+    stall = threading.Event()
+    extended_engine._brain_stage = lambda query, deadline=None, analysis=None: stall.wait(10)
+
+    def vector_stage(query, role, **kwargs):
+        time.sleep(0.05)
+        return None, [Document(text="from the vector store", metadata={}, score=0.9)], None
+    extended_engine._vector_stage = vector_stage
+
+    deadline = Deadline(0.5)
+    try:
+        results = asyncio.run(extended_engine.aretrieve_context("when does the term start", deadline=deadline))
+    finally:
+        stall.set()
+
+    assert [doc.text for doc in results] == ["from the vector store"]
+    assert deadline.degraded_reasons == ["brain_search"]
+
+class RecordingReranker:
+    """Reverses the candidates and notes which thread scored them"""
+
+    def __init__(self):
+        self.threads = []
+
+    def rerank(self, query, candidates):
+        self.threads.append(threading.current_thread().name)
+        return list(reversed(candidates))
+
+def test_reranking_runs_off_the_event_loop(extended_engine):
+    from retrieval_engine import Document
+    extended_engine.reranker = RecordingReranker()
+    extended_engine._brain_stage = lambda query, deadline=None, analysis=None: brain_answer("from the brain")
+    extended_engine._vector_stage = lambda query, role, **kwargs: (
+        None, [Document(text="from the vector store", metadata={}, score=0.9)], None)
+
+    results = asyncio.run(extended_engine.aretrieve_context("where is the library", deadline=Deadline(1.0)))
+
+    assert len(results) == 2
+    assert len(extended_engine.reranker.threads) == 1
+    assert extended_engine.reranker.threads[0].startswith("retrieval")
@@ -0,0 +1,101 @@
+import json
+
+import pytest
+
+from metadata_store import MetadataStore
+
+def document(doc_id, upload_time, title="Handbook", **extra):
+    return dict({"id": doc_id, "title": title, "source": "test", "content_type": "text/plain",
+                 "upload_time": upload_time, "size": 10}, **extra)
+
+@pytest.fixture
+def store(tmp_path):
+    return MetadataStore(tmp_path / "metadata.db", tmp_path / "legacy.json")
+
+@pytest.fixture
+def main_module(store, monkeypatch):
+    """main with its document processor reading from the test's metadata store"""
+    pytest.importorskip("chromadb")
+    pytest.importorskip("sentence_transformers")
+    import main
+    monkeypatch.setattr(main.document_processor, "metadata_store", store)
+    return main
+
+def test_pages_continue_past_documents_uploaded_at_the_same_time(store):
+    for i in range(5):
+        store.put(f"doc-{i}", document(f"doc-{i}", 100.0))
+    store.put("later", document("later", 200.0))
+
+    seen, after = [], None
+    while True:
+        _, rows = store.list_json(2, after=after)
+        if not rows:
+            break
+        seen.extend(doc_id for _, doc_id, _ in rows)
+        after = rows[-1][:2]
+
+    assert seen == ["doc-0", "doc-1", "doc-2", "doc-3", "doc-4", "later"]
+
+def test_fields_limit_the_returned_metadata(store):
+    store.put("doc", document("doc", 1.0, title="Fees", text_file="/data/doc.txt"))
+
+    _, rows = store.list_json(10, fields=["id", "title", "missing"])
+
+    assert json.loads(rows[0][2]) == {"id": "doc", "title": "Fees", "missing": None}
+
+def test_title_prefix_matches_a_case_sensitive_range(store):
+    for i, title in enumerate(["Beta 1", "Beta 2", "Betamax", "beta 3", "Alpha", "Beta"]):
+        store.put(f"doc-{i}", document(f"doc-{i}", float(i), title=title))
+
+    _, rows = store.list_json(10, title_prefix="Beta ")
+
+    assert [doc_id for _, doc_id, _ in rows] == ["doc-0", "doc-1"]
+
+def test_cursors_round_trip_and_reject_garbage(main_module):
+    cursor = main_module.encode_cursor(1712.5, "doc/ü")
+
+    assert main_module.decode_cursor(cursor) == (1712.5, "doc/ü")
+    for garbage in ["zzz", main_module.encode_cursor(1.0, "x")[:-4], "WzFd"]:
+        with pytest.raises(ValueError):
+            main_module.decode_cursor(garbage)
+
+def test_etag_matching_follows_if_none_match(main_module):
+    etag = '"documents-7"'
+
+    assert not main_module.etag_matches(None, etag)
+    assert not main_module.etag_matches('"documents-6"', etag)
+    assert main_module.etag_matches('"documents-6", "documents-7"', etag)
+    assert main_module.etag_matches('W/"documents-7"', etag)
+    assert main_module.etag_matches("*", etag)
+
+def test_unchanged_listing_answers_304_until_metadata_changes(main_module, store):
+    from fastapi.testclient import TestClient
+    client = TestClient(main_module.app)
+    store.put("doc", document("doc", 1.0))
+
+    first = client.get("/documents")
+    etag = first.headers["etag"]
+
+    assert client.get("/documents", headers={"If-None-Match": etag}).status_code == 304
+    store.put("other", document("other", 2.0))
+    changed = client.get("/documents", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+
+def test_large_pages_are_streamed_and_complete(main_module, store):
+    from fastapi.testclient import TestClient
+    client = TestClient(main_module.app)
+    count = main_module.DOCUMENT_STREAM_ROWS + 50
+    for i in range(count):
+        store.put(f"doc-{i:04d}", document(f"doc-{i:04d}", float(i)))
+
+    streamed = client.get("/documents", params={"limit": count - 10, "fields": "title"})
+    small = client.get("/documents", params={"limit": 10})
+
+    assert "content-length" not in streamed.headers
+    body = streamed.json()
+    assert [doc["id"] for doc in body["documents"]] == [f"doc-{i:04d}" for i in range(count - 10)]
+    assert body["documents"][0] == {"id": "doc-0000", "title": "Handbook"}
+    rest = client.get("/documents", params={"limit": 100, "cursor": body["next_cursor"]}).json()
+    assert len(rest["documents"]) == 10 and rest["next_cursor"] is None
+    assert "content-length" in small.headers
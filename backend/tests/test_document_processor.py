@@ -0,0 +1,98 @@
+import io
+import asyncio
+import zipfile
+from pathlib import Path
+
+from fastapi import UploadFile
+from starlette.datastructures import Headers
+
+import document_processor as document_processor_module
+
+def upload(filename, content, content_type="text/plain"):
+    return UploadFile(file=io.BytesIO(content), filename=filename,
+                      headers=Headers({"content-type": content_type}))
+
+def index(processor, doc_id):
+    """What index_documents does once a document's chunks are embedded"""
+    metadata = processor.get_metadata(doc_id)
+    text = processor.get_document_text(doc_id)
+    processor.store_chunked_text([(doc_id, metadata["sha256"], text, [("c", 0, 0, len(text))])])
+
+def test_text_file_shared_through_replace_is_kept_until_both_are_indexed(document_processor):
+    processor = document_processor
+    first, _ = asyncio.run(processor.store_document(upload("first.txt", b"tuition is due in may")))
+    second, _ = asyncio.run(processor.store_document(upload("second.txt", b"an older handbook")))
+    asyncio.run(processor.extract_document(first))
+
+    # The second document's new version has the first one's content
+    asyncio.run(processor.replace_document(second, upload("second.txt", b"tuition is due in may")))
+    asyncio.run(processor.extract_document(second))
+    text_file = Path(processor.get_metadata(first)["text_file"])
+    assert processor.get_metadata(second)["text_file"] == str(text_file)
+
+    index(processor, first)
+    assert text_file.is_file()
+    assert processor.get_document_text(second) == "tuition is due in may"
+
+    index(processor, second)
+    assert not text_file.exists()
+    assert processor.get_document_text(first) == processor.get_document_text(second) == "tuition is due in may"
+
+def zip_upload(entries, name="bundle.zip"):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for entry_name, content in entries:
+            archive.writestr(entry_name, content)
+    return upload(name, buffer.getvalue(), "application/zip")
+
+def stored_originals():
+    return sorted(path.name for path in document_processor_module.ORIGINALS_DIR.iterdir())
+
+def test_zip_entry_over_the_size_cap_is_skipped_before_decompressing(document_processor, monkeypatch):
+    monkeypatch.setattr(document_processor_module, "BULK_MAX_ENTRY_BYTES", 1000)
+    before = stored_originals()
+    report = asyncio.run(document_processor.store_documents([zip_upload([
+        ("bomb.txt", b"0" * 10_000),
+        ("notes.txt", b"small enough"),
+    ])]))
+
+    assert [entry["filename"] for entry in report] == ["bundle.zip/bomb.txt", "bundle.zip/notes.txt"]
+    assert "1000 bytes" in report[0]["error"] and "doc_id" not in report[0]
+    assert report[1]["size"] == len(b"small enough")
+    assert len(stored_originals()) == len(before) + 1
+
+def test_zip_total_uncompressed_size_is_capped(document_processor, monkeypatch):
+    monkeypatch.setattr(document_processor_module, "BULK_MAX_ARCHIVE_BYTES", 2500)
+    report = asyncio.run(document_processor.store_documents([zip_upload([
+        (f"part{i}.txt", bytes([65 + i]) * 1000) for i in range(5)
+    ])]))
+
+    assert [("doc_id" in entry) for entry in report] == [True, True, False]
+    assert "2500 bytes" in report[2]["error"]
+
+def test_zip_entry_larger_than_its_header_is_rejected(document_processor):
+    content = b"more text than the header admits " * 100
+    buffer = io.BytesIO(zip_upload([("liar.txt", content)]).file.getvalue())
+    # Understate the uncompressed size in both headers; a zip bomb's headers are under the sender's control
+    data = bytearray(buffer.getvalue())
+    for signature, offset in ((b"PK\x03\x04", 22), (b"PK\x01\x02", 24)):
+        position = data.find(signature)
+        data[position + offset:position + offset + 4] = (100).to_bytes(4, "little")
+    before = stored_originals()
+
+    report = asyncio.run(document_processor.store_documents([upload("liar.zip", bytes(data), "application/zip")]))
+
+    assert "doc_id" not in report[0]
+    assert report[0]["error"], report
+    assert stored_originals() == before
+
+def test_file_cap_stops_reading_the_archive(document_processor, monkeypatch):
+    monkeypatch.setattr(document_processor_module, "BULK_MAX_FILES", 3)
+    report = asyncio.run(document_processor.store_documents([
+        zip_upload([(f"doc{i}.txt", f"document number {i}") for i in range(50)]),
+        upload("extra.txt", b"after the cap"),
+    ]))
+
+    assert len(report) == 4
+    assert all("doc_id" in entry for entry in report[:3])
+    assert "More than 3 files" in report[3]["error"]
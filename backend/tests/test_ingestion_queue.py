@@ -0,0 +1,51 @@
+import time
+import threading
+
+import ingestion_queue
+from ingestion_queue import IngestionQueue
+
+def test_lease_is_renewed_while_a_long_batch_runs(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingestion_queue, "INGEST_LEASE_SECONDS", 0.3)
+    queue = IngestionQueue(tmp_path / "jobs.db", workers=1)
+    other_process = IngestionQueue(tmp_path / "jobs.db", workers=0)
+    job_id = queue.enqueue("doc-1")
+    finished = threading.Event()
+    reclaimed = []
+
+    def slow_batch(doc_ids, set_state):
+        # Several lease lengths without a stage change
+        deadline = time.time() + 1.2
+        while time.time() < deadline:
+            reclaimed.extend(other_process._claim())
+            time.sleep(0.05)
+        finished.set()
+        return {}
+
+    queue.start(slow_batch)
+    try:
+        assert finished.wait(5)
+        for _ in range(50):
+            if queue.get(job_id)["state"] == "indexed":
+                break
+            time.sleep(0.05)
+    finally:
+        queue.stop()
+
+    assert reclaimed == []
+    assert queue.get(job_id)["state"] == "indexed"
+    assert queue.get(job_id)["attempts"] == 1
+
+def test_expired_lease_on_the_last_attempt_fails_the_job(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingestion_queue, "INGEST_MAX_ATTEMPTS", 2)
+    queue = IngestionQueue(tmp_path / "jobs.db", workers=0)
+    job_id = queue.enqueue("doc-1")
+
+    # Two workers in a row die mid-batch
+    for attempt in (1, 2):
+        assert [job["id"] for job in queue._claim()] == [job_id]
+        queue._connection().execute("UPDATE jobs SET lease_expires_at = ? WHERE id = ?", (time.time() - 1, job_id))
+
+    assert queue._claim() == []
+    job = queue.get(job_id)
+    assert job["state"] == "failed"
+    assert job["attempts"] == 2
@@ -0,0 +1,118 @@
+from conftest import add_document
+
+import near_duplicates
+from near_duplicates import NearDuplicateIndex
+
+POLICY = ("Students may defer an examination once per term by submitting the deferral form "
+          "to the registrar at least five working days before the scheduled sitting. ") * 3
+
+def test_public_copy_of_restricted_text_stays_visible_to_students(retrieval_engine):
+    add_document(retrieval_engine, "faculty-doc", POLICY, access_level="faculty")
+    add_document(retrieval_engine, "public-doc", POLICY, access_level="public")
+    assert retrieval_engine.index_documents(["faculty-doc"]) == {}
+    assert retrieval_engine.index_documents(["public-doc"]) == {}
+
+    # The public document is indexed in its own right rather than linked to the faculty copy
+    metadata = retrieval_engine.document_processor.get_metadata("public-doc")
+    assert metadata["dedup"]["duplicate_chunks"] == 0
+
+    query_embedding = retrieval_engine.embed_query("defer an examination")
+    results = retrieval_engine.retrieve_context("defer an examination", role="student",
+                                                query_embedding=query_embedding)
+    assert [doc.metadata["doc_id"] for doc in results] == ["public-doc"]
+    assert results[0].text.startswith("Students may defer")
+
+def test_restricted_text_is_not_linked_to_a_public_chunk(retrieval_engine):
+    add_document(retrieval_engine, "public-doc", POLICY, access_level="public")
+    add_document(retrieval_engine, "admin-doc", POLICY, access_level="admin")
+    retrieval_engine.index_documents(["public-doc", "admin-doc"])
+
+    assert retrieval_engine.document_processor.get_metadata("admin-doc")["dedup"]["duplicate_chunks"] == 0
+    results = retrieval_engine.retrieve_context("defer an examination", role="admin", top_k=5,
+                                                query_embedding=retrieval_engine.embed_query("defer an examination"))
+    assert {doc.metadata["doc_id"] for doc in results} == {"public-doc", "admin-doc"}
+
+def test_same_level_duplicates_are_still_linked(retrieval_engine):
+    add_document(retrieval_engine, "first", POLICY, access_level="student")
+    add_document(retrieval_engine, "second", POLICY, access_level="student")
+    retrieval_engine.index_documents(["first", "second"])
+
+    assert retrieval_engine.document_processor.get_metadata("second")["dedup"]["duplicate_chunks"] == 1
+
+class FailingEmbedder:
+    def encode(self, texts):
+        raise RuntimeError("model unavailable")
+
+def test_embedding_failure_still_requeues_documents_that_lost_their_links(retrieval_engine):
+    add_document(retrieval_engine, "first", POLICY, access_level="student")
+    add_document(retrieval_engine, "second", POLICY, access_level="student")
+    retrieval_engine.index_documents(["first", "second"])
+    requeued = []
+    retrieval_engine.requeue_documents = requeued.extend
+
+    # The new version drops the chunk "second" links to, and cannot be embedded
+    add_document(retrieval_engine, "first", "The registrar's office has moved to the second floor.",
+                 access_level="student")
+    embedder, retrieval_engine.embedding_model = retrieval_engine.embedding_model, FailingEmbedder()
+    failures = retrieval_engine.index_documents(["first"])
+
+    assert failures["first"].startswith("Embedding failed")
+    assert requeued == ["second"]
+
+    retrieval_engine.embedding_model = embedder
+    assert retrieval_engine.index_documents(["first", "second"]) == {}
+    assert retrieval_engine.document_processor.get_metadata("second")["dedup"]["duplicate_chunks"] == 0
+    results = retrieval_engine.retrieve_context("defer an examination", role="student",
+                                                query_embedding=retrieval_engine.embed_query("defer an examination"))
+    second = [doc for doc in results if doc.metadata["doc_id"] == "second"]
+    assert second and second[0].text.startswith("Students may defer")
+
+def test_removing_a_document_queues_its_dependents_instead_of_indexing_them(retrieval_engine):
+    add_document(retrieval_engine, "first", POLICY, access_level="student")
+    add_document(retrieval_engine, "second", POLICY, access_level="student")
+    retrieval_engine.index_documents(["first", "second"])
+    requeued = []
+    retrieval_engine.requeue_documents = requeued.extend
+
+    assert retrieval_engine.remove_document("first")
+
+    assert requeued == ["second"]
+    assert retrieval_engine.collection.get(where={"doc_id": "second"})["ids"] == []
+
+def test_workers_sharing_an_index_keep_each_others_chunks(tmp_path):
+    first = NearDuplicateIndex(tmp_path / "minhash.db", legacy_file=tmp_path / "none.json")
+    second = NearDuplicateIndex(tmp_path / "minhash.db", legacy_file=tmp_path / "none.json")
+    a = first.signature("the library opens at eight in the morning on weekdays")
+    b = second.signature("housing applications close on the first friday of august")
+
+    first.add("chunk-a", "doc-a", a, "public")
+    second.add("chunk-b", "doc-b", b, "public")
+
+    # Each sees the other's chunk without losing its own
+    assert first.find_duplicate(b, "public") == "chunk-b"
+    assert first.find_duplicate(a, "public") == "chunk-a"
+    assert second.find_duplicate(a, "public") == "chunk-a"
+    assert first.find_duplicate(a, "faculty") is None
+
+    second.remove_chunks(["chunk-a"])
+    assert first.find_duplicate(a, "public") is None
+    assert "chunk-b" in first
+
+def test_change_log_is_pruned_and_lagging_workers_reload(tmp_path, monkeypatch):
+    monkeypatch.setattr(near_duplicates, "CHANGE_LOG_KEEP", 3)
+    writer = NearDuplicateIndex(tmp_path / "minhash.db", legacy_file=tmp_path / "none.json")
+    lagging = NearDuplicateIndex(tmp_path / "minhash.db", legacy_file=tmp_path / "none.json")
+    texts = [f"notice {i}: the {i}th floor study rooms close for cleaning at {i} pm" for i in range(10)]
+    for i, text in enumerate(texts):
+        writer.add(f"chunk-{i}", f"doc-{i}", writer.signature(text), "public")
+
+    assert writer._connection().execute("SELECT COUNT(*) FROM changes").fetchone()[0] == 3
+    # The entries for the first chunks are gone, so the lagging worker reloads rather than replaying
+    assert lagging.find_duplicate(lagging.signature(texts[0]), "public") == "chunk-0"
+    assert len(lagging._signatures) == 10
+
+    writer.clear()
+    writer.add("chunk-new", "doc-new", writer.signature(texts[4]), "public")
+    assert lagging.find_duplicate(lagging.signature(texts[4]), "public") == "chunk-new"
+    # Caught up with the log again, so later refreshes replay it instead of reloading
+    assert lagging._last_change == 11
@@ -0,0 +1,30 @@
+import threading
+
+from deadline import Deadline
+from prompt_engine.prompt_engine import PromptEngine, TIMEOUT_RESPONSE
+
+def test_waiter_that_runs_out_of_time_does_not_generate_again():
+    engine = PromptEngine()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow_generate(query, context, role, deadline, analysis):
+        calls.append(query)
+        started.set()
+        release.wait(10)
+        return "the answer"
+    engine.response_generator.generate_response = slow_generate
+
+    leader = threading.Thread(target=engine.generate_response, args=("how do I pay the fee", []))
+    leader.start()
+    started.wait(5)
+    try:
+        deadline = Deadline(0.1)
+        response = engine.generate_response("how do I pay the fee", [], deadline=deadline)
+    finally:
+        release.set()
+        leader.join(5)
+
+    assert response == TIMEOUT_RESPONSE
+    assert deadline.degraded_reasons == ["coalesced_wait"]
+    assert len(calls) == 1
@@ -0,0 +1,109 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+
+from quantized_index import QuantizedVectorIndex, _normalize
+
+DIM = 48
+
+def vectors(count, seed):
+    return _normalize(np.random.default_rng(seed).normal(size=(count, DIM))).astype(np.float32)
+
+def add_rows(index_dir, worker, rounds):
+    index = QuantizedVectorIndex("float16", index_dir, pq_subvectors=12)
+    for r in range(rounds):
+        ids = [f"w{worker}_r{r}_{i}" for i in range(5)]
+        index.add(ids, vectors(5, worker * 1000 + r), ["public"] * 5)
+
+@pytest.mark.parametrize("precision", ["float32", "float16", "pq"])
+def test_rows_added_by_one_instance_are_searchable_from_another(tmp_path, precision):
+    writer = QuantizedVectorIndex(precision, tmp_path, pq_subvectors=12)
+    reader = QuantizedVectorIndex(precision, tmp_path, pq_subvectors=12)
+    data = vectors(40, 0)
+
+    writer.add([f"c{i}" for i in range(20)], data[:20], ["public"] * 20)
+    writer.add([f"c{i}" for i in range(20, 40)], data[20:], ["staff"] * 20)
+
+    assert reader.search(data[30], 1)[0][0] == "c30"
+    assert len(reader) == 40
+    assert reader.search(data[30], 1, ["public"])[0][0] != "c30"
+
+def test_codebooks_trained_by_one_instance_are_used_by_another(tmp_path):
+    writer = QuantizedVectorIndex("pq", tmp_path, pq_subvectors=12)
+    reader = QuantizedVectorIndex("pq", tmp_path, pq_subvectors=12)
+    data = vectors(1100, 6)
+    writer.add([f"c{i}" for i in range(1000)], data[:1000], ["public"] * 1000)
+    assert reader.search(data[5], 1)[0][0] == "c5"
+
+    writer.add([f"c{i}" for i in range(1000, 1100)], data[1000:], ["public"] * 100)
+
+    assert reader.search(data[1050], 1)[0][0] == "c1050"
+    assert reader.get_stats()["pq_trained"]
+    assert reader._codes.shape == (1100, 12)
+
+def test_pq_falls_back_to_subvectors_that_divide_the_dimension(tmp_path):
+    writer = QuantizedVectorIndex("pq", tmp_path, pq_subvectors=12)
+    data = _normalize(np.random.default_rng(7).normal(size=(1100, 50))).astype(np.float32)
+    writer.add([f"c{i}" for i in range(1100)], data, ["public"] * 1100)
+    reader = QuantizedVectorIndex("pq", tmp_path, pq_subvectors=12)
+
+    assert writer.pq_subvectors == reader.pq_subvectors == 10
+    assert reader._codes.shape == (1100, 10)
+    assert reader.search(data[42], 1)[0][0] == "c42"
+
+def test_remove_in_one_instance_reaches_the_other(tmp_path):
+    first = QuantizedVectorIndex("float16", tmp_path)
+    second = QuantizedVectorIndex("float16", tmp_path)
+    data = vectors(10, 1)
+    first.add([f"c{i}" for i in range(10)], data, ["public"] * 10)
+    assert len(second.search(data[3], 1)) == 1
+
+    second.remove(["c3"])
+    first.add(["c10"], vectors(1, 2), ["public"])
+
+    assert "c3" not in [chunk_id for chunk_id, _ in first.search(data[3], 10)]
+    assert len(first) == len(second.search(data[3], 100)) == 10
+
+def test_rows_written_without_a_manifest_update_are_ignored(tmp_path):
+    index = QuantizedVectorIndex("float16", tmp_path)
+    index.add(["a", "b"], vectors(2, 3), ["public"] * 2)
+    # A writer that died between appending and committing the manifest
+    with open(tmp_path / "full.f32", "ab") as f:
+        f.write(vectors(1, 4).tobytes())
+    with open(tmp_path / "ids.jsonl", "a") as f:
+        f.write('["orphan", "public"]\n')
+
+    index.add(["c"], vectors(1, 5), ["public"])
+    reopened = QuantizedVectorIndex("float16", tmp_path)
+
+    assert reopened._ids == ["a", "b", "c"]
+    assert reopened.search(vectors(1, 5)[0], 1)[0][0] == "c"
+
+def test_concurrent_writer_processes_keep_every_row(tmp_path):
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=add_rows, args=(tmp_path, w, 10)) for w in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(60)
+        assert worker.exitcode == 0
+
+    index = QuantizedVectorIndex("float16", tmp_path)
+    assert len(index) == 4 * 10 * 5
+    assert len(set(index._ids)) == len(index)
+    for w in range(4):
+        assert index.search(vectors(5, w * 1000 + 9)[2], 1)[0][0] == f"w{w}_r9_2"
+
+def test_access_levels_follow_rows_through_remove(tmp_path):
+    index = QuantizedVectorIndex("float16", tmp_path)
+    data = vectors(6, 8)
+    index.add([f"c{i}" for i in range(6)], data, ["public", "staff"] * 3)
+    index.remove(["c0", "c3"])
+    reopened = QuantizedVectorIndex("float16", tmp_path)
+
+    for searcher in (index, reopened):
+        assert list(searcher._levels) == ["staff", "public", "public", "staff"]
+        assert searcher.search(data[2], 1, ["public"])[0][0] == "c2"
+        assert "c5" not in [chunk_id for chunk_id, _ in searcher.search(data[5], 4, ["public"])]
+    assert reopened.get_stats()["chroma_vector_bytes"] == 4 * DIM * 4
@@ -0,0 +1,17 @@
+import pytest
+
+from query_analysis import fingerprint
+
+@pytest.mark.parametrize("first, second", [
+    ("can I pay the fee late", "should I pay the fee late"),
+    ("will I pay the fee late", "can I pay the fee late"),
+    ("list all courses", "list some courses"),
+    ("list only elective courses", "list elective courses"),
+    ("any scholarships for each program", "some scholarships for each program"),
+    ("where is my transcript", "where is your transcript"),
+])
+def test_modal_scope_and_pronoun_words_change_the_fingerprint(first, second):
+    assert fingerprint(first) != fingerprint(second)
+
+def test_case_punctuation_and_plurals_do_not_change_the_fingerprint():
+    assert fingerprint("Can I pay the fees late?") == fingerprint("can i pay the fee late")
@@ -0,0 +1,91 @@
+import asyncio
+import hashlib
+
+import pytest
+from fastapi import HTTPException
+
+import upload_sessions as upload_sessions_module
+from upload_sessions import UploadSessions
+
+async def body(*parts):
+    for part in parts:
+        yield part
+
+@pytest.fixture
+def sessions(tmp_path):
+    uploads_dir = tmp_path / "uploads"
+    uploads_dir.mkdir()
+    return UploadSessions(tmp_path / "uploads.db", uploads_dir)
+
+def test_parts_are_refused_while_finishing_even_after_the_lease_expires(sessions, monkeypatch):
+    upload = sessions.create("big.txt", "text/plain", None, "test", "public")
+    asyncio.run(sessions.write_part(upload["upload_id"], 0, body(b"first part")))
+    sessions._digests.clear()  # rehash on finish, as when the parts went to another worker
+
+    _, path, sha256, size = asyncio.run(sessions.finish(upload["upload_id"]))
+    assert sha256 == hashlib.sha256(b"first part").hexdigest()
+    assert sessions.get(upload["upload_id"])["finalizing"]
+
+    # The finisher is still storing the file when its lease runs out
+    monkeypatch.setattr(upload_sessions_module.time, "time", lambda: 10 ** 12)
+    with pytest.raises(HTTPException) as refused:
+        asyncio.run(sessions.write_part(upload["upload_id"], size, body(b"late part")))
+    assert refused.value.status_code == 409
+    assert path.read_bytes() == b"first part"
+
+def test_lease_is_renewed_while_hashing_a_large_upload(sessions, monkeypatch):
+    monkeypatch.setattr(upload_sessions_module, "HASH_READ_SIZE", 4)
+    monkeypatch.setattr(upload_sessions_module, "UPLOAD_LEASE_SECONDS", 0.0)
+    upload = sessions.create("big.txt", "text/plain", None, "test", "public")
+    asyncio.run(sessions.write_part(upload["upload_id"], 0, body(b"0123456789" * 10)))
+    sessions._digests.clear()
+
+    renewals = []
+    save_progress = sessions._save_progress
+    def record(*args, **kwargs):
+        renewals.append(args)
+        return save_progress(*args, **kwargs)
+    monkeypatch.setattr(sessions, "_save_progress", record)
+
+    asyncio.run(sessions.finish(upload["upload_id"]))
+    assert len(renewals) >= 20
+
+def test_failed_finish_accepts_parts_again(sessions):
+    upload = sessions.create("big.txt", "text/plain", None, "test", "public", size=20)
+    asyncio.run(sessions.write_part(upload["upload_id"], 0, body(b"half")))
+
+    with pytest.raises(HTTPException):
+        asyncio.run(sessions.finish(upload["upload_id"]))
+
+    assert not sessions.get(upload["upload_id"])["finalizing"]
+    assert asyncio.run(sessions.write_part(upload["upload_id"], 4, body(b"x" * 16)))["offset"] == 20
+
+def test_cancel_is_refused_while_a_part_is_being_written(sessions):
+    upload = sessions.create("big.txt", "text/plain", None, "test", "public")
+    asyncio.run(sessions.write_part(upload["upload_id"], 0, body(b"first part")))
+    _, writer = sessions._acquire(upload["upload_id"], 10)
+
+    with pytest.raises(HTTPException) as refused:
+        sessions.remove(upload["upload_id"])
+    assert refused.value.status_code == 409
+    assert sessions._part_path(upload["upload_id"]).exists()
+
+    sessions._save_progress(upload["upload_id"], writer, 10, release=True)
+    assert sessions.remove(upload["upload_id"])
+    assert sessions.get(upload["upload_id"]) is None
+    assert not sessions._part_path(upload["upload_id"]).exists()
+
+def test_only_the_finisher_removes_a_finalizing_upload(sessions, monkeypatch):
+    upload = sessions.create("big.txt", "text/plain", None, "test", "public")
+    asyncio.run(sessions.write_part(upload["upload_id"], 0, body(b"all of it")))
+    session, path, _, _ = asyncio.run(sessions.finish(upload["upload_id"]))
+
+    # Not even once the finisher's lease has run out
+    monkeypatch.setattr(upload_sessions_module.time, "time", lambda: 10 ** 12)
+    with pytest.raises(HTTPException) as refused:
+        sessions.remove(upload["upload_id"])
+    assert refused.value.status_code == 409
+    assert path.read_bytes() == b"all of it"
+
+    assert sessions.remove(upload["upload_id"], session["writer"])
+    assert not sessions.remove(upload["upload_id"])
@@ -0,0 +1,183 @@
+import sys
+import time
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from shared_cache import SharedCache
+
+_MISSING = object()
+
+# Every cache registers itself here so /search-stats can report on all of them
+_registry: "weakref.WeakValueDictionary[str, TTLCache]" = weakref.WeakValueDictionary()
+
+def estimate_size(value: Any, _depth: int = 0) -> int:
+    """Approximate the memory footprint of a cached value in bytes"""
+    size = sys.getsizeof(value)
+    if _depth > 4 or isinstance(value, (str, bytes, bytearray, int, float, bool, type(None))):
+        return size
+    if isinstance(value, dict):
+        return size + sum(estimate_size(k, _depth + 1) + estimate_size(v, _depth + 1) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return size + sum(estimate_size(item, _depth + 1) for item in value)
+    if hasattr(value, "__dict__"):
+        return size + estimate_size(vars(value), _depth + 1)
+    return size
+
+class TTLCache:
+    """
+    Bounded in-process cache with least-recently-used eviction:
+    - O(1) get and put on an ordered dict
+    - Bounded by entry count, approximate memory size and per-entry TTL
+    - Keeps hit, miss, expiration and eviction counters
+    - Optionally backed by a shared L2 store that other worker processes can read
+    """
+
+    def __init__(self,
+                 name: str,
+                 max_entries: int = 1024,
+                 max_bytes: Optional[int] = None,
+                 ttl: Optional[float] = None,
+                 sizeof: Callable[[Any], int] = estimate_size,
+                 l2: Optional["SharedCache"] = None):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._sizeof = sizeof
+        self.l2 = l2
+
+        # key -> (expires_at, size, value)
+        self._entries: "OrderedDict[Any, Tuple[float, int, Any]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "expirations": 0,
+            "evictions": 0,
+            "rejected": 0,
+            "l2_hits": 0
+        }
+        _registry[name] = self
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        """Return a live entry and mark it as recently used, falling back to the L2 store"""
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires_at, _, value = entry
+                if expires_at >= time.time():
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return value
+
+                self._remove(key)
+                self._stats["expirations"] += 1
+
+        # Another worker may already have computed this entry
+        if self.l2 is not None:
+            shared = self.l2.lookup(self.name, str(key))
+            if shared is not None:
+                value, expires_at = shared
+                self._insert(key, value, expires_at)
+                with self._lock:
+                    self._stats["hits"] += 1
+                    self._stats["l2_hits"] += 1
+                return value
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return default
+
+    def put(self, key: Any, value: Any) -> None:
+        """Insert or replace an entry locally and in the L2 store"""
+        self._insert(key, value, time.time() + self.ttl if self.ttl is not None else float("inf"))
+        if self.l2 is not None:
+            self.l2.store(self.name, str(key), value, self.ttl)
+
+    def _insert(self, key: Any, value: Any, expires_at: float) -> None:
+        """Insert into the local map, evicting least recently used entries to stay in bounds"""
+        size = self._sizeof(value) if self.max_bytes is not None else 0
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            if self.max_bytes is not None and size > self.max_bytes:
+                self._stats["rejected"] += 1
+                return
+
+            self._entries[key] = (expires_at, size, value)
+            self._bytes += size
+
+            while len(self._entries) > self.max_entries or \
+                    (self.max_bytes is not None and self._bytes > self.max_bytes):
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self._stats["evictions"] += 1
+
+    def pop(self, key: Any, default: Any = None) -> Any:
+        """Remove an entry and return its value"""
+        if self.l2 is not None:
+            self.l2.delete(self.name, str(key))
+        with self._lock:
+            if key not in self._entries:
+                return default
+            value = self._entries[key][2]
+            self._remove(key)
+            return value
+
+    def _remove(self, key: Any) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def clear(self) -> None:
+        """Drop all entries, keeping the counters"""
+        if self.l2 is not None:
+            self.l2.clear(self.name)
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __contains__(self, key: Any) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[0] >= time.time()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def items(self) -> Iterator[Tuple[Any, Any]]:
+        """Snapshot of live (key, value) pairs, without affecting recency"""
+        now = time.time()
+        with self._lock:
+            snapshot = [(key, entry[2]) for key, entry in self._entries.items() if entry[0] >= now]
+        return iter(snapshot)
+
+    def keys(self) -> Iterator[Any]:
+        return (key for key, _ in self.items())
+
+    def values(self) -> Iterator[Any]:
+        return (value for _, value in self.items())
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get size and hit/miss/eviction statistics"""
+        with self._lock:
+            stats = self._stats.copy()
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+            stats["max_entries"] = self.max_entries
+            stats["max_bytes"] = self.max_bytes
+            stats["ttl"] = self.ttl
+            stats["shared"] = self.l2 is not None
+
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups > 0 else 0
+        return stats
+
+def get_cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Statistics for every live cache, keyed by cache name"""
+    return {name: cache.get_stats() for name, cache in list(_registry.items())}
@@ -0,0 +1,305 @@
+import os
+import time
+import uuid
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+from fastapi import HTTPException
+from starlette.requests import ClientDisconnect
+
+from metadata_store import ImmediateTransaction
+
+DATA_DIR = Path("./data")
+# Parts are written here, beside the originals, so a finished upload is moved into place by a rename
+UPLOADS_DIR = DATA_DIR / "documents" / "uploads"
+UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
+UPLOAD_SESSIONS_DB = DATA_DIR / "upload_sessions.db"
+
+UPLOAD_SESSION_TTL = float(os.getenv("UPLOAD_SESSION_TTL", str(24 * 60 * 60)))  # seconds an idle upload is kept
+UPLOAD_LEASE_SECONDS = float(os.getenv("UPLOAD_LEASE_SECONDS", "60"))  # a writer not heard from for this long loses the upload
+# Progress is recorded at least this often, so a dropped connection resumes close to where it stopped
+UPLOAD_PROGRESS_BYTES = 1024 * 1024
+HASH_READ_SIZE = 1024 * 1024
+
+class UploadSessions:
+    """
+    Resumable uploads for large documents: create, then send parts at increasing offsets, then finish.
+    - Sessions live in SQLite and parts on disk, so any worker process can take the next part
+    - Each part is streamed straight into the upload's file and hashed as it arrives;
+      memory per upload stays constant whatever the file size
+    - One part is written at a time: the writer holds a lease, renewed as it makes progress
+    - Finishing marks the upload finalizing; from then on parts are refused whatever the lease
+    - If the running SHA-256 is not in this process (parts went to another worker, or a restart),
+      it is rebuilt by hashing the bytes already received
+    - Uploads left idle for UPLOAD_SESSION_TTL are removed
+    """
+
+    def __init__(self, path: Path = UPLOAD_SESSIONS_DB, uploads_dir: Path = UPLOADS_DIR):
+        self.path = Path(path)
+        self.uploads_dir = Path(uploads_dir)
+        self._local = threading.local()
+        # upload_id -> (bytes hashed, running SHA-256) for uploads whose last part came to this process
+        self._digests: Dict[str, Tuple[int, Any]] = {}
+
+        self._connection().executescript("""
+            CREATE TABLE IF NOT EXISTS uploads (
+                id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                content_type TEXT NOT NULL,
+                title TEXT,
+                source TEXT NOT NULL,
+                access_level TEXT NOT NULL,
+                size INTEGER,
+                received INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                writer TEXT,
+                lease_expires_at REAL,
+                finalizing INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS uploads_updated_at ON uploads (updated_at);
+        """)
+        self._add_finalizing_column(self._connection())
+
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread and process; SQLite connections must not cross either"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(str(self.path), timeout=10.0, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _add_finalizing_column(self, conn: sqlite3.Connection) -> None:
+        """Session stores created before finalizing was tracked lack the column; add it"""
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(uploads)")]
+        if "finalizing" in columns:
+            return
+        try:
+            conn.execute("ALTER TABLE uploads ADD COLUMN finalizing INTEGER NOT NULL DEFAULT 0")
+        except sqlite3.OperationalError as e:
+            # Another worker added it first
+            if "duplicate column" not in str(e):
+                raise
+
+    def _part_path(self, upload_id: str) -> Path:
+        return self.uploads_dir / f"{upload_id}.part"
+
+    @staticmethod
+    def _status(row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            "upload_id": row["id"],
+            "filename": row["filename"],
+            "size": row["size"],
+            "offset": row["received"],
+            "finalizing": bool(row["finalizing"]),
+            "expires_at": row["updated_at"] + UPLOAD_SESSION_TTL
+        }
+
+    def create(self, filename: str, content_type: str, title: Optional[str], source: str,
+               access_level: str, size: Optional[int] = None) -> Dict[str, Any]:
+        """Start an upload; the caller has validated its format and access level"""
+        if size is not None and size < 0:
+            raise HTTPException(status_code=400, detail="size must not be negative")
+        self.purge_expired()
+
+        upload_id = str(uuid.uuid4())
+        self._part_path(upload_id).touch()
+        now = time.time()
+        conn = self._connection()
+        conn.execute(
+            "INSERT INTO uploads (id, filename, content_type, title, source, access_level, size, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (upload_id, filename, content_type, title, source, access_level, size, now, now)
+        )
+        return self._status(conn.execute("SELECT * FROM uploads WHERE id = ?", (upload_id,)).fetchone())
+
+    def get(self, upload_id: str) -> Optional[Dict[str, Any]]:
+        """Status of an upload, including the offset the next part must start at, or None"""
+        row = self._connection().execute("SELECT * FROM uploads WHERE id = ?", (upload_id,)).fetchone()
+        return self._status(row) if row else None
+
+    def _acquire(self, upload_id: str, offset: Optional[int] = None, finalize: bool = False) -> Tuple[sqlite3.Row, str]:
+        """
+        Take the upload's write lease, checking that offset is where the last part ended.
+        With finalize the upload is marked finalizing, and no part is accepted from then on.
+        """
+        now = time.time()
+        writer = str(uuid.uuid4())
+        with ImmediateTransaction(self._connection()) as conn:
+            row = conn.execute("SELECT * FROM uploads WHERE id = ?", (upload_id,)).fetchone()
+            if row is None:
+                raise HTTPException(status_code=404, detail=f"Upload not found: {upload_id}")
+            if row["writer"] is not None and row["lease_expires_at"] > now:
+                raise HTTPException(status_code=409, detail="Another part of this upload is still being received")
+            # Only a finish left behind by a lost finisher may take over; parts could change the file being stored
+            if row["finalizing"] and not finalize:
+                raise HTTPException(status_code=409, detail="Upload is being finalized")
+            if offset is not None and offset != row["received"]:
+                raise HTTPException(
+                    status_code=409,
+                    detail={"message": f"Parts must continue at offset {row['received']}", "offset": row["received"]}
+                )
+            conn.execute(
+                "UPDATE uploads SET writer = ?, lease_expires_at = ?, updated_at = ?, finalizing = ? WHERE id = ?",
+                (writer, now + UPLOAD_LEASE_SECONDS, now, int(finalize or row["finalizing"]), upload_id)
+            )
+        return row, writer
+
+    def _save_progress(self, upload_id: str, writer: str, received: int, release: bool = False) -> bool:
+        """Record the bytes received and renew or release the lease; False if the lease was lost"""
+        now = time.time()
+        return self._connection().execute(
+            "UPDATE uploads SET received = ?, updated_at = ?, writer = ?, lease_expires_at = ? WHERE id = ? AND writer = ?",
+            (received, now, None if release else writer, None if release else now + UPLOAD_LEASE_SECONDS, upload_id, writer)
+        ).rowcount > 0
+
+    async def _digest_at(self, upload_id: str, offset: int, writer: str) -> Any:
+        """Running SHA-256 of the first offset bytes of an upload, renewing writer's lease while hashing"""
+        state = self._digests.pop(upload_id, None)
+        if state is not None and state[0] == offset:
+            return state[1]
+
+        # Earlier parts went to another worker, or this one restarted: hash what was received so far
+        def hash_prefix():
+            digest = hashlib.sha256()
+            remaining = offset
+            renew_at = time.time() + UPLOAD_LEASE_SECONDS / 2
+            with open(self._part_path(upload_id), "rb") as f:
+                while remaining > 0:
+                    # Hashing a large upload can outlast the lease
+                    if time.time() > renew_at:
+                        if not self._save_progress(upload_id, writer, offset):
+                            raise HTTPException(status_code=409, detail="Upload was taken over by another request")
+                        renew_at = time.time() + UPLOAD_LEASE_SECONDS / 2
+                    block = f.read(min(HASH_READ_SIZE, remaining))
+                    if not block:
+                        raise ValueError(f"Upload {upload_id} has fewer bytes on disk than recorded")
+                    digest.update(block)
+                    remaining -= len(block)
+            return digest
+
+        return await asyncio.get_running_loop().run_in_executor(None, hash_prefix)
+
+    async def write_part(self, upload_id: str, offset: int, stream: AsyncIterator[bytes]) -> Dict[str, Any]:
+        """
+        Append a part, streamed from the request body, at offset. If the connection drops
+        midway, the bytes that arrived are kept and the upload resumes from there.
+        Returns the upload's status with its new offset.
+        """
+        row, writer = self._acquire(upload_id, offset)
+        size = row["size"]
+        received = saved = offset
+        renew_at = time.time() + UPLOAD_LEASE_SECONDS / 2
+        owned = True
+        digest = None
+
+        try:
+            digest = await self._digest_at(upload_id, offset, writer)
+            with open(self._part_path(upload_id), "r+b") as f:
+                # Bytes past the recorded offset are from a part that was cut off before its progress was saved
+                f.seek(offset)
+                f.truncate()
+                try:
+                    async for chunk in stream:
+                        if size is not None and received + len(chunk) > size:
+                            raise HTTPException(status_code=400, detail=f"Upload is larger than its declared size of {size} bytes")
+
+                        # Renew the lease before writing once half of it has passed, so a stalled writer never overwrites a newer one
+                        if received - saved >= UPLOAD_PROGRESS_BYTES or time.time() > renew_at:
+                            f.flush()
+                            if not self._save_progress(upload_id, writer, received):
+                                owned = False
+                                raise HTTPException(status_code=409, detail="Upload was taken over by another request")
+                            saved = received
+                            renew_at = time.time() + UPLOAD_LEASE_SECONDS / 2
+
+                        f.write(chunk)
+                        digest.update(chunk)
+                        received += len(chunk)
+                except ClientDisconnect:
+                    print(f"Upload {upload_id} disconnected at offset {received}; it can resume from there")
+        finally:
+            if owned and self._save_progress(upload_id, writer, received, release=True) and digest is not None:
+                self._digests[upload_id] = (received, digest)
+
+        return self.get(upload_id)
+
+    async def finish(self, upload_id: str) -> Tuple[Dict[str, Any], Path, str, int]:
+        """
+        Close an upload once all of it has arrived: returns the session details, the path of
+        the received file, its SHA-256 and size. The caller stores the file, then calls remove,
+        or release if storing failed, with the session's writer. Until then the upload is
+        finalizing and can be neither sent parts nor removed by anyone else.
+        """
+        row, writer = self._acquire(upload_id, finalize=True)
+        try:
+            received = row["received"]
+            if row["size"] is not None and received != row["size"]:
+                raise HTTPException(
+                    status_code=409,
+                    detail={"message": f"Upload is incomplete: {received} of {row['size']} bytes received", "offset": received}
+                )
+            digest = await self._digest_at(upload_id, received, writer)
+        except Exception:
+            # Unless another finish has taken over since
+            self.release(upload_id, writer)
+            raise
+
+        session = dict(row, writer=writer)
+        return session, self._part_path(upload_id), digest.hexdigest(), received
+
+    def release(self, upload_id: str, writer: Optional[str] = None) -> None:
+        """Let parts be sent again after a failed finish; with writer, only if it still holds the lease"""
+        sql = "UPDATE uploads SET writer = NULL, lease_expires_at = NULL, finalizing = 0 WHERE id = ?"
+        if writer is None:
+            self._connection().execute(sql, (upload_id,))
+        else:
+            self._connection().execute(sql + " AND writer = ?", (upload_id, writer))
+
+    def remove(self, upload_id: str, writer: Optional[str] = None) -> bool:
+        """
+        Forget an upload and delete whatever of it is still on disk; False if there is no such upload.
+        Refused with 409 while a part is being written or the upload is finalizing,
+        unless writer is the one holding the lease.
+        """
+        with ImmediateTransaction(self._connection()) as conn:
+            row = conn.execute("SELECT * FROM uploads WHERE id = ?", (upload_id,)).fetchone()
+            if row is None:
+                return False
+            if writer is None or row["writer"] != writer:
+                if row["finalizing"]:
+                    raise HTTPException(status_code=409, detail="Upload is being finalized")
+                if row["writer"] is not None and row["lease_expires_at"] > time.time():
+                    raise HTTPException(status_code=409, detail="A part of this upload is still being received")
+            conn.execute("DELETE FROM uploads WHERE id = ?", (upload_id,))
+        self._delete_part(upload_id)
+        return True
+
+    def _delete_part(self, upload_id: str) -> None:
+        self._digests.pop(upload_id, None)
+        part_path = self._part_path(upload_id)
+        if part_path.exists():
+            os.remove(part_path)
+
+    def purge_expired(self) -> int:
+        """Remove uploads idle for longer than UPLOAD_SESSION_TTL"""
+        cutoff = time.time() - UPLOAD_SESSION_TTL
+        # Also uploads whose finisher died: nobody has held their lease for the whole TTL
+        expired = "updated_at < ? AND (writer IS NULL OR lease_expires_at < ?)"
+        rows = self._connection().execute(f"SELECT id FROM uploads WHERE {expired}", (cutoff, time.time())).fetchall()
+        purged = 0
+        for row in rows:
+            # Unless a writer came back since the lookup
+            if self._connection().execute(f"DELETE FROM uploads WHERE id = ? AND {expired}",
+                                          (row["id"], cutoff, time.time())).rowcount > 0:
+                self._delete_part(row["id"])
+                purged += 1
+        return purged